@@ -89,6 +89,16 @@ DATABASES = {
     }
 }
 
+# Local runs and benchmarks can use a SQLite file instead of PostgreSQL
+
+if os.environ.get("SQLITE_DATABASE"):
+    DATABASES = {
+        "default": {
+            "ENGINE": "django.db.backends.sqlite3",
+            "NAME": os.environ["SQLITE_DATABASE"],
+        }
+    }
+
 
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
@@ -138,3 +148,92 @@ MEDIA_ROOT = os.path.join(BASE_DIR, "media")
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# Data import
+# Rows per bulk_create/bulk_update/delete statement issued by the importer
+
+IMPORT_BATCH_SIZE = 1000
+
+# Worker processes that parse and validate workbook sheets in parallel; 1 keeps
+# parsing in the importing process. Workers are forked, so platforms without
+# fork, and imports run inside a caller's transaction, always parse in-process.
+
+IMPORT_WORKERS = int(os.environ.get("IMPORT_WORKERS", 1))
+
+# Scope in which question text must be unique when matching uploaded rows:
+# "global" (a question can move between categories) or "category"
+
+QUESTION_KEY_SCOPE = "global"
+
+# New questions at least this similar (estimated Jaccard over text shingles and
+# the correct answer) to a stored or uploaded question are flagged as possible
+# duplicates; None turns the check off
+
+NEAR_DUPLICATE_THRESHOLD = 0.7
+
+# Google Sheets
+# Override the API endpoints, e.g. to point imports at a local fake server, and
+# the client class used to read spreadsheets and their revision metadata
+
+GOOGLE_SHEETS_API_ENDPOINT = os.environ.get("GOOGLE_SHEETS_API_ENDPOINT")
+GOOGLE_DRIVE_API_ENDPOINT = os.environ.get("GOOGLE_DRIVE_API_ENDPOINT")
+GOOGLE_SHEETS_CLIENT = "tool.utils.GoogleSheetsClient"
+
+# Questions committed per transaction when an import is run in resumable,
+# chunked-commit mode
+
+IMPORT_COMMIT_CHUNK_SIZE = 5000
+
+# Admin
+# Changelists over tables at least this large show the PostgreSQL planner's row
+# estimate instead of running COUNT(*)
+
+ADMIN_ESTIMATED_COUNT_THRESHOLD = 100000
+
+# Read API
+# Bearer token required by /api/questions/; unset leaves the API open
+
+QUESTIONS_API_TOKEN = os.environ.get("QUESTIONS_API_TOKEN")
+
+# Largest "count" accepted by /api/questions/random/
+
+MAX_SAMPLE_SIZE = 100
+
+# Question snapshot
+# Memory-mapped file game servers load the bank from; rebuilt after every import
+# that is not a dry run. Unset to stop building it.
+
+QUESTION_SNAPSHOT_PATH = os.environ.get(
+    "QUESTION_SNAPSHOT_PATH", os.path.join(BASE_DIR, "snapshots", "questions.snapshot")
+)
+
+# Import logs
+# Each import run writes its own file in IMPORT_LOG_DIR, buffering up to
+# IMPORT_LOG_BUFFER_SIZE lines per write and rotating past IMPORT_LOG_MAX_BYTES.
+# Files older than IMPORT_LOG_RETENTION_DAYS are removed after each run.
+
+IMPORT_LOG_DIR = os.environ.get("IMPORT_LOG_DIR", "logs")
+IMPORT_LOG_BUFFER_SIZE = 500
+IMPORT_LOG_MAX_BYTES = 50 * 1024 * 1024
+IMPORT_LOG_BACKUP_COUNT = 5
+IMPORT_LOG_RETENTION_DAYS = 30
+
+# "auto" reconciles imports inside PostgreSQL through a COPY staging table;
+# "python" diffs them in Python through the ORM, as on SQLite
+
+IMPORT_BACKEND = "auto"
+
+# Copy questions removed by an import (with their options) into the archive
+# tables, from where they can be restored in the admin without re-importing
+
+IMPORT_ARCHIVE_DELETED = False
+
+# Seconds without a progress report before a running import job counts as
+# abandoned and may be resumed from the admin
+
+IMPORT_JOB_STALE_AFTER = 3600
+
+# Uploaded workbooks are removed once their job succeeds; those of failed jobs
+# are kept this many days so the job can be resumed
+
+IMPORT_UPLOAD_RETENTION_DAYS = 30
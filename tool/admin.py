@@ -1,12 +1,93 @@
 from django.contrib import admin
-from django.http import HttpResponseRedirect
-from django.urls import path
-from django.shortcuts import render
+from django.http import (
+    FileResponse,
+    HttpResponseRedirect,
+    JsonResponse,
+    StreamingHttpResponse,
+)
+from django.urls import path, reverse
+from django.shortcuts import get_object_or_404, render
 from django.contrib import messages
-from .models import Category, Question, Option, ProductType, ProductTypeEnum
-from .utils import read_google_sheet, setup_data_import_logger
-import pandas as pd
-import logging
+from django.core.paginator import Paginator
+from .models import (
+    ArchivedOption,
+    ArchivedQuestion,
+    BankVersion,
+    Category,
+    ImportJob,
+    ImportPlan,
+    ImportPlanEntry,
+    ImportRun,
+    Question,
+    Option,
+    ProductType,
+)
+from .archive import restore_questions
+from .dedupe import index_question_ids
+from .export import EXPORT_FORMATS, iter_csv, iter_jsonl, write_xlsx
+from .importer import clear_sheet_fingerprints
+from .pagination import EstimatedCountPaginator
+from .sampling import touch_question_buckets
+from .search import search_options, search_questions
+from .jobs import (
+    enqueue_excel_import,
+    enqueue_plan_apply,
+    enqueue_sheets_import,
+    resume_job,
+)
+import tempfile
+
+PLAN_PREVIEW_PAGE_SIZE = 100
+
+
+def export_response(queryset, export_format):
+    content_type, extension = EXPORT_FORMATS[export_format]
+    filename = f"questions.{extension}"
+    if export_format == "xlsx":
+        # A workbook is a zip that is only complete once saved, so it is built
+        # in a temporary file and streamed from there
+        output = tempfile.TemporaryFile()
+        write_xlsx(output, queryset)
+        output.seek(0)
+        return FileResponse(
+            output, as_attachment=True, filename=filename, content_type=content_type
+        )
+
+    chunks = iter_csv(queryset) if export_format == "csv" else iter_jsonl(queryset)
+    response = StreamingHttpResponse(chunks, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return response
+
+
+def import_job_progress_url(job):
+    return reverse("admin:tool_importjob_progress", args=[job.import_job_id])
+
+
+def import_plan_preview_url(plan):
+    return reverse("admin:tool_importplan_preview", args=[plan.import_plan_id])
+
+
+def questions_edited():
+    # Manual edits make stored sheet fingerprints stale, so the next import
+    # re-checks every sheet instead of skipping it, and change the bank version
+    # that API responses and import previews are validated against
+    clear_sheet_fingerprints()
+    BankVersion.bump()
+
+
+class ClearSheetFingerprintsMixin:
+    # Called once per admin save, after save_model and any inline formsets
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        questions_edited()
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        questions_edited()
+
+    def delete_queryset(self, request, queryset):
+        super().delete_queryset(request, queryset)
+        questions_edited()
 
 
 class OptionInline(admin.TabularInline):
@@ -16,7 +97,7 @@ class OptionInline(admin.TabularInline):
 
 
 @admin.register(Question)
-class QuestionAdmin(admin.ModelAdmin):
+class QuestionAdmin(ClearSheetFingerprintsMixin, admin.ModelAdmin):
     list_display = (
         "question_text",
         "category",
@@ -25,9 +106,55 @@ class QuestionAdmin(admin.ModelAdmin):
         "product_type",
     )
     list_filter = ("category", "is_product_question", "product_type")
+    list_select_related = ("category", "product_type")
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ("question_text",)
     inlines = [OptionInline]
     readonly_fields = ("question_id",)
+    actions = ["export_xlsx", "export_csv", "export_jsonl"]
+
+    @admin.action(description="Export selected questions as Excel (import layout)")
+    def export_xlsx(self, request, queryset):
+        return export_response(queryset, "xlsx")
+
+    @admin.action(description="Export selected questions as CSV")
+    def export_csv(self, request, queryset):
+        return export_response(queryset, "csv")
+
+    @admin.action(description="Export selected questions as JSON lines")
+    def export_jsonl(self, request, queryset):
+        return export_response(queryset, "jsonl")
+
+    def save_model(self, request, obj, form, change):
+        # Both the sampling bucket the question left and the one it joined
+        buckets = {(obj.category_id, obj.product_type_id)}
+        if change:
+            buckets.add(
+                (form.initial.get("category"), form.initial.get("product_type"))
+            )
+        super().save_model(request, obj, form, change)
+        touch_question_buckets(buckets)
+
+    def delete_model(self, request, obj):
+        super().delete_model(request, obj)
+        touch_question_buckets([(obj.category_id, obj.product_type_id)])
+
+    def delete_queryset(self, request, queryset):
+        buckets = set(queryset.values_list("category_id", "product_type_id").distinct())
+        super().delete_queryset(request, queryset)
+        touch_question_buckets(buckets)
+
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        # After the inline options, so the correct answer is current
+        index_question_ids([form.instance.question_id])
+
+    def get_search_results(self, request, queryset, search_term):
+        results = search_questions(queryset, search_term)
+        if results is None:
+            return super().get_search_results(request, queryset, search_term)
+        return results, False
 
 
 @admin.register(Category)
@@ -45,255 +172,23 @@ class CategoryAdmin(admin.ModelAdmin):
         ]
         return custom_urls + urls
 
-    def process_data(self, request, data_dict):
-        logger, log_file = setup_data_import_logger()
-        logger.info("Starting data import process")
-
-        try:
-            category_id_mapping = Category.get_category_id_mapping()
-
-            for name, category_id in category_id_mapping.items():
-                Category.objects.get_or_create(category_id=category_id, name=name)
-
-            excel_questions = set()
-            for sheet_name, df in data_dict.items():
-                for index, row in df.iterrows():
-                    if not (pd.isna(row[0]) or str(row[0]).strip() == ""):
-                        question_text = str(row[0]).strip()
-                        excel_questions.add(question_text)
-
-            existing_questions = {}
-            for category in Category.objects.all():
-                questions = Question.objects.filter(category=category).prefetch_related(
-                    "option_set"
-                )
-                for question in questions:
-                    key = question.question_text.strip()
-                    options = list(question.option_set.all())
-                    options_data = {
-                        "correct": next(
-                            (opt.option_text for opt in options if opt.is_correct), None
-                        ),
-                        "incorrect": [
-                            opt.option_text for opt in options if not opt.is_correct
-                        ],
-                    }
-                    existing_questions[key] = {
-                        "question": question,
-                        "options": options_data,
-                        "found_in_excel": key in excel_questions,
-                    }
-
-            questions_to_create = []
-            questions_to_update = []
-
-            for sheet_name, df in data_dict.items():
-                logger.info(f"Processing sheet: {sheet_name}")
-
-                category_id = next(
-                    (
-                        id
-                        for name, id in category_id_mapping.items()
-                        if name.lower() == sheet_name.lower()
-                    ),
-                    None,
-                )
-
-                if category_id is None:
-                    logger.error(
-                        f"Invalid sheet name: {sheet_name}. Must be one of {list(category_id_mapping.keys())}"
-                    )
-                    continue
-
-                category = Category.objects.get(category_id=category_id)
-
-                for index, row in df.iterrows():
-                    row_num = index + 2
-                    try:
-                        if pd.isna(row[0]) or str(row[0]).strip() == "":
-                            logger.error(
-                                f"Sheet: {sheet_name}, Row: {row_num} - Question text is empty"
-                            )
-                            continue
-
-                        if pd.isna(row[1]) or str(row[1]).strip() == "":
-                            logger.error(
-                                f"Sheet: {sheet_name}, Row: {row_num} - Correct answer is empty"
-                            )
-                            continue
-
-                        question_text = str(row[0]).strip()
-                        key = question_text
-
-                        product_value = (
-                            row.get("Product", "").strip().upper()
-                            if pd.notna(row.get("Product", ""))
-                            else ""
-                        )
-                        is_product = product_value in ["AMAZON", "GOOGLE"]
-                        product_type = None
-
-                        if is_product:
-                            product_type, _ = ProductType.objects.get_or_create(
-                                name=product_value, defaults={"is_active": True}
-                            )
-                            logger.info(
-                                f"Sheet: {sheet_name}, Row: {row_num} - Valid product type: {product_value}"
-                            )
-                        else:
-                            if product_value:
-                                logger.warning(
-                                    f"Sheet: {sheet_name}, Row: {row_num} - Invalid or unsupported product type: {product_value}. "
-                                    f"Only AMAZON and GOOGLE are supported."
-                                )
-                                self.message_user(
-                                    request,
-                                    f"Warning: Invalid or unsupported product type '{product_value}' found in sheet '{sheet_name}', row {row_num}. "
-                                    f"Only AMAZON and GOOGLE are supported. Treating as non-product question.",
-                                    level="WARNING",
-                                )
-
-                        new_options = {
-                            "correct": str(row[1]).strip(),
-                            "incorrect": [
-                                str(row[i]).strip()
-                                for i in range(2, 5)
-                                if pd.notna(row[i]) and str(row[i]).strip()
-                            ],
-                        }
-
-                        if key in existing_questions:
-                            existing_data = existing_questions[key]
-                            existing_question = existing_data["question"]
-                            existing_options = existing_data["options"]
-
-                            # Only update if it's in a different category or has changes
-                            if (
-                                existing_question.category_id != category_id
-                                or existing_question.is_product_question != is_product
-                                or existing_question.product_type != product_type
-                                or existing_options["correct"] != new_options["correct"]
-                                or set(existing_options["incorrect"])
-                                != set(new_options["incorrect"])
-                            ):
-                                questions_to_update.append(
-                                    {
-                                        "question": existing_question,
-                                        "category": category,
-                                        "is_product_question": is_product,
-                                        "product_type": product_type,
-                                        "options": new_options,
-                                        "time_limit": 60 if is_product else 15,
-                                        "hint": "Hint Text" if is_product else None,
-                                    }
-                                )
-                                logger.info(
-                                    f"Sheet: {sheet_name}, Row: {row_num} - Question will be updated: {existing_question.question_id}"
-                                )
-                        else:
-                            questions_to_create.append(
-                                {
-                                    "category": category,
-                                    "question_text": question_text,
-                                    "is_product_question": is_product,
-                                    "product_type": product_type,
-                                    "time_limit": 60 if is_product else 15,
-                                    "hint": "Hint Text" if is_product else None,
-                                    "options": new_options,
-                                }
-                            )
-                            logger.info(
-                                f"Sheet: {sheet_name}, Row: {row_num} - New question will be created"
-                            )
-
-                    except Exception as row_error:
-                        error_msg = f"Error processing row {row_num} in sheet '{sheet_name}': {str(row_error)}"
-                        logger.error(error_msg)
-                        self.message_user(request, error_msg, level="ERROR")
-                        continue
-
-            from django.db import transaction
-
-            with transaction.atomic():
-                # Only delete questions that don't exist in any sheet
-                questions_to_delete = [
-                    data["question"]
-                    for data in existing_questions.values()
-                    if not data["found_in_excel"]
-                ]
-
-                for question_data in questions_to_create:
-                    options = question_data.pop("options")
-                    question = Question.objects.create(**question_data)
-                    Option.objects.create(
-                        question=question,
-                        option_text=options["correct"],
-                        is_correct=True,
-                    )
-                    for incorrect_option in options["incorrect"]:
-                        Option.objects.create(
-                            question=question,
-                            option_text=incorrect_option,
-                            is_correct=False,
-                        )
-                    logger.info(f"Created new question: {question.question_id}")
-
-                for update_data in questions_to_update:
-                    question = update_data["question"]
-                    options = update_data.pop("options")
-                    for field, value in update_data.items():
-                        setattr(question, field, value)
-                    question.save()
-
-                    question.option_set.all().delete()
-                    Option.objects.create(
-                        question=question,
-                        option_text=options["correct"],
-                        is_correct=True,
-                    )
-                    for incorrect_option in options["incorrect"]:
-                        Option.objects.create(
-                            question=question,
-                            option_text=incorrect_option,
-                            is_correct=False,
-                        )
-                    logger.info(f"Updated question: {question.question_id}")
-
-                for question in questions_to_delete:
-                    question_id = question.question_id
-                    question.delete()
-                    logger.info(f"Deleted question: {question_id}")
-
-                logger.info(
-                    f"Summary: Created {len(questions_to_create)} questions, Updated {len(questions_to_update)} questions, Deleted {len(questions_to_delete)} questions"
-                )
-
-            success_msg = f"Data processed successfully. Check the log file for details: {log_file}"
-            logger.info("Data import completed successfully")
-            self.message_user(request, success_msg)
-
-        except Exception as e:
-            error_msg = f"Error processing data: {str(e)}"
-            logger.error(error_msg)
-            self.message_user(request, error_msg, level="ERROR")
-
     def upload_excel(self, request):
         if request.method == "POST" and request.FILES.get("excel_file"):
             excel_file = request.FILES["excel_file"]
             try:
-                xls = pd.ExcelFile(excel_file)
-                data_dict = {}
-                for sheet_name in xls.sheet_names:
-                    df = pd.read_excel(excel_file, sheet_name=sheet_name)
-                    data_dict[sheet_name] = df
-
-                self.process_data(request, data_dict)
+                job = enqueue_excel_import(
+                    excel_file,
+                    force=bool(request.POST.get("force")),
+                    chunked=bool(request.POST.get("chunked")),
+                    dry_run=bool(request.POST.get("dry_run")),
+                )
             except Exception as e:
                 self.message_user(
                     request, f"Error processing Excel file: {str(e)}", level="ERROR"
                 )
+                return HttpResponseRedirect("../")
 
-            return HttpResponseRedirect("../")
+            return HttpResponseRedirect(import_job_progress_url(job))
 
         return render(request, "admin/category/upload.html")
 
@@ -301,27 +196,45 @@ class CategoryAdmin(admin.ModelAdmin):
         if request.method == "POST" and request.POST.get("sheet_url"):
             sheet_url = request.POST["sheet_url"]
             try:
-                data_dict = read_google_sheet(sheet_url)
-                self.process_data(request, data_dict)
+                job = enqueue_sheets_import(
+                    sheet_url,
+                    force=bool(request.POST.get("force")),
+                    chunked=bool(request.POST.get("chunked")),
+                    dry_run=bool(request.POST.get("dry_run")),
+                )
             except Exception as e:
                 self.message_user(
                     request,
                     f"Error importing from Google Sheets: {str(e)}",
                     level="ERROR",
                 )
+                return HttpResponseRedirect("../")
 
-            return HttpResponseRedirect("../")
+            return HttpResponseRedirect(import_job_progress_url(job))
 
         return HttpResponseRedirect("../")
 
 
 @admin.register(Option)
-class OptionAdmin(admin.ModelAdmin):
+class OptionAdmin(ClearSheetFingerprintsMixin, admin.ModelAdmin):
     list_display = ("option_text", "question", "is_correct")
     list_filter = ("is_correct", "question__category")
+    list_select_related = ("question",)
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     search_fields = ("option_text", "question__question_text")
     readonly_fields = ("option_id",)
 
+    def save_model(self, request, obj, form, change):
+        super().save_model(request, obj, form, change)
+        index_question_ids([obj.question_id])
+
+    def get_search_results(self, request, queryset, search_term):
+        results = search_options(queryset, search_term)
+        if results is None:
+            return super().get_search_results(request, queryset, search_term)
+        return results, False
+
 
 @admin.register(ProductType)
 class ProductTypeAdmin(admin.ModelAdmin):
@@ -329,3 +242,235 @@ class ProductTypeAdmin(admin.ModelAdmin):
     list_filter = ("is_active",)
     search_fields = ("name",)
     readonly_fields = ("product_type_id",)
+
+
+@admin.register(ImportJob)
+class ImportJobAdmin(admin.ModelAdmin):
+    list_display = (
+        "import_job_id",
+        "source",
+        "status",
+        "phase",
+        "rows_processed",
+        "created_count",
+        "updated_count",
+        "deleted_count",
+        "chunks_committed",
+        "dry_run",
+        "created_at",
+        "finished_at",
+    )
+    list_filter = ("status", "source", "dry_run")
+    readonly_fields = [field.name for field in ImportJob._meta.fields]
+    actions = ["resume_jobs"]
+
+    @admin.action(description="Resume selected failed or stalled imports")
+    def resume_jobs(self, request, queryset):
+        resumed = sum(resume_job(job) for job in queryset)
+        self.message_user(request, f"Re-queued {resumed} import job(s).")
+        if resumed < len(queryset):
+            self.message_user(
+                request,
+                f"Skipped {len(queryset) - resumed} job(s) that succeeded, are "
+                f"queued, or are still running.",
+                messages.WARNING,
+            )
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "<int:job_id>/progress/",
+                self.admin_site.admin_view(self.progress_view),
+                name="tool_importjob_progress",
+            ),
+            path(
+                "<int:job_id>/status/",
+                self.admin_site.admin_view(self.status_view),
+                name="tool_importjob_status",
+            ),
+        ]
+        return custom_urls + urls
+
+    def progress_view(self, request, job_id):
+        job = get_object_or_404(ImportJob, import_job_id=job_id)
+        context = {
+            **self.admin_site.each_context(request),
+            "job": job,
+            "status_url": reverse("admin:tool_importjob_status", args=[job_id]),
+            "plan_url": import_plan_preview_url(job.plan) if job.plan else "",
+        }
+        return render(request, "admin/importjob/progress.html", context)
+
+    def status_view(self, request, job_id):
+        job = get_object_or_404(ImportJob, import_job_id=job_id)
+        return JsonResponse(
+            {
+                "status": job.status,
+                "status_display": job.get_status_display(),
+                "phase_display": job.get_phase_display(),
+                "finished": job.is_finished,
+                "rows_processed": job.rows_processed,
+                "rows_total": job.rows_total,
+                "created": job.created_count,
+                "updated": job.updated_count,
+                "deleted": job.deleted_count,
+                "chunks_committed": job.chunks_committed,
+                "has_plan": job.plan_id is not None,
+                "log_file": job.log_file,
+                "messages": job.messages,
+                "error": job.error,
+            }
+        )
+
+
+@admin.register(ImportRun)
+class ImportRunAdmin(admin.ModelAdmin):
+    list_display = (
+        "import_run_id",
+        "import_job",
+        "status",
+        "dry_run",
+        "created_count",
+        "updated_count",
+        "deleted_count",
+        "warning_count",
+        "error_count",
+        "started_at",
+        "finished_at",
+        "log_file",
+    )
+    list_filter = ("status", "dry_run")
+    list_select_related = ("import_job",)
+    readonly_fields = [field.name for field in ImportRun._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ArchivedQuestion)
+class ArchivedQuestionAdmin(admin.ModelAdmin):
+    list_display = ("question_id", "question_text", "category_id", "archived_at")
+    list_filter = ("category_id", "is_product_question")
+    search_fields = ("question_text",)
+    readonly_fields = [field.name for field in ArchivedQuestion._meta.fields]
+    actions = ["restore_selected"]
+
+    # Sheet fingerprints are kept: a restored question stays until its sheet
+    # changes, like any question the current sheets don't contain
+    @admin.action(description="Restore selected questions")
+    def restore_selected(self, request, queryset):
+        restored, skipped = restore_questions(
+            queryset.values_list("question_id", flat=True)
+        )
+        self.message_user(request, f"Restored {restored} question(s).")
+        if skipped:
+            self.message_user(
+                request,
+                f"Skipped {skipped} question(s) whose category no longer exists "
+                f"or whose text is in the bank again.",
+                messages.WARNING,
+            )
+
+    def delete_model(self, request, obj):
+        ArchivedOption.objects.filter(question_id=obj.question_id).delete()
+        super().delete_model(request, obj)
+
+    def delete_queryset(self, request, queryset):
+        ArchivedOption.objects.filter(
+            question_id__in=queryset.values("question_id")
+        ).delete()
+        super().delete_queryset(request, queryset)
+
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(ImportPlan)
+class ImportPlanAdmin(admin.ModelAdmin):
+    list_display = (
+        "import_plan_id",
+        "source",
+        "status",
+        "create_count",
+        "update_count",
+        "delete_count",
+        "created_at",
+        "applied_at",
+    )
+    list_filter = ("status", "source")
+    readonly_fields = [field.name for field in ImportPlan._meta.fields]
+
+    def has_add_permission(self, request):
+        return False
+
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path(
+                "<int:plan_id>/preview/",
+                self.admin_site.admin_view(self.preview_view),
+                name="tool_importplan_preview",
+            ),
+            path(
+                "<int:plan_id>/apply/",
+                self.admin_site.admin_view(self.apply_view),
+                name="tool_importplan_apply",
+            ),
+        ]
+        return custom_urls + urls
+
+    def preview_view(self, request, plan_id):
+        plan = get_object_or_404(ImportPlan, import_plan_id=plan_id)
+        counts = {
+            ImportPlanEntry.Action.CREATE: plan.create_count,
+            ImportPlanEntry.Action.UPDATE: plan.update_count,
+            ImportPlanEntry.Action.DELETE: plan.delete_count,
+        }
+        action = request.GET.get("action")
+        if action not in counts:
+            action = ImportPlanEntry.Action.CREATE
+
+        # The stored counts stand in for COUNT(*), so a page is a single
+        # index range scan however large the plan is
+        paginator = Paginator(
+            plan.entries.filter(action=action).order_by("import_plan_entry_id"),
+            PLAN_PREVIEW_PAGE_SIZE,
+        )
+        paginator.count = counts[action]
+        page = paginator.get_page(request.GET.get("page"))
+
+        context = {
+            **self.admin_site.each_context(request),
+            "plan": plan,
+            "is_stale": plan.status == ImportPlan.Status.PENDING and plan.is_stale,
+            "tabs": [
+                (choice, label, counts[choice])
+                for choice, label in ImportPlanEntry.Action.choices
+            ],
+            "action": action,
+            "page": page,
+            "apply_url": reverse("admin:tool_importplan_apply", args=[plan_id]),
+        }
+        return render(request, "admin/importplan/preview.html", context)
+
+    def apply_view(self, request, plan_id):
+        plan = get_object_or_404(ImportPlan, import_plan_id=plan_id)
+        if request.method != "POST":
+            return HttpResponseRedirect(import_plan_preview_url(plan))
+        if plan.status != ImportPlan.Status.PENDING:
+            self.message_user(request, f"{plan} has already been applied.", "ERROR")
+            return HttpResponseRedirect(import_plan_preview_url(plan))
+        if plan.is_stale:
+            self.message_user(
+                request,
+                f"{plan} is out of date. Run the preview again before applying.",
+                "ERROR",
+            )
+            return HttpResponseRedirect(import_plan_preview_url(plan))
+
+        job = enqueue_plan_apply(plan)
+        return HttpResponseRedirect(import_job_progress_url(job))
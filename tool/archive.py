@@ -0,0 +1,158 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+from .dedupe import index_question_ids
+from .models import (
+    ArchivedOption,
+    ArchivedQuestion,
+    Category,
+    Option,
+    ProductType,
+    Question,
+    QuestionSignature,
+    QuestionSignatureBand,
+)
+import logging
+
+logger = logging.getLogger(__name__)
+
+QUESTION_COLUMNS = [
+    "question_id",
+    "category_id",
+    "question_text",
+    "time_limit",
+    "is_product_question",
+    "product_type_id",
+    "hint",
+    "text_hash",
+]
+OPTION_COLUMNS = ["option_id", "question_id", "option_text", "is_correct"]
+
+# Deleted before the questions: Django only cascades in Python, and these
+# statements bypass it
+DEPENDENT_MODELS = [QuestionSignatureBand, QuestionSignature, Option]
+
+
+def get_archive_deleted():
+    return getattr(settings, "IMPORT_ARCHIVE_DELETED", False)
+
+
+def table(model):
+    return connection.ops.quote_name(model._meta.db_table)
+
+
+def columns(names):
+    return ", ".join(connection.ops.quote_name(name) for name in names)
+
+
+def id_placeholders(question_ids):
+    return ", ".join(["%s"] * len(question_ids))
+
+
+def remove_questions(cursor, id_source, params=(), archive=False):
+    # Deletes the questions whose IDs id_source (SQL) selects, with their
+    # options and dedupe index entries, in a few set-based statements. With
+    # archive they are copied to the archive tables first.
+    if archive:
+        # An earlier archive of a restored question is replaced
+        for model in [ArchivedOption, ArchivedQuestion]:
+            cursor.execute(
+                f"DELETE FROM {table(model)} WHERE question_id IN ({id_source})",
+                params,
+            )
+        cursor.execute(
+            f"INSERT INTO {table(ArchivedQuestion)} "
+            f"({columns(QUESTION_COLUMNS + ['archived_at'])}) "
+            f"SELECT {columns(QUESTION_COLUMNS)}, %s FROM {table(Question)} "
+            f"WHERE question_id IN ({id_source})",
+            [timezone.now(), *params],
+        )
+        cursor.execute(
+            f"INSERT INTO {table(ArchivedOption)} ({columns(OPTION_COLUMNS)}) "
+            f"SELECT {columns(OPTION_COLUMNS)} FROM {table(Option)} "
+            f"WHERE question_id IN ({id_source})",
+            params,
+        )
+
+    for model in DEPENDENT_MODELS:
+        cursor.execute(
+            f"DELETE FROM {table(model)} WHERE question_id IN ({id_source})", params
+        )
+    cursor.execute(
+        f"DELETE FROM {table(Question)} WHERE question_id IN ({id_source})", params
+    )
+    return cursor.rowcount
+
+
+def restore_questions(question_ids, batch_size=1000):
+    # Moves archived questions back into the bank under their original IDs.
+    # Questions whose category is gone, or whose text is in the bank again,
+    # are left in the archive. Returns (restored, skipped).
+    from .importer import bank_changed, chunked, get_key_scope, question_key
+
+    scope = get_key_scope()
+    category_ids = set(Category.objects.values_list("category_id", flat=True))
+    product_type_ids = set(
+        ProductType.objects.values_list("product_type_id", flat=True)
+    )
+    restored = skipped = 0
+
+    for batch in chunked(list(question_ids), batch_size):
+        archived = list(
+            ArchivedQuestion.objects.filter(question_id__in=batch).values_list(
+                "question_id", "category_id", "product_type_id", "text_hash"
+            )
+        )
+        present = {
+            question_key(category_id, text_hash, scope)
+            for category_id, text_hash in Question.objects.filter(
+                text_hash__in=[row[3] for row in archived]
+            ).values_list("category_id", "text_hash")
+        }
+        ids = [
+            question_id
+            for question_id, category_id, _, text_hash in archived
+            if category_id in category_ids
+            and question_key(category_id, text_hash, scope) not in present
+        ]
+        skipped += len(batch) - len(ids)
+        if not ids:
+            continue
+
+        placeholders = id_placeholders(ids)
+        with transaction.atomic(), connection.cursor() as cursor:
+            cursor.execute(
+                f"INSERT INTO {table(Question)} ({columns(QUESTION_COLUMNS)}) "
+                f"SELECT {columns(QUESTION_COLUMNS)} FROM {table(ArchivedQuestion)} "
+                f"WHERE question_id IN ({placeholders})",
+                ids,
+            )
+            cursor.execute(
+                f"INSERT INTO {table(Option)} ({columns(OPTION_COLUMNS)}) "
+                f"SELECT {columns(OPTION_COLUMNS)} FROM {table(ArchivedOption)} "
+                f"WHERE question_id IN ({placeholders})",
+                ids,
+            )
+            # Product types deleted since the archive leave plain questions
+            Question.objects.filter(question_id__in=ids).exclude(
+                product_type_id__in=product_type_ids
+            ).exclude(product_type__isnull=True).update(
+                product_type=None, is_product_question=False
+            )
+            for model in [ArchivedOption, ArchivedQuestion]:
+                cursor.execute(
+                    f"DELETE FROM {table(model)} WHERE question_id IN ({placeholders})",
+                    ids,
+                )
+            index_question_ids(ids, batch_size)
+            bank_changed(
+                set(
+                    Question.objects.filter(question_id__in=ids)
+                    .values_list("category_id", "product_type_id")
+                    .distinct()
+                )
+            )
+        restored += len(ids)
+        logger.info(f"Restored {len(ids)} archived questions")
+
+    return restored, skipped
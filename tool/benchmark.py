@@ -0,0 +1,200 @@
+from django.db import connection
+from django.utils import timezone
+from .importer import PRODUCT_TYPES, get_import_workers, process_data
+from .models import Category
+from .reference import reset_reference_cache
+from .utils import excel_sheet_loaders, iter_excel_sheets
+from contextlib import contextmanager
+from openpyxl import Workbook
+import json
+import os
+import random
+
+BASELINE_FORMAT_VERSION = 1
+
+WORKBOOK_COLUMNS = [
+    "Question",
+    "Correct",
+    "Incorrect1",
+    "Incorrect2",
+    "Incorrect3",
+    "Product",
+]
+
+WORDS = (
+    "which what when where who first largest famous classic released known "
+    "original popular century record team player city country device game "
+    "series album film brand model console league festival island river "
+    "mountain capital award character company language world championship "
+    "smartphone platform stadium airport museum song season title version"
+).split()
+
+# Metrics compared against the baseline, per phase and for the whole import
+COMPARED_METRICS = ["wall", "queries"]
+# RSS growth below this is noise from the allocator, not a regression
+MIN_RSS_GROWTH = 16 * 1024 * 1024
+
+
+def question_row(seed, category, number, product_ratio, variant=0):
+    # The same (seed, category, number) always gives the same question, so two
+    # workbooks generated from one seed overlap where their numbers do
+    rng = random.Random(f"{seed}-{category}-{number}")
+    words = rng.choices(WORDS, k=rng.randint(6, 18))
+    answers = [
+        f"{' '.join(rng.choices(WORDS, k=rng.randint(1, 4)))} {number}-{choice}"
+        for choice in range(4)
+    ]
+    if variant:
+        # An edited correct answer makes the question an update
+        answers[0] = f"{answers[0]} (rev {variant})"
+    product = rng.choice(PRODUCT_TYPES) if rng.random() < product_ratio else None
+    return [f"{category} #{number}: {' '.join(words)}?", *answers, product]
+
+
+def generate_workbook(
+    path,
+    rows,
+    seed=0,
+    product_ratio=0.2,
+    duplicate_ratio=0.0,
+    update_ratio=0.0,
+    delete_ratio=0.0,
+    new_ratio=0.0,
+    revision=0,
+):
+    # Writes rows questions split over the category tabs the importer knows, in
+    # the upload layout. The ratios turn it into a later revision of the same
+    # bank: some rows dropped (deletes), some answers edited (updates), rows
+    # added past the original numbers (creates) and rows repeated (skipped as
+    # duplicates within the sheet).
+    categories = list(Category.get_category_id_mapping())
+    rng = random.Random(f"{seed}-mix-{revision}")
+    per_category = max(rows // len(categories), 1)
+    added = int(per_category * new_ratio)
+
+    workbook = Workbook(write_only=True)
+    written = 0
+    for category in categories:
+        worksheet = workbook.create_sheet(title=category)
+        worksheet.append(WORKBOOK_COLUMNS)
+        kept = []
+        for number in range(per_category + added):
+            if number < per_category and rng.random() < delete_ratio:
+                continue
+            variant = revision if rng.random() < update_ratio else 0
+            row = question_row(seed, category, number, product_ratio, variant)
+            worksheet.append(row)
+            kept.append(row)
+            written += 1
+        for row in rng.sample(kept, int(len(kept) * duplicate_ratio)):
+            worksheet.append(row)
+            written += 1
+    workbook.save(path)
+    return written
+
+
+@contextmanager
+def throwaway_database(temp_dir):
+    # Benchmarks run against an empty, freshly migrated test database and never
+    # touch the configured one
+    test_settings = connection.settings_dict["TEST"]
+    if connection.vendor == "sqlite" and not test_settings.get("NAME"):
+        # The default in-memory test database would hide disk writes
+        test_settings["NAME"] = os.path.join(temp_dir, "bench.sqlite3")
+    old_name = connection.creation.create_test_db(
+        verbosity=0, autoclobber=True, serialize=False
+    )
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+
+
+def run_import(path, force=False, commit_chunk_size=None):
+    # Same entry points as an Excel upload job
+    reset_reference_cache()
+    if get_import_workers() > 1:
+        result = process_data(
+            excel_sheet_loaders(path), force=force, commit_chunk_size=commit_chunk_size
+        )
+    else:
+        with open(path, "rb") as excel_file:
+            result = process_data(
+                iter_excel_sheets(excel_file),
+                force=force,
+                commit_chunk_size=commit_chunk_size,
+            )
+    return result["metrics"]
+
+
+def baseline_key(rows):
+    return f"{connection.vendor}-{rows}"
+
+
+def load_baseline(path):
+    if not os.path.exists(path):
+        return {"format": BASELINE_FORMAT_VERSION, "runs": {}}
+    with open(path, encoding="utf-8") as baseline_file:
+        return json.load(baseline_file)
+
+
+def save_baseline(path, rows, options, scenarios):
+    baseline = load_baseline(path)
+    baseline["runs"][baseline_key(rows)] = {
+        "recorded_at": timezone.now().isoformat(),
+        "options": options,
+        "scenarios": scenarios,
+    }
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as baseline_file:
+        json.dump(baseline, baseline_file, indent=2, sort_keys=True)
+
+
+def peak_rise(metrics):
+    if metrics.get("rss_peak") is None or metrics.get("rss_start") is None:
+        return None
+    return metrics["rss_peak"] - metrics["rss_start"]
+
+
+def find_regressions(scenarios, baseline_run, tolerance, min_seconds=0.05):
+    # Metrics more than tolerance (a fraction) above the baseline. Times also
+    # have to grow by min_seconds, so short phases don't flag on noise.
+    regressions = []
+
+    def compare(label, current, recorded):
+        for metric in COMPARED_METRICS:
+            before, after = recorded.get(metric), current.get(metric)
+            if not before or after is None or after <= before * (1 + tolerance):
+                continue
+            if metric == "wall" and after - before < min_seconds:
+                continue
+            regressions.append(
+                f"{label} {metric}: {after:g} vs {before:g} "
+                f"(+{(after / before - 1) * 100:.0f}%)"
+            )
+
+    for name, metrics in scenarios.items():
+        recorded = baseline_run["scenarios"].get(name)
+        if recorded is None:
+            continue
+        compare(name, metrics, recorded)
+        # Memory is compared as growth over the RSS the import started with, so
+        # it doesn't depend on what ran before it in the same process: both the
+        # growth that stays and the peak reached on the way
+        for label, before, after in [
+            ("rss_growth", recorded.get("rss_growth"), metrics.get("rss_growth")),
+            ("rss_peak", peak_rise(recorded), peak_rise(metrics)),
+        ]:
+            if (
+                before is not None
+                and after is not None
+                and after > max(before, 0) * (1 + tolerance) + MIN_RSS_GROWTH
+            ):
+                regressions.append(
+                    f"{name} {label}: {after / 1024 / 1024:+.0f} MB vs "
+                    f"{before / 1024 / 1024:+.0f} MB over the starting RSS"
+                )
+        for phase, stats in metrics["phases"].items():
+            if phase in recorded["phases"]:
+                compare(f"{name} {phase}", stats, recorded["phases"][phase])
+    return regressions
@@ -0,0 +1,242 @@
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import F, Window
+from django.db.models.functions import RowNumber
+from .models import Option, Question, QuestionSignature, QuestionSignatureBand
+import hashlib
+import numpy as np
+import re
+import zlib
+
+# MinHash signatures split into LSH bands: two questions become candidates when
+# any band matches exactly, which happens with high probability above roughly
+# (1 / BANDS) ** (1 / ROWS_PER_BAND) = 50% similarity. Changing any of these
+# invalidates the stored index; rebuild it with build_dedupe_index --rebuild.
+NUM_PERM = 64
+BANDS = 16
+ROWS_PER_BAND = NUM_PERM // BANDS
+SHINGLE_SIZE = 4
+MAX_MATCHES = 3
+# Questions compared per band and incoming row. A bucket shared by many
+# questions says little about any of them and would make lookups linear.
+MAX_BUCKET_CANDIDATES = 20
+
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64(0xFFFFFFFF)
+# Drawn from the whole field: with small coefficients a * hash + b stays below
+# the prime, so every permutation keeps the order of the raw hashes and picks
+# the same shingle. The product wraps at 64 bits, as in datasketch.
+_random = np.random.RandomState(52)
+_PERM_A = _random.randint(1, _MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+_PERM_B = _random.randint(0, _MERSENNE_PRIME, NUM_PERM, dtype=np.uint64)
+
+_NON_WORD = re.compile(r"[^\w\s]")
+
+
+def get_near_duplicate_threshold():
+    return getattr(settings, "NEAR_DUPLICATE_THRESHOLD", 0.7)
+
+
+def normalize_text(text):
+    # Casing, punctuation and spacing differences do not count
+    return " ".join(_NON_WORD.sub(" ", str(text).lower()).split())
+
+
+def shingles(question_text, correct=None):
+    text = normalize_text(question_text)
+    result = {text[i : i + SHINGLE_SIZE] for i in range(len(text) - SHINGLE_SIZE + 1)}
+    result = result or {text}
+    if correct is not None:
+        # Words of the answer, tagged so they never collide with text shingles
+        result |= {f"={word}" for word in normalize_text(correct).split()}
+    return result
+
+
+def minhash(question_text, correct=None):
+    hashes = np.fromiter(
+        (
+            zlib.crc32(shingle.encode("utf-8"))
+            for shingle in shingles(question_text, correct)
+        ),
+        dtype=np.uint64,
+    )
+    permuted = (_PERM_A[:, None] * hashes[None, :] + _PERM_B[:, None]) % _MERSENNE_PRIME
+    return (permuted.min(axis=1) & _MAX_HASH).astype(np.uint32)
+
+
+def band_buckets(signature):
+    return [
+        int.from_bytes(
+            hashlib.blake2b(
+                signature[band * ROWS_PER_BAND : (band + 1) * ROWS_PER_BAND].tobytes(),
+                digest_size=8,
+            ).digest(),
+            "big",
+            signed=True,
+        )
+        for band in range(BANDS)
+    ]
+
+
+def similarities(signature, others):
+    # Share of matching MinHash values estimates the Jaccard similarity; others
+    # is a stacked (n, NUM_PERM) array, compared in one vectorized step
+    return (others == signature).mean(axis=1).tolist()
+
+
+def index_questions(rows, batch_size=1000, signatures=None):
+    # rows are (question_id, question_text, correct option text) triples;
+    # existing entries for those questions are replaced. signatures may hold
+    # their already computed MinHash signatures (None where unknown).
+    from .importer import chunked
+
+    known = signatures or [None] * len(rows)
+    signatures = []
+    bands = []
+    for (question_id, question_text, correct), signature in zip(rows, known):
+        if signature is None:
+            signature = minhash(question_text, correct)
+        signatures.append(
+            QuestionSignature(question_id=question_id, signature=signature.tobytes())
+        )
+        bands.extend(
+            (question_id, band, bucket)
+            for band, bucket in enumerate(band_buckets(signature))
+        )
+
+    with transaction.atomic():
+        for batch in chunked([row[0] for row in rows], batch_size):
+            QuestionSignatureBand.objects.filter(question_id__in=batch).delete()
+        QuestionSignature.objects.bulk_create(
+            signatures,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=["question"],
+            update_fields=["signature"],
+        )
+
+        # BANDS rows per question: a plain executemany avoids building a model
+        # instance and compiling SQL for each of them
+        table = connection.ops.quote_name(QuestionSignatureBand._meta.db_table)
+        with connection.cursor() as cursor:
+            for batch in chunked(bands, batch_size * BANDS):
+                cursor.executemany(
+                    f"INSERT INTO {table} (question_id, band, bucket) VALUES (%s, %s, %s)",
+                    batch,
+                )
+    return len(signatures)
+
+
+def index_question_ids(question_ids, batch_size=1000):
+    from .importer import chunked
+
+    indexed = 0
+    for batch in chunked(list(question_ids), batch_size):
+        correct = dict(
+            Option.objects.filter(question_id__in=batch, is_correct=True).values_list(
+                "question_id", "option_text"
+            )
+        )
+        rows = [
+            (question_id, question_text, correct.get(question_id))
+            for question_id, question_text in Question.objects.filter(
+                question_id__in=batch
+            ).values_list("question_id", "question_text")
+        ]
+        indexed += index_questions(rows, batch_size)
+    return indexed
+
+
+def find_near_duplicates(rows, threshold, batch_size=1000):
+    # rows are (question_text, correct option text) pairs for incoming questions.
+    # Returns, per row, the most similar stored questions as (question_id, score)
+    # and earlier rows of the same batch as (row index, score), and the rows'
+    # signatures for indexing them once written. Only questions sharing an LSH
+    # bucket are compared, never the whole bank.
+    from .importer import chunked
+
+    signatures = [minhash(text, correct) for text, correct in rows]
+    upload_signatures = np.vstack(signatures) if signatures else None
+
+    wanted = {}
+    upload_buckets = {}
+    upload_matches = []
+    for index, signature in enumerate(signatures):
+        earlier = set()
+        for band, bucket in enumerate(band_buckets(signature)):
+            wanted.setdefault(bucket, []).append((band, index))
+            members = upload_buckets.setdefault((band, bucket), [])
+            earlier.update(members)
+            if len(members) < MAX_BUCKET_CANDIDATES:
+                members.append(index)
+        earlier = sorted(earlier)
+        upload_matches.append(
+            top_matches(
+                zip(earlier, similarities(signature, upload_signatures[earlier])),
+                threshold,
+            )
+            if earlier
+            else []
+        )
+
+    candidates = [set() for _ in rows]
+    found = {}
+    for batch in chunked(list(wanted), batch_size):
+        # Crowded buckets are capped in the query rather than read in full
+        stored = (
+            QuestionSignatureBand.objects.filter(bucket__in=batch)
+            .annotate(
+                position=Window(
+                    RowNumber(),
+                    partition_by=[F("bucket"), F("band")],
+                    order_by=F("question_id").asc(),
+                )
+            )
+            .filter(position__lte=MAX_BUCKET_CANDIDATES)
+            .values_list("question_id", "band", "bucket")
+        )
+        for question_id, band, bucket in stored:
+            for wanted_band, index in wanted[bucket]:
+                if wanted_band != band:
+                    continue
+                count = found.get((band, index), 0)
+                if count < MAX_BUCKET_CANDIDATES:
+                    found[(band, index)] = count + 1
+                    candidates[index].add(question_id)
+
+    stored_positions = {}
+    stored_signatures = []
+    for batch in chunked(list(set().union(*candidates)), batch_size):
+        for question_id, signature in QuestionSignature.objects.filter(
+            question_id__in=batch
+        ).values_list("question_id", "signature"):
+            stored_positions[question_id] = len(stored_signatures)
+            stored_signatures.append(np.frombuffer(signature, dtype=np.uint32))
+    stored_signatures = np.vstack(stored_signatures) if stored_signatures else None
+
+    bank_matches = []
+    for signature, row_candidates in zip(signatures, candidates):
+        question_ids = sorted(
+            question_id
+            for question_id in row_candidates
+            if question_id in stored_positions
+        )
+        if not question_ids:
+            bank_matches.append([])
+            continue
+        scores = similarities(
+            signature,
+            stored_signatures[
+                [stored_positions[question_id] for question_id in question_ids]
+            ],
+        )
+        bank_matches.append(top_matches(zip(question_ids, scores), threshold))
+    return bank_matches, upload_matches, signatures
+
+
+def top_matches(scored, threshold):
+    matches = sorted(
+        ((key, score) for key, score in scored if score >= threshold),
+        key=lambda match: (-match[1], match[0]),
+    )
+    return matches[:MAX_MATCHES]
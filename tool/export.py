@@ -0,0 +1,133 @@
+from .importer import get_batch_size
+from .models import Category, Option, Question
+from itertools import islice
+from openpyxl import Workbook
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.cell.cell import ILLEGAL_CHARACTERS_RE
+import csv
+import json
+
+EXPORT_COLUMNS = [
+    "Question",
+    "Correct",
+    "Incorrect1",
+    "Incorrect2",
+    "Incorrect3",
+    "Product",
+]
+
+EXPORT_FORMATS = {
+    "csv": ("text/csv", "csv"),
+    "jsonl": ("application/x-ndjson", "jsonl"),
+    "xlsx": (
+        "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+        "xlsx",
+    ),
+}
+
+
+def category_sheet_names():
+    # Sheet names are what the importer maps back to categories
+    names = dict(Category.objects.values_list("category_id", "name"))
+    names.update(
+        {
+            category_id: name
+            for name, category_id in Category.get_category_id_mapping().items()
+        }
+    )
+    return names
+
+
+def iter_export_rows(queryset=None, batch_size=None):
+    # Yields (sheet name, row in EXPORT_COLUMNS layout) category by category.
+    # Questions are streamed and the options of each batch are read in one
+    # query, so memory stays flat however large the bank is.
+    queryset = Question.objects.all() if queryset is None else queryset
+    batch_size = batch_size or get_batch_size()
+    sheet_names = category_sheet_names()
+
+    category_ids = (
+        queryset.order_by("category_id")
+        .values_list("category_id", flat=True)
+        .distinct()
+    )
+    for category_id in list(category_ids):
+        rows = (
+            queryset.filter(category_id=category_id)
+            .order_by("question_id")
+            .values_list("question_id", "question_text", "product_type__name")
+            .iterator(chunk_size=batch_size)
+        )
+        while batch := list(islice(rows, batch_size)):
+            options = {}
+            option_rows = (
+                Option.objects.filter(question_id__in=[row[0] for row in batch])
+                .order_by("question_id", "-is_correct", "option_id")
+                .values_list("question_id", "option_text")
+            )
+            for question_id, option_text in option_rows:
+                options.setdefault(question_id, []).append(option_text)
+
+            for question_id, question_text, product in batch:
+                # Correct option first, then up to three incorrect ones
+                texts = (options.get(question_id, []) + [None] * 4)[:4]
+                yield sheet_names.get(category_id, str(category_id)), [
+                    question_text,
+                    *texts,
+                    product,
+                ]
+
+
+class Echo:
+    # csv.writer target that hands each row back instead of buffering it
+    def write(self, value):
+        return value
+
+
+def iter_csv(queryset=None):
+    writer = csv.writer(Echo())
+    yield writer.writerow(["Category", *EXPORT_COLUMNS])
+    for sheet_name, row in iter_export_rows(queryset):
+        yield writer.writerow([sheet_name, *row])
+
+
+def iter_jsonl(queryset=None):
+    for sheet_name, row in iter_export_rows(queryset):
+        question_text, correct, *incorrect, product = row
+        record = {
+            "category": sheet_name,
+            "question": question_text,
+            "correct": correct,
+            "incorrect": [text for text in incorrect if text is not None],
+            "product": product,
+        }
+        yield json.dumps(record, ensure_ascii=False) + "\n"
+
+
+def xlsx_row(worksheet, row):
+    cells = []
+    for value in row:
+        if isinstance(value, str):
+            value = ILLEGAL_CHARACTERS_RE.sub("", value)
+        if isinstance(value, str) and value.startswith("="):
+            # Text, not a formula, so it reads back as written
+            cell = WriteOnlyCell(worksheet, value=value)
+            cell.data_type = "s"
+            value = cell
+        cells.append(value)
+    return cells
+
+
+def write_xlsx(output, queryset=None):
+    # Write-only mode spools each sheet to disk instead of keeping cells in
+    # memory; the result can be uploaded again as is
+    workbook = Workbook(write_only=True)
+    worksheet = None
+    for sheet_name, row in iter_export_rows(queryset):
+        if worksheet is None or worksheet.title != sheet_name[:31]:
+            worksheet = workbook.create_sheet(title=sheet_name[:31])
+            worksheet.append(EXPORT_COLUMNS)
+        worksheet.append(xlsx_row(worksheet, row))
+    if worksheet is None:
+        workbook.create_sheet().append(EXPORT_COLUMNS)
+    workbook.save(output)
@@ -0,0 +1,1168 @@
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.db import connection, connections, transaction
+from django.db.models import Prefetch
+from .models import (
+    BankVersion,
+    Category,
+    ImportJob,
+    Option,
+    ProductTypeEnum,
+    Question,
+    ImportPlan,
+    ImportPlanEntry,
+    SheetFingerprint,
+    SpreadsheetImportState,
+    question_text_hash,
+)
+from .archive import get_archive_deleted, id_placeholders, remove_questions
+from .dedupe import find_near_duplicates, get_near_duplicate_threshold, index_questions
+from .metrics import ImportMetrics
+from .reference import get_category_ids, get_product_type_ids
+from .runlog import import_run
+from .sampling import touch_question_buckets
+from .utils import (
+    extract_sheet_id_from_url,
+    get_google_sheets_client,
+    sheet_values_to_dataframes,
+)
+from django.utils import timezone
+import hashlib
+import json
+import multiprocessing
+import pandas as pd
+
+SHEET_COLUMNS = ["question_text", "correct", "incorrect1", "incorrect2", "incorrect3"]
+PRODUCT_TYPES = list(ProductTypeEnum.values)
+ERROR_COLUMNS = ["row_num", "level", "question_text", "message"]
+
+# Bump when normalization or validation rules change so every sheet is re-imported
+FINGERPRINT_VERSION = 1
+
+# Cap on warnings kept for display on the import job page; the log has them all
+MAX_JOB_MESSAGES = 200
+
+QUESTION_UPDATE_FIELDS = [
+    "category_id",
+    "is_product_question",
+    "product_type_id",
+    "time_limit",
+    "hint",
+]
+
+
+def get_batch_size():
+    return getattr(settings, "IMPORT_BATCH_SIZE", 1000)
+
+
+def get_import_workers():
+    # Processes used to parse and validate sheets; 1 keeps everything in-process
+    return getattr(settings, "IMPORT_WORKERS", 1)
+
+
+def get_key_scope():
+    # "global": a question text is unique across the bank and may move between
+    # categories; "category": the same text may exist once per category
+    return getattr(settings, "QUESTION_KEY_SCOPE", "global")
+
+
+def question_key(category_id, text_hash, scope=None):
+    if (scope or get_key_scope()) == "category":
+        return (category_id, text_hash)
+    return text_hash
+
+
+def chunked(items, size):
+    for start in range(0, len(items), size):
+        yield items[start : start + size]
+
+
+def normalize_column(series):
+    values = series.astype("string").str.strip()
+    return values.mask(values == "")
+
+
+def normalize_sheet(df):
+    # Columns A-E are positional, Product is matched by header name
+    empty = pd.Series(pd.NA, index=df.index, dtype="string")
+    frame = pd.DataFrame(
+        {
+            name: (
+                normalize_column(df.iloc[:, position])
+                if position < df.shape[1]
+                else empty
+            )
+            for position, name in enumerate(SHEET_COLUMNS)
+        }
+    )
+    frame["product"] = (
+        normalize_column(df["Product"]).str.upper()
+        if "Product" in df.columns
+        else empty
+    )
+    frame["row_num"] = range(2, len(df) + 2)
+    return frame.reset_index(drop=True)
+
+
+def error_rows(frame, level, message):
+    return pd.DataFrame(
+        {
+            "row_num": frame["row_num"],
+            "level": level,
+            "question_text": frame["question_text"],
+            "message": message,
+        },
+        columns=ERROR_COLUMNS,
+    )
+
+
+def sheet_fingerprint(frame):
+    # Stable across sources: hashes the normalized cell values, not the raw types
+    digest = hashlib.sha256(f"v{FINGERPRINT_VERSION}:".encode("utf-8"))
+    row_hashes = pd.util.hash_pandas_object(
+        frame[SHEET_COLUMNS + ["product"]], index=False
+    )
+    digest.update(row_hashes.to_numpy().tobytes())
+    return digest.hexdigest()
+
+
+def load_sheet_fingerprints():
+    return dict(SheetFingerprint.objects.values_list("category_id", "fingerprint"))
+
+
+def save_sheet_fingerprints(fingerprints):
+    # Replaces every stored fingerprint: a category missing here was absent
+    # from the upload or lost questions, so its sheet has to be re-checked
+    SheetFingerprint.objects.exclude(category_id__in=list(fingerprints)).delete()
+    for category_id, fingerprint in fingerprints.items():
+        SheetFingerprint.objects.update_or_create(
+            category_id=category_id, defaults={"fingerprint": fingerprint}
+        )
+
+
+def clear_sheet_fingerprints():
+    # Called on admin edits so the next upload re-checks every sheet
+    SheetFingerprint.objects.all().delete()
+
+
+def category_question_keys(category_id):
+    scope = get_key_scope()
+    return {
+        question_key(category_id, text_hash, scope)
+        for text_hash in Question.objects.filter(category_id=category_id).values_list(
+            "text_hash", flat=True
+        )
+    }
+
+
+def validate_sheet(frame):
+    # Takes a normalize_sheet() frame; returns (plan of valid rows, error table)
+    missing_question = frame["question_text"].isna()
+    missing_correct = ~missing_question & frame["correct"].isna()
+    valid = ~(missing_question | missing_correct)
+
+    is_product = frame["product"].isin(PRODUCT_TYPES)
+    invalid_product = valid & frame["product"].notna() & ~is_product
+
+    errors = pd.concat(
+        [
+            error_rows(frame[missing_question], "ERROR", "Question text is empty"),
+            error_rows(frame[missing_correct], "ERROR", "Correct answer is empty"),
+            error_rows(
+                frame[invalid_product],
+                "WARNING",
+                "Invalid or unsupported product type: "
+                + frame.loc[invalid_product, "product"]
+                + f". Only {' and '.join(PRODUCT_TYPES)} are supported.",
+            ),
+        ],
+        ignore_index=True,
+    ).sort_values("row_num", kind="stable", ignore_index=True)
+
+    plan = frame[valid].copy()
+    plan["is_product_question"] = is_product[valid]
+    plan["product"] = plan["product"].where(plan["is_product_question"])
+    plan["text_hash"] = plan["question_text"].map(question_text_hash)
+    errors["text_hash"] = errors["question_text"].map(
+        question_text_hash, na_action="ignore"
+    )
+    return plan.reset_index(drop=True), errors
+
+
+def sheet_question_keys(category_id, plan, errors):
+    # Rows rejected for a missing answer still count as present in the upload
+    scope = get_key_scope()
+    return {
+        question_key(category_id, text_hash, scope)
+        for text_hash in set(plan["text_hash"]) | set(errors["text_hash"].dropna())
+    }
+
+
+def resolve_category_id(sheet_name, category_id_mapping):
+    return next(
+        (
+            id
+            for name, id in category_id_mapping.items()
+            if name.lower() == sheet_name.lower()
+        ),
+        None,
+    )
+
+
+def load_existing_questions(keys, batch_size=None):
+    # Index probe on text_hash for just the keys present in the upload
+    batch_size = batch_size or get_batch_size()
+    scope = get_key_scope()
+    text_hashes = list({key[1] if scope == "category" else key for key in keys})
+
+    existing_questions = {}
+    for batch in chunked(text_hashes, batch_size):
+        # With several stored copies of a question the oldest is matched, and
+        # its first correct option, like the COPY path's match step
+        questions = (
+            Question.objects.filter(text_hash__in=batch)
+            .order_by("question_id")
+            .prefetch_related(
+                Prefetch("option_set", queryset=Option.objects.order_by("option_id"))
+            )
+        )
+        for question in questions:
+            key = question_key(question.category_id, question.text_hash, scope)
+            if key not in keys or key in existing_questions:
+                continue
+            options = list(question.option_set.all())
+            existing_questions[key] = {
+                "question": question,
+                "options": {
+                    "correct": next(
+                        (opt.option_text for opt in options if opt.is_correct), None
+                    ),
+                    "incorrect": [
+                        opt.option_text for opt in options if not opt.is_correct
+                    ],
+                },
+            }
+    return existing_questions
+
+
+def find_questions_to_delete(keys, batch_size=None):
+    # Only (id, category, hash) triples are streamed, never full rows or options
+    batch_size = batch_size or get_batch_size()
+    scope = get_key_scope()
+    rows = Question.objects.values_list("question_id", "category_id", "text_hash")
+    return [
+        question_id
+        for question_id, category_id, text_hash in rows.iterator(chunk_size=batch_size)
+        if question_key(category_id, text_hash, scope) not in keys
+    ]
+
+
+def row_options(row):
+    return {
+        "correct": row.correct,
+        "incorrect": [
+            text
+            for text in (row.incorrect1, row.incorrect2, row.incorrect3)
+            if not pd.isna(text)
+        ],
+    }
+
+
+def add_message(result, level, message):
+    if len(result["messages"]) < MAX_JOB_MESSAGES:
+        result["messages"].append({"level": level, "message": message})
+
+
+def build_options(question, options):
+    # Correct option first, then the incorrect ones in sheet order
+    return [
+        Option(question=question, option_text=options["correct"], is_correct=True)
+    ] + [
+        Option(question=question, option_text=text, is_correct=False)
+        for text in options["incorrect"]
+    ]
+
+
+def option_changes(existing_options, options):
+    # Minimal edit from the stored options, as (option_id, option_text,
+    # is_correct) ordered by option_id, to the wanted ones. Identical options
+    # keep their rows; the rest are rewritten in place before any row is
+    # inserted or deleted. Returns (updates, creates, delete_ids).
+    wanted = [(options["correct"], True)] + [
+        (text, False) for text in options["incorrect"]
+    ]
+    unmatched = []
+    for option_id, option_text, is_correct in existing_options:
+        if (option_text, is_correct) in wanted:
+            wanted.remove((option_text, is_correct))
+        else:
+            unmatched.append(option_id)
+    updates = list(zip(unmatched, wanted))
+    return updates, wanted[len(updates) :], unmatched[len(updates) :]
+
+
+def question_changes(existing_question, existing_options, fields, new_options):
+    # Field-level diff used both to decide on an update and for the dry-run preview
+    changes = {
+        field: [getattr(existing_question, field), fields[field]]
+        for field in ("category_id", "is_product_question", "product_type_id")
+        if getattr(existing_question, field) != fields[field]
+    }
+    if existing_options["correct"] != new_options["correct"]:
+        changes["correct"] = [existing_options["correct"], new_options["correct"]]
+    if set(existing_options["incorrect"]) != set(new_options["incorrect"]):
+        changes["incorrect"] = [
+            sorted(existing_options["incorrect"]),
+            sorted(new_options["incorrect"]),
+        ]
+    return changes
+
+
+def bulk_create_questions(questions_to_create, logger, batch_size=None):
+    batch_size = batch_size or get_batch_size()
+    created = 0
+
+    for batch in chunked(questions_to_create, batch_size):
+        questions = [
+            Question(
+                question_text=data["question_text"],
+                text_hash=question_text_hash(data["question_text"]),
+                **{field: data[field] for field in QUESTION_UPDATE_FIELDS},
+            )
+            for data in batch
+        ]
+
+        if connection.features.can_return_rows_from_bulk_insert:
+            # Postgres (and SQLite >= 3.35) hand the new IDs back via RETURNING
+            Question.objects.bulk_create(questions)
+        else:
+            for question in questions:
+                question.save()
+
+        options = []
+        for question, data in zip(questions, batch):
+            options.extend(build_options(question, data["options"]))
+        Option.objects.bulk_create(options, batch_size=batch_size)
+        index_questions(
+            [
+                (
+                    question.question_id,
+                    data["question_text"],
+                    data["options"]["correct"],
+                )
+                for question, data in zip(questions, batch)
+            ],
+            batch_size,
+            [data.get("signature") for data in batch],
+        )
+
+        for question in questions:
+            logger.info(f"Created new question: {question.question_id}")
+        created += len(questions)
+
+    return created
+
+
+def bulk_update_questions(questions_to_update, logger, batch_size=None):
+    batch_size = batch_size or get_batch_size()
+    updated = 0
+
+    for batch in chunked(questions_to_update, batch_size):
+        questions = [
+            Question(
+                question_id=data["question_id"],
+                **{field: data[field] for field in QUESTION_UPDATE_FIELDS},
+            )
+            for data in batch
+        ]
+        existing_options = {}
+        for option_id, question_id, option_text, is_correct in (
+            Option.objects.filter(question__in=questions)
+            .order_by("option_id")
+            .values_list("option_id", "question_id", "option_text", "is_correct")
+        ):
+            existing_options.setdefault(question_id, []).append(
+                (option_id, option_text, is_correct)
+            )
+
+        # Options are diffed rather than replaced, so a question whose answers
+        # are unchanged doesn't touch the options table and option IDs survive
+        options_to_update = []
+        options_to_create = []
+        option_ids_to_delete = []
+        for question, data in zip(questions, batch):
+            updates, creates, delete_ids = option_changes(
+                existing_options.get(question.question_id, []), data["options"]
+            )
+            options_to_update.extend(
+                Option(option_id=option_id, option_text=text, is_correct=correct)
+                for option_id, (text, correct) in updates
+            )
+            options_to_create.extend(
+                Option(question=question, option_text=text, is_correct=correct)
+                for text, correct in creates
+            )
+            option_ids_to_delete.extend(delete_ids)
+
+        Question.objects.bulk_update(
+            questions, QUESTION_UPDATE_FIELDS, batch_size=batch_size
+        )
+        if option_ids_to_delete:
+            Option.objects.filter(option_id__in=option_ids_to_delete).delete()
+        if options_to_update:
+            Option.objects.bulk_update(
+                options_to_update, ["option_text", "is_correct"], batch_size=batch_size
+            )
+        Option.objects.bulk_create(options_to_create, batch_size=batch_size)
+        index_questions(
+            [
+                (data["question_id"], data["question_text"], data["options"]["correct"])
+                for data in batch
+            ],
+            batch_size,
+        )
+
+        for question in questions:
+            logger.info(f"Updated question: {question.question_id}")
+        updated += len(questions)
+
+    return updated
+
+
+def bulk_delete_questions(question_ids, logger, batch_size=None, archive=None):
+    # Set-based deletes per batch rather than Django's collector, which loads
+    # every question and option it cascades to
+    batch_size = batch_size or get_batch_size()
+    archive = get_archive_deleted() if archive is None else archive
+    deleted = 0
+
+    with connection.cursor() as cursor:
+        for batch in chunked(question_ids, batch_size):
+            deleted += remove_questions(
+                cursor, id_placeholders(batch), batch, archive=archive
+            )
+            for question_id in batch:
+                logger.info(
+                    f"{'Archived' if archive else 'Deleted'} question: {question_id}"
+                )
+
+    return deleted
+
+
+def prepare_sheet(sheet_name, df, known_fingerprints):
+    # Parse, normalize and validate one sheet without touching the database, so
+    # it can run in a worker process. df may be a loader returning the DataFrame.
+    if callable(df):
+        df = df()
+
+    category_id = resolve_category_id(sheet_name, Category.get_category_id_mapping())
+    frame = normalize_sheet(df)
+    prepared = {
+        "sheet_name": sheet_name,
+        "category_id": category_id,
+        "rows": len(df),
+        "fingerprint": sheet_fingerprint(frame),
+        "skipped": False,
+        "plan": None,
+        "errors": None,
+    }
+
+    if (
+        category_id is not None
+        and known_fingerprints.get(category_id) == prepared["fingerprint"]
+    ):
+        prepared["skipped"] = True
+    else:
+        prepared["plan"], prepared["errors"] = validate_sheet(frame)
+    return prepared
+
+
+def get_fork_context():
+    # Workers are forked so they inherit the configured Django; a spawned or
+    # forkserver worker would import this module before settings and the app
+    # registry are set up. None where fork is not available.
+    if "fork" not in multiprocessing.get_all_start_methods():
+        return None
+    return multiprocessing.get_context("fork")
+
+
+def iter_prepared_sheets(sheets, known_fingerprints, workers=None):
+    workers = workers or get_import_workers()
+    context = get_fork_context()
+    # Closing the connections below would break a caller's transaction, so
+    # sheets are parsed in-process there
+    in_transaction = any(
+        conn.in_atomic_block for conn in connections.all(initialized_only=True)
+    )
+    if workers <= 1 or context is None or in_transaction:
+        for sheet_name, df in sheets:
+            yield prepare_sheet(sheet_name, df, known_fingerprints)
+        return
+
+    sheets = list(sheets)
+    if not sheets:
+        return
+
+    # Forked workers must not share the parent's database connections
+    connections.close_all()
+    with ProcessPoolExecutor(
+        max_workers=min(workers, len(sheets)), mp_context=context
+    ) as executor:
+        futures = [
+            executor.submit(prepare_sheet, sheet_name, df, known_fingerprints)
+            for sheet_name, df in sheets
+        ]
+        # Results are consumed in sheet order so logs and duplicate handling
+        # do not depend on which worker finishes first
+        for future in futures:
+            yield future.result()
+
+
+def sheet_values_hash(values):
+    payload = json.dumps(values, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def check_google_sheet(sheet_url, force=False, client=None):
+    # Returns the spreadsheet's tabs as DataFrames under "data", or None there
+    # when neither the revision nor any tab's content changed since last import
+    try:
+        client = client or get_google_sheets_client()
+        sheet_id = extract_sheet_id_from_url(sheet_url)
+        state = SpreadsheetImportState.objects.filter(spreadsheet_id=sheet_id).first()
+        check = {
+            "spreadsheet_id": sheet_id,
+            "revision": client.get_revision(sheet_id) or "",
+            "data": None,
+            "changed_tabs": [],
+        }
+
+        if (
+            not force
+            and state is not None
+            and check["revision"]
+            and state.revision == check["revision"]
+        ):
+            # Short-circuit on metadata alone, without fetching any values
+            check["tab_hashes"] = state.tab_hashes
+            return check
+
+        values_by_sheet = client.get_values(sheet_id)
+        check["tab_hashes"] = {
+            sheet_name: sheet_values_hash(values)
+            for sheet_name, values in values_by_sheet.items()
+        }
+        previous_hashes = state.tab_hashes if state is not None else {}
+        check["changed_tabs"] = [
+            sheet_name
+            for sheet_name, tab_hash in check["tab_hashes"].items()
+            if previous_hashes.get(sheet_name) != tab_hash
+        ]
+
+        if force or state is None or check["tab_hashes"] != previous_hashes:
+            check["data"] = sheet_values_to_dataframes(values_by_sheet)
+        return check
+    except Exception as e:
+        raise Exception(f"Error reading Google Sheet: {str(e)}")
+
+
+def save_google_sheet_state(check, imported):
+    defaults = {"revision": check["revision"], "tab_hashes": check["tab_hashes"]}
+    if imported:
+        defaults["imported_at"] = timezone.now()
+    SpreadsheetImportState.objects.update_or_create(
+        spreadsheet_id=check["spreadsheet_id"], defaults=defaults
+    )
+
+
+def no_progress(phase, **fields):
+    pass
+
+
+def get_commit_chunk_size():
+    return getattr(settings, "IMPORT_COMMIT_CHUNK_SIZE", 5000)
+
+
+def entry_buckets(entries):
+    return {(data["category_id"], data["product_type_id"]) for data in entries}
+
+
+def stored_buckets(question_ids, batch_size):
+    # Buckets the questions are in before they are changed or deleted
+    buckets = set()
+    for batch in chunked(question_ids, batch_size):
+        buckets.update(
+            Question.objects.filter(question_id__in=batch)
+            .values_list("category_id", "product_type_id")
+            .distinct()
+        )
+    return buckets
+
+
+def bank_changed(buckets):
+    # In the writing transaction, so readers never see the new version early
+    BankVersion.bump()
+    touch_question_buckets(buckets)
+
+
+def write_in_chunks(
+    questions_to_create, questions_to_update, chunk_size, logger, progress
+):
+    # Each chunk commits on its own and is reported as a checkpoint. A rerun of
+    # the same upload matches the committed rows as existing questions, so an
+    # interrupted import resumes after its last committed chunk.
+    batch_size = min(get_batch_size(), chunk_size)
+    created = updated = 0
+
+    for chunk in chunked(questions_to_create, chunk_size):
+        with transaction.atomic():
+            count = bulk_create_questions(chunk, logger, batch_size)
+            bank_changed(entry_buckets(chunk))
+        created += count
+        logger.info(f"Checkpoint: committed {count} created questions")
+        progress(ImportJob.Phase.WRITING, committed={"created": count})
+
+    for chunk in chunked(questions_to_update, chunk_size):
+        with transaction.atomic():
+            buckets = stored_buckets(
+                [data["question_id"] for data in chunk], batch_size
+            )
+            count = bulk_update_questions(chunk, logger, batch_size)
+            bank_changed(buckets | entry_buckets(chunk))
+        updated += count
+        logger.info(f"Checkpoint: committed {count} updated questions")
+        progress(ImportJob.Phase.WRITING, committed={"updated": count})
+
+    return created, updated
+
+
+def flag_near_duplicates(new_rows, result, logger):
+    # new_rows are (location, create entry) pairs. Matches are kept on the entry
+    # so a dry-run plan shows them next to the question, and the signature until
+    # the question is written (it is not stored with a plan).
+    threshold = get_near_duplicate_threshold()
+    if threshold is None or not new_rows:
+        return
+
+    bank_matches, upload_matches, signatures = find_near_duplicates(
+        [(data["question_text"], data["options"]["correct"]) for _, data in new_rows],
+        threshold,
+        get_batch_size(),
+    )
+    flagged = 0
+    for (location, data), bank, upload, signature in zip(
+        new_rows, bank_matches, upload_matches, signatures
+    ):
+        # Reused when the question is indexed, instead of hashing it again
+        data["signature"] = signature
+        duplicates = [
+            f"question #{question_id} ({score:.0%})" for question_id, score in bank
+        ] + [f"{new_rows[index][0]} ({score:.0%})" for index, score in upload]
+        if not duplicates:
+            continue
+        flagged += 1
+        data["duplicates"] = duplicates
+        message = f"Possible duplicate: {location} looks like {', '.join(duplicates)}."
+        logger.warning(message)
+        add_message(result, "WARNING", message)
+    logger.info(f"Flagged {flagged} new questions as possible duplicates")
+
+
+def parse_sheets(sheets, result, logger, progress, force=False, workers=None):
+    # Parses and validates every sheet. Sheets unchanged since the last import
+    # are only listed by category under "skipped", and all their questions kept.
+    # "fingerprints" covers every sheet in the upload, skipped ones included.
+    # Missing categories are created first so their questions can be written.
+    get_category_ids()
+    sheet_plans = []
+    skipped = []
+    rows_processed = 0
+    known_fingerprints = {} if force else load_sheet_fingerprints()
+    new_fingerprints = {}
+    # sheets is any iterable of (sheet_name, DataFrame or loader) pairs; each
+    # raw sheet is dropped as soon as it has been validated
+    for prepared in iter_prepared_sheets(sheets, known_fingerprints, workers):
+        sheet_name = prepared["sheet_name"]
+        category_id = prepared["category_id"]
+        rows_processed += prepared["rows"]
+
+        if prepared["skipped"]:
+            logger.info(f"Sheet: {sheet_name} - Unchanged since last import, skipped")
+            add_message(
+                result,
+                "INFO",
+                f"Sheet '{sheet_name}' is unchanged since the last import and was skipped.",
+            )
+            skipped.append(category_id)
+            new_fingerprints[category_id] = prepared["fingerprint"]
+            progress(ImportJob.Phase.PARSING, rows_processed=rows_processed)
+            continue
+
+        if category_id is not None:
+            new_fingerprints[category_id] = prepared["fingerprint"]
+        sheet_plans.append(
+            (sheet_name, category_id, prepared["plan"], prepared["errors"])
+        )
+        progress(ImportJob.Phase.PARSING, rows_processed=rows_processed)
+
+    return {
+        "sheets": sheet_plans,
+        "skipped": skipped,
+        "fingerprints": new_fingerprints,
+        "rows": rows_processed,
+    }
+
+
+def sheet_product_type_ids(sheet_plans):
+    return get_product_type_ids(
+        {
+            name
+            for _, _, plan, _ in sheet_plans
+            for name in plan["product"].dropna().unique()
+        }
+    )
+
+
+def log_sheet(sheet_name, category_id, plan, errors, result, logger):
+    # Logs a sheet's validation problems; False when it matches no category
+    logger.info(f"Processing sheet: {sheet_name}")
+
+    if category_id is None:
+        logger.error(
+            f"Invalid sheet name: {sheet_name}. Must be one of {list(get_category_ids().keys())}"
+        )
+        return False
+
+    for error in errors.itertuples(index=False):
+        message = f"Sheet: {sheet_name}, Row: {error.row_num} - {error.message}"
+        if error.level == "WARNING":
+            logger.warning(message)
+            add_message(
+                result,
+                "WARNING",
+                f"Warning: {error.message} Found in sheet '{sheet_name}', row {error.row_num}. "
+                f"Treating as non-product question.",
+            )
+        else:
+            logger.error(message)
+
+    logger.info(
+        f"Sheet: {sheet_name} - {len(plan)} valid rows, "
+        f"{int(plan['is_product_question'].sum())} product questions"
+    )
+    return True
+
+
+def question_fields(category_id, row, product_types):
+    is_product = bool(row.is_product_question)
+    return {
+        "category_id": category_id,
+        "is_product_question": is_product,
+        "product_type_id": product_types[row.product] if is_product else None,
+        "time_limit": 60 if is_product else 15,
+        "hint": "Hint Text" if is_product else None,
+    }
+
+
+def build_plan(sheets, result, logger, progress, force=False, workers=None):
+    # Parse, validate and diff the upload against the bank without writing any
+    # questions. The plan only holds IDs and plain values so it can be stored.
+    # Read before anything else so a stored plan is stale after any later change
+    bank_version = BankVersion.current()
+    parsed = parse_sheets(sheets, result, logger, progress, force, workers)
+    sheet_plans = parsed["sheets"]
+
+    excel_questions = set()
+    for category_id in parsed["skipped"]:
+        # Unchanged since the last import: keep what is stored for it
+        excel_questions |= category_question_keys(category_id)
+    for _, category_id, plan, errors in sheet_plans:
+        excel_questions |= sheet_question_keys(category_id, plan, errors)
+
+    progress(ImportJob.Phase.LOADING, rows_total=parsed["rows"])
+    batch_size = get_batch_size()
+    existing_questions = load_existing_questions(excel_questions, batch_size)
+    questions_to_delete = find_questions_to_delete(excel_questions, batch_size)
+
+    progress(ImportJob.Phase.DIFFING)
+    questions_to_create = []
+    questions_to_update = []
+    planned_rows = {}
+    new_rows = []
+    product_types = sheet_product_type_ids(sheet_plans)
+
+    for sheet_name, category_id, plan, errors in sheet_plans:
+        if not log_sheet(sheet_name, category_id, plan, errors, result, logger):
+            continue
+
+        for row in plan.itertuples(index=False):
+            key = question_key(category_id, row.text_hash)
+            if key in planned_rows:
+                logger.warning(
+                    f"Sheet: {sheet_name}, Row: {row.row_num} - Duplicate question, "
+                    f"already listed at {planned_rows[key]}. Skipping"
+                )
+                continue
+            planned_rows[key] = f"sheet '{sheet_name}', row {row.row_num}"
+
+            fields = question_fields(category_id, row, product_types)
+            new_options = row_options(row)
+
+            if key in existing_questions:
+                existing_data = existing_questions[key]
+                existing_question = existing_data["question"]
+
+                # Only update if it's in a different category or has changes
+                changes = question_changes(
+                    existing_question, existing_data["options"], fields, new_options
+                )
+                if changes:
+                    moved_from = existing_question.category_id
+                    if moved_from != category_id and moved_from in parsed["skipped"]:
+                        # A skipped sheet's category loses this question, so
+                        # the sheet is checked again next time
+                        parsed["fingerprints"].pop(moved_from, None)
+                    questions_to_update.append(
+                        {
+                            "question_id": existing_question.question_id,
+                            "question_text": existing_question.question_text,
+                            **fields,
+                            "options": new_options,
+                            "changes": changes,
+                        }
+                    )
+                    logger.info(
+                        f"Sheet: {sheet_name}, Row: {row.row_num} - Question will be updated: {existing_question.question_id}"
+                    )
+            else:
+                data = {
+                    "question_text": row.question_text,
+                    **fields,
+                    "options": new_options,
+                }
+                questions_to_create.append(data)
+                new_rows.append((planned_rows[key], data))
+                logger.info(
+                    f"Sheet: {sheet_name}, Row: {row.row_num} - New question will be created"
+                )
+
+    flag_near_duplicates(new_rows, result, logger)
+
+    return {
+        "create": questions_to_create,
+        "update": questions_to_update,
+        "delete": questions_to_delete,
+        "fingerprints": parsed["fingerprints"],
+        "bank_version": bank_version,
+    }
+
+
+def write_plan(plan, logger, progress=no_progress, commit_chunk_size=None):
+    batch_size = get_batch_size()
+    progress(ImportJob.Phase.WRITING)
+    if commit_chunk_size:
+        created, updated = write_in_chunks(
+            plan["create"], plan["update"], commit_chunk_size, logger, progress
+        )
+        committed = {"deleted": 0}
+    else:
+        created = updated = 0
+        committed = {}
+
+    with transaction.atomic():
+        buckets = stored_buckets(plan["delete"], batch_size)
+        if not commit_chunk_size:
+            buckets |= stored_buckets(
+                [data["question_id"] for data in plan["update"]], batch_size
+            )
+            buckets |= entry_buckets(plan["create"]) | entry_buckets(plan["update"])
+            created = bulk_create_questions(plan["create"], logger, batch_size)
+            updated = bulk_update_questions(plan["update"], logger, batch_size)
+            committed.update(created=created, updated=updated)
+
+        # Only questions that don't exist in any sheet are deleted, and
+        # always in one transaction so a partial upload never deletes
+        deleted = bulk_delete_questions(plan["delete"], logger, batch_size)
+        committed["deleted"] = deleted
+
+        logger.info(
+            f"Summary: Created {created} questions, Updated {updated} questions, Deleted {deleted} questions"
+        )
+        save_sheet_fingerprints(plan["fingerprints"])
+        if created or updated or deleted:
+            bank_changed(buckets)
+
+    progress(ImportJob.Phase.WRITING, committed=committed)
+    return created, updated, deleted
+
+
+def process_data(
+    sheets,
+    progress=no_progress,
+    force=False,
+    workers=None,
+    commit_chunk_size=None,
+    dry_run=False,
+    job=None,
+):
+    # Runs one import end to end and returns its summary; errors are logged and
+    # re-raised for the caller (the import worker) to record.
+    # progress(phase, **fields) receives phase changes and ImportJob field updates,
+    # plus committed={"created"/"updated"/"deleted": n} after each commit.
+    # With dry_run nothing is written and the summary carries the plan instead.
+    # The summary's "metrics" are the timings of each phase, also logged as JSON.
+    with import_run(job, dry_run) as run:
+        logger = run.logger
+        logger.info("Starting data import process")
+        metrics = ImportMetrics()
+        progress = metrics.track(progress)
+        progress(ImportJob.Phase.PARSING, log_file=run.log_file)
+
+        result = {
+            "created": 0,
+            "updated": 0,
+            "deleted": 0,
+            "log_file": run.log_file,
+            "messages": [],
+        }
+
+        # Imported here: the PostgreSQL backend builds on this module
+        from . import pg_import
+
+        try:
+            with metrics.capture():
+                if pg_import.use_copy_import(dry_run, commit_chunk_size):
+                    logger.info(
+                        "Reconciling in PostgreSQL through a COPY staging table"
+                    )
+                    parsed = parse_sheets(
+                        sheets, result, logger, progress, force, workers
+                    )
+                    created, updated, deleted = pg_import.copy_import(
+                        parsed, result, logger, progress
+                    )
+                else:
+                    plan = build_plan(sheets, result, logger, progress, force, workers)
+                    if dry_run:
+                        logger.info(
+                            f"Dry run: would create {len(plan['create'])} questions, "
+                            f"update {len(plan['update'])} questions, delete {len(plan['delete'])} questions"
+                        )
+                        result["plan"] = plan
+                    else:
+                        created, updated, deleted = write_plan(
+                            plan, logger, progress, commit_chunk_size
+                        )
+
+                if not dry_run:
+                    result.update(created=created, updated=updated, deleted=deleted)
+                    logger.info("Data import completed successfully")
+
+        except Exception as e:
+            logger.error(f"Error processing data: {str(e)}")
+            log_metrics(logger, metrics.finish(succeeded=False, dry_run=dry_run))
+            raise
+
+        run.created_count = result["created"]
+        run.updated_count = result["updated"]
+        run.deleted_count = result["deleted"]
+        result["metrics"] = log_metrics(
+            logger,
+            metrics.finish(
+                succeeded=True,
+                dry_run=dry_run,
+                created=result["created"],
+                updated=result["updated"],
+                deleted=result["deleted"],
+            ),
+        )
+    return result
+
+
+def log_metrics(logger, metrics):
+    # One JSON line per import, for comparing runs across deployments
+    logger.info(f"Metrics: {json.dumps(metrics)}")
+    return metrics
+
+
+def upload_hash(file):
+    digest = hashlib.sha256()
+    for chunk in iter(lambda: file.read(1024 * 1024), b""):
+        digest.update(chunk)
+    file.seek(0)
+    return digest.hexdigest()
+
+
+def tab_hashes_hash(tab_hashes):
+    return sheet_values_hash(sorted(tab_hashes.items()))
+
+
+def find_reusable_plan(source, upload_hash, force=False):
+    # A pending preview of the same upload is reused as long as no import has
+    # changed the bank since it was computed
+    plan = ImportPlan.objects.filter(
+        source=source,
+        upload_hash=upload_hash,
+        force=force,
+        status=ImportPlan.Status.PENDING,
+    ).first()
+    if plan is None or plan.is_stale:
+        return None
+    return plan
+
+
+def save_plan(plan_data, source, upload_hash, force, messages, source_state=None):
+    batch_size = get_batch_size()
+    with transaction.atomic():
+        plan = ImportPlan.objects.create(
+            source=source,
+            upload_hash=upload_hash,
+            force=force,
+            create_count=len(plan_data["create"]),
+            update_count=len(plan_data["update"]),
+            delete_count=len(plan_data["delete"]),
+            fingerprints=plan_data["fingerprints"],
+            bank_version=plan_data["bank_version"],
+            source_state=source_state,
+            messages=messages,
+        )
+
+        entries = [
+            ImportPlanEntry(
+                plan=plan,
+                action=ImportPlanEntry.Action.CREATE,
+                category_id=data["category_id"],
+                question_text=data["question_text"],
+                payload={
+                    field: value
+                    for field, value in data.items()
+                    if field != "signature"
+                },
+            )
+            for data in plan_data["create"]
+        ] + [
+            ImportPlanEntry(
+                plan=plan,
+                action=ImportPlanEntry.Action.UPDATE,
+                question_id=data["question_id"],
+                category_id=data["category_id"],
+                question_text=data["question_text"],
+                payload={
+                    field: value for field, value in data.items() if field != "changes"
+                },
+                changes=data["changes"],
+            )
+            for data in plan_data["update"]
+        ]
+        ImportPlanEntry.objects.bulk_create(entries, batch_size=batch_size)
+
+        # Texts of deleted questions are only needed for the preview
+        for batch in chunked(plan_data["delete"], batch_size):
+            rows = Question.objects.filter(question_id__in=batch).values_list(
+                "question_id", "category_id", "question_text"
+            )
+            ImportPlanEntry.objects.bulk_create(
+                [
+                    ImportPlanEntry(
+                        plan=plan,
+                        action=ImportPlanEntry.Action.DELETE,
+                        question_id=question_id,
+                        category_id=category_id,
+                        question_text=question_text,
+                    )
+                    for question_id, category_id, question_text in rows
+                ],
+                batch_size=batch_size,
+            )
+    return plan
+
+
+def load_plan(plan):
+    plan_data = {
+        "create": [],
+        "update": [],
+        "delete": [],
+        "fingerprints": {
+            int(category_id): fingerprint
+            for category_id, fingerprint in plan.fingerprints.items()
+        },
+    }
+    entries = plan.entries.order_by("import_plan_entry_id").values_list(
+        "action", "question_id", "payload"
+    )
+    for action, question_id, payload in entries.iterator(chunk_size=get_batch_size()):
+        if action == ImportPlanEntry.Action.DELETE:
+            plan_data["delete"].append(question_id)
+        else:
+            plan_data[action.lower()].append(payload)
+    return plan_data
+
+
+def plan_stale_error(plan):
+    return Exception(
+        f"{plan} is out of date: the questions changed after it was previewed. "
+        f"Run the preview again."
+    )
+
+
+def apply_plan(plan, progress=no_progress, job=None):
+    # Writes a previewed plan exactly as it was shown, without re-parsing. Always
+    # one transaction: a partly applied plan could not be safely applied again.
+    if plan.status != ImportPlan.Status.PENDING:
+        raise Exception(f"{plan} has already been applied")
+    if plan.is_stale:
+        raise plan_stale_error(plan)
+
+    with import_run(job) as run:
+        logger = run.logger
+        logger.info(f"Applying {plan}")
+        metrics = ImportMetrics()
+        progress = metrics.track(progress)
+        progress(ImportJob.Phase.LOADING, log_file=run.log_file)
+
+        try:
+            with metrics.capture():
+                plan_data = load_plan(plan)
+                with transaction.atomic():
+                    # Claimed and checked again in the writing transaction: a
+                    # second apply of the same plan waits for this one and then
+                    # finds it no longer pending
+                    claimed = ImportPlan.objects.filter(
+                        import_plan_id=plan.import_plan_id,
+                        status=ImportPlan.Status.PENDING,
+                    ).update(
+                        status=ImportPlan.Status.APPLIED, applied_at=timezone.now()
+                    )
+                    if not claimed:
+                        raise Exception(f"{plan} has already been applied")
+                    if plan.bank_version != BankVersion.current(lock=True):
+                        raise plan_stale_error(plan)
+                    created, updated, deleted = write_plan(plan_data, logger, progress)
+                    if plan.source_state:
+                        save_google_sheet_state(plan.source_state, imported=True)
+            logger.info("Data import completed successfully")
+        except Exception as e:
+            logger.error(f"Error applying plan: {str(e)}")
+            log_metrics(logger, metrics.finish(succeeded=False, dry_run=False))
+            raise
+
+        run.created_count = created
+        run.updated_count = updated
+        run.deleted_count = deleted
+        return {
+            "created": created,
+            "updated": updated,
+            "deleted": deleted,
+            "log_file": run.log_file,
+            "messages": plan.messages,
+            "metrics": log_metrics(
+                logger,
+                metrics.finish(
+                    succeeded=True,
+                    dry_run=False,
+                    created=created,
+                    updated=updated,
+                    deleted=deleted,
+                ),
+            ),
+        }
@@ -0,0 +1,338 @@
+from django.conf import settings
+from django.db.models import F, Q
+from django.utils import timezone
+from .importer import (
+    apply_plan,
+    check_google_sheet,
+    find_reusable_plan,
+    get_commit_chunk_size,
+    get_import_workers,
+    process_data,
+    save_google_sheet_state,
+    save_plan,
+    tab_hashes_hash,
+    upload_hash,
+)
+from .models import ImportJob
+from .reference import reset_reference_cache
+from .snapshot import refresh_snapshot
+from .utils import excel_sheet_loaders, iter_excel_sheets
+from datetime import timedelta
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+def get_job_stale_after():
+    # Seconds without a progress report before a running job counts as
+    # abandoned. Reports made inside a write transaction only show once it
+    # commits, so this has to exceed the longest write phase.
+    return getattr(settings, "IMPORT_JOB_STALE_AFTER", 3600)
+
+
+def get_upload_retention_days():
+    return getattr(settings, "IMPORT_UPLOAD_RETENTION_DAYS", 30)
+
+
+def enqueue_excel_import(excel_file, force=False, chunked=False, dry_run=False):
+    return ImportJob.objects.create(
+        source=ImportJob.Source.EXCEL,
+        upload=excel_file,
+        force=force,
+        dry_run=dry_run,
+        commit_chunk_size=get_commit_chunk_size() if chunked else None,
+    )
+
+
+def enqueue_sheets_import(sheet_url, force=False, chunked=False, dry_run=False):
+    return ImportJob.objects.create(
+        source=ImportJob.Source.SHEETS,
+        sheet_url=sheet_url,
+        force=force,
+        dry_run=dry_run,
+        commit_chunk_size=get_commit_chunk_size() if chunked else None,
+    )
+
+
+def enqueue_plan_apply(plan):
+    # A repeated click follows the job already applying the plan
+    pending = ImportJob.objects.filter(
+        source=ImportJob.Source.PLAN,
+        plan=plan,
+        status__in=[ImportJob.Status.QUEUED, ImportJob.Status.RUNNING],
+    ).first()
+    return pending or ImportJob.objects.create(source=ImportJob.Source.PLAN, plan=plan)
+
+
+def resume_job(job):
+    # Re-queues a failed or abandoned job. Chunks it already committed are seen
+    # as existing questions on the rerun, so only the remaining rows are written.
+    # A running job is only abandoned once its worker stopped reporting; the
+    # conditional UPDATE keeps a live one from being queued and run twice.
+    stale_before = timezone.now() - timedelta(seconds=get_job_stale_after())
+    abandoned = Q(status=ImportJob.Status.RUNNING) & (
+        Q(heartbeat_at__lt=stale_before)
+        | Q(heartbeat_at__isnull=True, started_at__lt=stale_before)
+    )
+    return (
+        ImportJob.objects.filter(import_job_id=job.import_job_id)
+        .filter(Q(status=ImportJob.Status.FAILED) | abandoned)
+        .update(
+            status=ImportJob.Status.QUEUED,
+            phase=ImportJob.Phase.PENDING,
+            error="",
+            heartbeat_at=None,
+            finished_at=None,
+        )
+    )
+
+
+def claim_next_job():
+    # The conditional UPDATE makes the claim atomic, so several workers can poll
+    # the same queue without running a job twice
+    queued = ImportJob.objects.filter(status=ImportJob.Status.QUEUED).order_by(
+        "created_at"
+    )
+    for job_id in queued.values_list("import_job_id", flat=True)[:10]:
+        claimed = ImportJob.objects.filter(
+            import_job_id=job_id, status=ImportJob.Status.QUEUED
+        ).update(
+            status=ImportJob.Status.RUNNING,
+            started_at=timezone.now(),
+            heartbeat_at=timezone.now(),
+        )
+        if claimed:
+            return ImportJob.objects.get(import_job_id=job_id)
+    return None
+
+
+def job_progress(job):
+    def progress(phase, committed=None, **fields):
+        if committed:
+            # Counts accumulate across resumed runs of the same job
+            for name, count in committed.items():
+                fields[f"{name}_count"] = F(f"{name}_count") + count
+            if job.commit_chunk_size:
+                fields["chunks_committed"] = F("chunks_committed") + 1
+            fields["checkpoint_at"] = timezone.now()
+        ImportJob.objects.filter(import_job_id=job.import_job_id).update(
+            phase=phase, heartbeat_at=timezone.now(), **fields
+        )
+
+    return progress
+
+
+def store_plan(job, result, source_hash, source_state=None):
+    plan = save_plan(
+        result.pop("plan"),
+        job.source,
+        source_hash,
+        job.force,
+        result["messages"],
+        source_state,
+    )
+    ImportJob.objects.filter(import_job_id=job.import_job_id).update(plan=plan)
+    result["messages"].insert(
+        0,
+        {
+            "level": "INFO",
+            "message": f"Dry run: {plan.create_count} to create, {plan.update_count} to update, "
+            f"{plan.delete_count} to delete. Review and apply {plan}.",
+        },
+    )
+    return result
+
+
+def reuse_plan(job, plan):
+    ImportJob.objects.filter(import_job_id=job.import_job_id).update(plan=plan)
+    return {
+        "created": 0,
+        "updated": 0,
+        "deleted": 0,
+        "log_file": "",
+        "messages": [
+            {
+                "level": "INFO",
+                "message": f"The same upload was already previewed as {plan}; reusing it.",
+            }
+        ],
+    }
+
+
+def run_excel_import(job):
+    if not job.upload:
+        raise Exception("The uploaded workbook of this job has been removed")
+    if job.dry_run:
+        with job.upload.open("rb") as excel_file:
+            source_hash = upload_hash(excel_file)
+        plan = find_reusable_plan(job.source, source_hash, job.force)
+        if plan is not None:
+            return reuse_plan(job, plan)
+
+    excel_path = None
+    if get_import_workers() > 1:
+        try:
+            excel_path = job.upload.path
+        except NotImplementedError:
+            pass
+
+    if excel_path:
+        # Each worker process opens the file and parses only its own sheet
+        result = process_data(
+            excel_sheet_loaders(excel_path),
+            job_progress(job),
+            force=job.force,
+            commit_chunk_size=job.commit_chunk_size,
+            dry_run=job.dry_run,
+            job=job,
+        )
+    else:
+        with job.upload.open("rb") as excel_file:
+            result = process_data(
+                iter_excel_sheets(excel_file),
+                job_progress(job),
+                force=job.force,
+                commit_chunk_size=job.commit_chunk_size,
+                dry_run=job.dry_run,
+                job=job,
+            )
+
+    if job.dry_run:
+        return store_plan(job, result, source_hash)
+    return result
+
+
+def run_sheets_import(job):
+    check = check_google_sheet(job.sheet_url, force=job.force)
+    if check["data"] is None:
+        save_google_sheet_state(check, imported=False)
+        return {
+            "created": 0,
+            "updated": 0,
+            "deleted": 0,
+            "log_file": "",
+            "messages": [
+                {
+                    "level": "INFO",
+                    "message": "No changes in the spreadsheet since the last import.",
+                }
+            ],
+        }
+
+    if job.dry_run:
+        source_hash = tab_hashes_hash(check["tab_hashes"])
+        plan = find_reusable_plan(job.source, source_hash, job.force)
+        if plan is not None:
+            return reuse_plan(job, plan)
+
+    result = process_data(
+        check["data"].items(),
+        job_progress(job),
+        force=job.force,
+        commit_chunk_size=job.commit_chunk_size,
+        dry_run=job.dry_run,
+        job=job,
+    )
+    if check["changed_tabs"]:
+        result["messages"].insert(
+            0,
+            {
+                "level": "INFO",
+                "message": f"Changed tabs: {', '.join(check['changed_tabs'])}",
+            },
+        )
+
+    if job.dry_run:
+        # The spreadsheet state is only recorded once the plan is applied
+        source_state = {
+            "spreadsheet_id": check["spreadsheet_id"],
+            "revision": check["revision"],
+            "tab_hashes": check["tab_hashes"],
+        }
+        return store_plan(job, result, source_hash, source_state)
+
+    save_google_sheet_state(check, imported=True)
+    return result
+
+
+def run_plan_import(job):
+    if job.plan is None:
+        raise Exception("The plan for this job no longer exists")
+    return apply_plan(job.plan, job_progress(job), job=job)
+
+
+def discard_upload(job):
+    if not job.upload:
+        return
+    try:
+        job.upload.delete(save=False)
+    except OSError as e:
+        logger.warning(f"Could not remove the upload of {job}: {str(e)}")
+        return
+    ImportJob.objects.filter(import_job_id=job.import_job_id).update(upload="")
+
+
+def prune_import_uploads(retention_days=None):
+    # Workbooks of failed jobs are kept so they can be resumed, up to the
+    # retention period
+    retention_days = (
+        get_upload_retention_days() if retention_days is None else retention_days
+    )
+    if not retention_days:
+        return 0
+    cutoff = timezone.now() - timedelta(days=retention_days)
+    removed = 0
+    for job in (
+        ImportJob.objects.filter(status=ImportJob.Status.FAILED, finished_at__lt=cutoff)
+        .exclude(upload="")
+        .exclude(upload__isnull=True)
+    ):
+        discard_upload(job)
+        removed += 1
+    return removed
+
+
+JOB_RUNNERS = {
+    ImportJob.Source.EXCEL: run_excel_import,
+    ImportJob.Source.SHEETS: run_sheets_import,
+    ImportJob.Source.PLAN: run_plan_import,
+}
+
+
+def run_job(job):
+    logger.info(f"Running {job}")
+    # Admin edits to categories and product types only clear the cache of the
+    # process that made them, so each job starts from a fresh copy
+    reset_reference_cache()
+    try:
+        result = JOB_RUNNERS[job.source](job)
+    except Exception as e:
+        ImportJob.objects.filter(import_job_id=job.import_job_id).update(
+            status=ImportJob.Status.FAILED,
+            error=str(e),
+            finished_at=timezone.now(),
+        )
+        logger.error(f"{job} failed: {str(e)}")
+        prune_import_uploads()
+        return False
+
+    ImportJob.objects.filter(import_job_id=job.import_job_id).update(
+        status=ImportJob.Status.SUCCEEDED,
+        phase=ImportJob.Phase.DONE,
+        log_file=result["log_file"],
+        messages=result["messages"],
+        metrics=result.get("metrics", {}),
+        finished_at=timezone.now(),
+    )
+    logger.info(f"{job} finished")
+    # Plans are stored as entries, so nothing reads the workbook again
+    discard_upload(job)
+
+    if not job.dry_run:
+        # Game servers read the bank from the snapshot; a failed rebuild leaves
+        # the previous one in place and is retried after the next import
+        try:
+            refresh_snapshot()
+        except Exception as e:
+            logger.error(f"Could not rebuild the question snapshot: {str(e)}")
+    return True
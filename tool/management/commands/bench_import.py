@@ -0,0 +1,172 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from tool.benchmark import (
+    baseline_key,
+    find_regressions,
+    generate_workbook,
+    load_baseline,
+    run_import,
+    save_baseline,
+    throwaway_database,
+)
+import os
+import tempfile
+import time
+
+
+def megabytes(value, sign=""):
+    # None where the RSS can't be read on this platform
+    return "n/a" if value is None else f"{value / 1024 / 1024:{sign}.0f} MB"
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark imports end to end on generated workbooks: a first import into "
+        "an empty bank, a forced re-import of the same workbook, then a revision "
+        "with updates, deletes, new and duplicate rows. Runs against a throwaway "
+        "test database (set SQLITE_DATABASE to use SQLite) and compares each "
+        "phase with the stored baseline."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, default=10000)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--product-ratio", type=float, default=0.2)
+        parser.add_argument("--duplicate-ratio", type=float, default=0.01)
+        parser.add_argument("--update-ratio", type=float, default=0.05)
+        parser.add_argument("--delete-ratio", type=float, default=0.02)
+        parser.add_argument("--new-ratio", type=float, default=0.05)
+        parser.add_argument(
+            "--chunk-size",
+            type=int,
+            help="Commit in chunks of this many questions, like a resumable import",
+        )
+        parser.add_argument(
+            "--baseline",
+            default=os.path.join(
+                settings.BASE_DIR, "benchmarks", "import_baseline.json"
+            ),
+        )
+        parser.add_argument(
+            "--save-baseline",
+            action="store_true",
+            help="Record this run as the baseline for its database and row count",
+        )
+        parser.add_argument(
+            "--tolerance",
+            type=float,
+            default=0.2,
+            help="Flag metrics more than this fraction above the baseline",
+        )
+        parser.add_argument(
+            "--workbook-dir", help="Keep the generated workbooks in this directory"
+        )
+
+    def handle(self, *args, **options):
+        rows = options["rows"]
+        mix = {
+            "seed": options["seed"],
+            "product_ratio": options["product_ratio"],
+            "duplicate_ratio": options["duplicate_ratio"],
+        }
+
+        with tempfile.TemporaryDirectory() as temp_dir:
+            workbook_dir = options["workbook_dir"] or temp_dir
+            os.makedirs(workbook_dir, exist_ok=True)
+            first = os.path.join(workbook_dir, f"bench_{rows}.xlsx")
+            revised = os.path.join(workbook_dir, f"bench_{rows}_revised.xlsx")
+
+            started = time.perf_counter()
+            written = generate_workbook(first, rows, **mix)
+            written_revised = generate_workbook(
+                revised,
+                rows,
+                update_ratio=options["update_ratio"],
+                delete_ratio=options["delete_ratio"],
+                new_ratio=options["new_ratio"],
+                revision=1,
+                **mix,
+            )
+            self.stdout.write(
+                f"Generated {written} and {written_revised} rows "
+                f"in {time.perf_counter() - started:.1f}s"
+            )
+
+            scenarios = self.run_scenarios(
+                [
+                    ("initial", first, False),
+                    ("unchanged", first, True),
+                    ("revised", revised, False),
+                ],
+                options["chunk_size"],
+                temp_dir,
+            )
+
+        for name, metrics in scenarios.items():
+            self.report(name, metrics)
+
+        baseline = load_baseline(options["baseline"])
+        baseline_run = baseline["runs"].get(baseline_key(rows))
+        regressions = []
+        if baseline_run is None:
+            self.stdout.write(f"No baseline for {baseline_key(rows)} yet")
+        else:
+            regressions = find_regressions(
+                scenarios, baseline_run, options["tolerance"]
+            )
+            for regression in regressions:
+                self.stdout.write(self.style.ERROR(f"Regression: {regression}"))
+            if not regressions:
+                self.stdout.write(
+                    self.style.SUCCESS(
+                        f"No regressions against the {baseline_key(rows)} baseline "
+                        f"from {baseline_run['recorded_at']}"
+                    )
+                )
+
+        if options["save_baseline"]:
+            recorded = {
+                name: options[name]
+                for name in [
+                    "seed",
+                    "product_ratio",
+                    "duplicate_ratio",
+                    "update_ratio",
+                    "delete_ratio",
+                    "new_ratio",
+                    "chunk_size",
+                ]
+            }
+            save_baseline(options["baseline"], rows, recorded, scenarios)
+            self.stdout.write(f"Saved the baseline to {options['baseline']}")
+        elif regressions:
+            raise CommandError(f"{len(regressions)} metric(s) regressed")
+
+    def run_scenarios(self, scenarios, chunk_size, temp_dir):
+        results = {}
+        with throwaway_database(temp_dir):
+            for name, path, force in scenarios:
+                self.stdout.write(f"Running {name}...")
+                results[name] = run_import(path, force, chunk_size)
+        return results
+
+    def report(self, name, metrics):
+        self.stdout.write(
+            f"{name}: {metrics['wall']:.2f}s wall, {metrics['cpu']:.2f}s CPU, "
+            f"{metrics['queries']} queries ({metrics['query_time']:.2f}s), "
+            f"{metrics['created']}/{metrics['updated']}/{metrics['deleted']} "
+            f"created/updated/deleted, {megabytes(metrics['rss_peak'])} peak RSS "
+            f"({megabytes(metrics['rss_growth'], '+')} growth)"
+        )
+        for phase, stats in metrics["phases"].items():
+            throughput = (
+                f", {stats['rows_per_second']:,.0f} rows/s"
+                if stats["rows_per_second"]
+                else ""
+            )
+            self.stdout.write(
+                f"  {phase:<8} {stats['wall']:8.2f}s wall {stats['cpu']:8.2f}s CPU "
+                f"{stats['queries']:6} queries {stats['query_time']:6.2f}s "
+                f"{megabytes(stats['rss_peak']):>8} peak "
+                f"{megabytes(stats['rss_growth'], '+'):>8}{throughput}"
+            )
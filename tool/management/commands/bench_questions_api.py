@@ -0,0 +1,83 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import RequestFactory
+from django.test.utils import CaptureQueriesContext
+from tool.benchmark import generate_workbook, run_import, throwaway_database
+from tool.views import question_list
+import json
+import os
+import tempfile
+import time
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure throughput of the questions read API by paging through the "
+        "whole bank, then revalidating every page with its ETag. Runs against a "
+        "throwaway test database filled by importing a generated workbook, so "
+        "the configured bank is never touched."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rows",
+            type=int,
+            default=10000,
+            help="Questions in the generated workbook imported before measuring",
+        )
+        parser.add_argument("--limit", type=int, default=100, help="Page size")
+        parser.add_argument("--category", type=int, help="Only page one category")
+
+    def handle(self, *args, **options):
+        with tempfile.TemporaryDirectory() as temp_dir:
+            path = os.path.join(temp_dir, "bench.xlsx")
+            generate_workbook(path, options["rows"])
+            with throwaway_database(temp_dir):
+                # Through the importer, so bank version, sampling buckets and
+                # fingerprints match the questions as they would in production
+                metrics = run_import(path)
+                self.stdout.write(
+                    f"Imported {metrics['created']} questions in {metrics['wall']:.1f}s"
+                )
+                self.measure(options)
+
+    def measure(self, options):
+        factory = RequestFactory()
+        params = {"limit": options["limit"]}
+        if options["category"] is not None:
+            params["category"] = options["category"]
+
+        pages = []
+        questions = queries = 0
+        started = time.perf_counter()
+        after = 0
+        while after is not None:
+            request = factory.get("/api/questions/", {**params, "after": after})
+            with CaptureQueriesContext(connection) as captured:
+                response = question_list(request)
+            data = json.loads(response.content)
+            pages.append((after, response["ETag"]))
+            questions += len(data["results"])
+            queries += len(captured.captured_queries)
+            after = data["next"]
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Full scan: {questions} questions in {len(pages)} pages, {elapsed:.2f}s "
+            f"({questions / elapsed:,.0f} questions/s, {len(pages) / elapsed:,.0f} pages/s, "
+            f"{queries / len(pages):.1f} queries/page)"
+        )
+
+        not_modified = 0
+        started = time.perf_counter()
+        for after, etag in pages:
+            request = factory.get(
+                "/api/questions/", {**params, "after": after}, HTTP_IF_NONE_MATCH=etag
+            )
+            not_modified += question_list(request).status_code == 304
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(
+            f"Revalidation: {not_modified}/{len(pages)} pages not modified, {elapsed:.2f}s "
+            f"({len(pages) / elapsed:,.0f} requests/s)"
+        )
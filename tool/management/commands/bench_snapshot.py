@@ -0,0 +1,178 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from tool.importer import get_batch_size
+from tool.metrics import current_rss
+from tool.models import Option, Question
+from tool.snapshot import Snapshot, build_snapshot, get_snapshot_path
+from itertools import islice
+import json
+import os
+import subprocess
+import sys
+import time
+
+
+def load_from_orm():
+    # What a game server does without the snapshot: every question with its
+    # options, in memory
+    batch_size = get_batch_size()
+    bank = {}
+    rows = (
+        Question.objects.order_by("question_id")
+        .values_list(
+            "question_id",
+            "category_id",
+            "question_text",
+            "time_limit",
+            "is_product_question",
+            "product_type__name",
+            "hint",
+        )
+        .iterator(chunk_size=batch_size)
+    )
+    while batch := list(islice(rows, batch_size)):
+        for (
+            question_id,
+            category_id,
+            text,
+            time_limit,
+            is_product,
+            product,
+            hint,
+        ) in batch:
+            bank[question_id] = {
+                "id": question_id,
+                "category": category_id,
+                "text": text,
+                "time_limit": time_limit,
+                "is_product_question": is_product,
+                "product_type": product,
+                "hint": hint,
+                "options": [],
+            }
+        option_rows = (
+            Option.objects.filter(question_id__in=[row[0] for row in batch])
+            .order_by("question_id", "option_id")
+            .values_list("question_id", "option_id", "option_text", "is_correct")
+        )
+        for question_id, option_id, option_text, is_correct in option_rows:
+            bank[question_id]["options"].append(
+                {"id": option_id, "text": option_text, "is_correct": is_correct}
+            )
+    return bank
+
+
+class Command(BaseCommand):
+    help = (
+        "Compare loading the question bank from the memory-mapped snapshot with "
+        "loading it through the ORM. Each measurement runs in a fresh process."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild", action="store_true", help="Build the snapshot first"
+        )
+        parser.add_argument(
+            "--lookups",
+            type=int,
+            default=100000,
+            help="Random question lookups by ID against the loaded bank",
+        )
+        parser.add_argument(
+            "--mode", choices=["orm", "snapshot"], help="Run one measurement in-process"
+        )
+
+    def handle(self, *args, **options):
+        if options["mode"]:
+            self.stdout.write(
+                json.dumps(self.measure(options["mode"], options["lookups"]))
+            )
+            return
+
+        path = get_snapshot_path()
+        if options["rebuild"] or not os.path.exists(path):
+            built = build_snapshot(path)
+            self.stdout.write(
+                f"Built {path}: {built['questions']} questions, "
+                f"{built['size'] / 1024 / 1024:.1f} MB"
+            )
+
+        for mode in ["orm", "snapshot"]:
+            output = subprocess.run(
+                [
+                    sys.executable,
+                    os.path.join(settings.BASE_DIR, "manage.py"),
+                    "bench_snapshot",
+                    "--mode",
+                    mode,
+                    "--lookups",
+                    str(options["lookups"]),
+                ],
+                check=True,
+                capture_output=True,
+                text=True,
+            ).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            self.stdout.write(
+                f"{mode}: {result['questions']} questions, ready in {result['load']:.3f}s, "
+                f"full scan {result['scan']:.3f}s, {result['lookups']} lookups "
+                f"{result['lookup']:.3f}s ({result['fetch']:.3f}s with payloads), RSS +{result['rss_load'] / 1024 / 1024:.1f} MB "
+                f"after load, +{result['rss_scan'] / 1024 / 1024:.1f} MB after scan"
+            )
+
+    def measure(self, mode, lookups):
+        baseline = current_rss() or 0
+        started = time.perf_counter()
+        if mode == "orm":
+            bank = load_from_orm()
+            question_ids = list(bank)
+            find = fetch = bank.__getitem__
+        else:
+            snapshot = Snapshot(get_snapshot_path())
+            question_ids = snapshot.question_id
+            find = snapshot.find
+            fetch = lambda question_id: snapshot.question(snapshot.find(question_id))
+        load = time.perf_counter() - started
+        rss_load = (current_rss() or 0) - baseline
+
+        # Touch every question and option, as a server warming its caches would
+        started = time.perf_counter()
+        if mode == "orm":
+            for question in bank.values():
+                len(question["text"])
+                for option in question["options"]:
+                    len(option["text"])
+        else:
+            for row in range(len(snapshot)):
+                len(snapshot.text(row))
+                for option in snapshot.options(row):
+                    len(option[1])
+        scan = time.perf_counter() - started
+        rss_scan = (current_rss() or 0) - baseline
+
+        # Finding a question by ID, then also decoding it into a payload, which
+        # the ORM bank has already paid for while loading
+        count = len(question_ids)
+        probes = [
+            question_ids[index * 7919 % count]
+            for index in range(lookups if count else 0)
+        ]
+        started = time.perf_counter()
+        for question_id in probes:
+            find(question_id)
+        lookup = time.perf_counter() - started
+        started = time.perf_counter()
+        for question_id in probes:
+            fetch(question_id)
+        fetch_time = time.perf_counter() - started
+
+        return {
+            "questions": count,
+            "load": load,
+            "scan": scan,
+            "lookups": lookups if count else 0,
+            "lookup": lookup,
+            "fetch": fetch_time,
+            "rss_load": rss_load,
+            "rss_scan": rss_scan,
+        }
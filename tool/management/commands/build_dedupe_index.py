@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand
+from tool.dedupe import index_question_ids
+from tool.importer import get_batch_size
+from tool.models import Question, QuestionSignature, QuestionSignatureBand
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the near-duplicate index for questions that are not in it yet, "
+        "e.g. questions that existed before the index was introduced."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--rebuild",
+            action="store_true",
+            help="Drop the whole index first, e.g. after changing its parameters",
+        )
+        parser.add_argument("--batch-size", type=int, default=get_batch_size())
+
+    def handle(self, *args, **options):
+        batch_size = options["batch_size"]
+        if options["rebuild"]:
+            QuestionSignatureBand.objects.all().delete()
+            QuestionSignature.objects.all().delete()
+            self.stdout.write("Dropped the existing index")
+
+        missing = Question.objects.filter(signature__isnull=True).order_by(
+            "question_id"
+        )
+        indexed = 0
+        last_id = 0
+        while True:
+            batch = list(
+                missing.filter(question_id__gt=last_id).values_list(
+                    "question_id", flat=True
+                )[:batch_size]
+            )
+            if not batch:
+                break
+            indexed += index_question_ids(batch, batch_size)
+            last_id = batch[-1]
+            self.stdout.write(f"Indexed {indexed} questions")
+
+        self.stdout.write(self.style.SUCCESS(f"Indexed {indexed} questions"))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand, CommandError
+from tool.importer import get_batch_size
+from tool.snapshot import (
+    SnapshotError,
+    build_snapshot,
+    get_snapshot_path,
+    refresh_snapshot,
+)
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the memory-mapped question snapshot game servers load the bank "
+        "from. Imports rebuild it automatically; run this after restoring a "
+        "backup or editing the database directly."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--output", help="File to write instead of QUESTION_SNAPSHOT_PATH"
+        )
+        parser.add_argument(
+            "--if-stale",
+            action="store_true",
+            help="Skip the build when the snapshot already matches the bank version",
+        )
+        parser.add_argument("--batch-size", type=int, default=get_batch_size())
+
+    def handle(self, *args, **options):
+        path = options["output"] or get_snapshot_path()
+        if not path:
+            raise CommandError("Set QUESTION_SNAPSHOT_PATH or pass --output")
+
+        try:
+            if options["if_stale"] and not options["output"]:
+                built = refresh_snapshot()
+            else:
+                built = build_snapshot(path, options["batch_size"])
+        except SnapshotError as e:
+            raise CommandError(str(e))
+
+        if built is None:
+            self.stdout.write("The snapshot is up to date")
+            return
+        self.stdout.write(
+            self.style.SUCCESS(
+                f"Wrote {built['questions']} questions and {built['options']} options "
+                f"at bank version {built['bank_version']} to {built['path']} "
+                f"({built['size'] / 1024 / 1024:.1f} MB)"
+            )
+        )
@@ -0,0 +1,45 @@
+from django.core.management.base import BaseCommand, CommandError
+from tool.export import EXPORT_FORMATS, iter_csv, iter_jsonl, write_xlsx
+from tool.models import Question
+
+
+class Command(BaseCommand):
+    help = (
+        "Export the question bank in the import layout (one sheet per category "
+        "for XLSX), streaming so memory stays flat on large banks."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--format", choices=sorted(EXPORT_FORMATS), default="xlsx")
+        parser.add_argument(
+            "--output", help="File to write; CSV and JSONL default to stdout"
+        )
+        parser.add_argument(
+            "--category", type=int, action="append", help="Only these category IDs"
+        )
+
+    def handle(self, *args, **options):
+        queryset = Question.objects.all()
+        if options["category"]:
+            queryset = queryset.filter(category_id__in=options["category"])
+
+        export_format = options["format"]
+        if export_format == "xlsx":
+            if not options["output"]:
+                raise CommandError("--output is required for XLSX exports")
+            write_xlsx(options["output"], queryset)
+        else:
+            chunks = (
+                iter_csv(queryset) if export_format == "csv" else iter_jsonl(queryset)
+            )
+            if options["output"]:
+                with open(
+                    options["output"], "w", encoding="utf-8", newline=""
+                ) as output:
+                    output.writelines(chunks)
+            else:
+                for chunk in chunks:
+                    self.stdout.write(chunk, ending="")
+
+        if options["output"]:
+            self.stdout.write(self.style.SUCCESS(f"Exported to {options['output']}"))
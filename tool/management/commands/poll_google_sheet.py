@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from tool.jobs import enqueue_sheets_import
+from tool.models import ImportJob
+
+
+class Command(BaseCommand):
+    help = (
+        "Queue an import of a Google spreadsheet, meant to be run on a schedule. "
+        "The job itself skips downloading values when the spreadsheet is unchanged."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("sheet_url")
+        parser.add_argument(
+            "--force",
+            action="store_true",
+            help="Re-import even if the spreadsheet has not changed",
+        )
+
+    def handle(self, *args, **options):
+        pending = ImportJob.objects.filter(
+            sheet_url=options["sheet_url"],
+            status__in=[ImportJob.Status.QUEUED, ImportJob.Status.RUNNING],
+        )
+        if pending.exists():
+            self.stdout.write("An import of this spreadsheet is already pending")
+            return
+
+        job = enqueue_sheets_import(options["sheet_url"], force=options["force"])
+        self.stdout.write(self.style.SUCCESS(f"Queued {job}"))
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+from tool.jobs import claim_next_job, run_job
+import time
+
+
+class Command(BaseCommand):
+    help = "Claim and run queued question import jobs"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--interval",
+            type=float,
+            default=2.0,
+            help="Seconds to wait between polls when the queue is empty",
+        )
+        parser.add_argument(
+            "--once",
+            action="store_true",
+            help="Run every queued job and exit instead of polling forever",
+        )
+
+    def handle(self, *args, **options):
+        self.stdout.write("Import worker started")
+        while True:
+            job = claim_next_job()
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["interval"])
+                continue
+
+            self.stdout.write(f"Running {job}")
+            if run_job(job):
+                self.stdout.write(self.style.SUCCESS(f"{job} succeeded"))
+            else:
+                self.stdout.write(self.style.ERROR(f"{job} failed"))
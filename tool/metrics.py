@@ -0,0 +1,196 @@
+from django.db import connection
+from .models import ImportJob
+import os
+import threading
+import time
+
+# How often the RSS sampler reads /proc while an import runs, in seconds
+RSS_SAMPLE_INTERVAL = 0.02
+
+
+def current_rss():
+    # Resident set size in bytes, or None where /proc is not available
+    try:
+        with open("/proc/self/statm") as statm:
+            return int(statm.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return None
+
+
+class RssSampler:
+    # Reads the RSS on a background thread and keeps the highest value since the
+    # last reset(), so a phase that allocates and frees again still shows its
+    # spike
+    def __init__(self, interval=RSS_SAMPLE_INTERVAL):
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.peak = current_rss()
+        self.thread = threading.Thread(target=self.run, daemon=True)
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            self.sample()
+
+    def sample(self):
+        rss = current_rss()
+        with self.lock:
+            self.peak = max(self.peak, rss)
+        return rss
+
+    def reset(self):
+        # The peak since the last reset; the next one starts from the RSS now
+        rss = self.sample()
+        with self.lock:
+            peak, self.peak = self.peak, rss
+        return peak
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+
+
+class ImportMetrics:
+    # Wall time, CPU time, queries and memory of one import, split by the
+    # ImportJob.Phase it reports through progress(). Used as a connection execute
+    # wrapper to count the queries of the thread running the import; parsing
+    # workers in other processes are not included in the CPU time. Memory is the
+    # sampled peak RSS of each phase, plus the RSS at its start and end and the
+    # growth in between; all of them are None where /proc is not available.
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.cpu_started = time.process_time()
+        self.rss_started = current_rss()
+        self.rss_peak = self.rss_started
+        self.sampler = RssSampler().start() if self.rss_started is not None else None
+        self.queries = 0
+        self.query_time = 0.0
+        self.rows_total = 0
+        self.phases = {}
+        self.phase = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries += 1
+            self.query_time += time.perf_counter() - started
+
+    def capture(self):
+        return connection.execute_wrapper(self)
+
+    def snapshot(self):
+        return (
+            time.perf_counter(),
+            time.process_time(),
+            self.queries,
+            self.query_time,
+            current_rss(),
+        )
+
+    def switch(self, phase):
+        if phase == self.phase:
+            return
+        self.close_phase()
+        self.phase = phase
+        if self.sampler:
+            self.sampler.reset()
+        self.phase_started = self.snapshot()
+        stats = self.phases.setdefault(
+            phase,
+            {
+                "wall": 0.0,
+                "cpu": 0.0,
+                "queries": 0,
+                "query_time": 0.0,
+                "rss_growth": None,
+                "rss_peak": None,
+                "rows": None,
+            },
+        )
+        stats.setdefault("rss_start", self.phase_started[-1])
+
+    def close_phase(self):
+        if self.phase is None:
+            return
+        stats = self.phases[self.phase]
+        now = self.snapshot()
+        for name, value, started in zip(
+            ["wall", "cpu", "queries", "query_time"], now, self.phase_started
+        ):
+            stats[name] += value - started
+        stats["rss_end"] = now[-1]
+        if self.sampler:
+            stats["rss_growth"] = (stats["rss_growth"] or 0) + (
+                now[-1] - self.phase_started[-1]
+            )
+            # A phase entered more than once keeps its highest peak
+            peak = self.sampler.reset()
+            stats["rss_peak"] = max(stats["rss_peak"] or 0, peak)
+            self.rss_peak = max(self.rss_peak, peak)
+        self.phase = None
+
+    def track(self, progress):
+        # Wraps a progress callback so every phase change is timed, and the row
+        # counts it reports are kept for throughput
+        def tracked(phase, committed=None, **fields):
+            self.switch(phase)
+            stats = self.phases[phase]
+            if "rows_processed" in fields:
+                stats["rows"] = fields["rows_processed"]
+            if "rows_total" in fields:
+                self.rows_total = fields["rows_total"]
+            if committed is not None:
+                stats["rows"] = (stats["rows"] or 0) + sum(committed.values())
+                fields["committed"] = committed
+            progress(phase, **fields)
+
+        return tracked
+
+    def finish(self, **summary):
+        self.close_phase()
+        wall = time.perf_counter() - self.started
+        rss = current_rss()
+        if self.sampler:
+            self.sampler.stop()
+            self.rss_peak = max(self.rss_peak, self.sampler.reset())
+        phases = {}
+        for phase, stats in self.phases.items():
+            rows = stats["rows"]
+            if rows is None and phase == ImportJob.Phase.DIFFING:
+                rows = self.rows_total
+            phases[str(phase)] = {
+                "wall": round(stats["wall"], 4),
+                "cpu": round(stats["cpu"], 4),
+                "queries": stats["queries"],
+                "query_time": round(stats["query_time"], 4),
+                "rows": rows,
+                "rows_per_second": (
+                    round(rows / stats["wall"], 1) if rows and stats["wall"] else None
+                ),
+                "rss_start": stats["rss_start"],
+                "rss_end": stats["rss_end"],
+                "rss_growth": stats["rss_growth"],
+                "rss_peak": stats["rss_peak"],
+            }
+        return {
+            **summary,
+            "wall": round(wall, 4),
+            "cpu": round(time.process_time() - self.cpu_started, 4),
+            "queries": self.queries,
+            "query_time": round(self.query_time, 4),
+            "rows": self.rows_total,
+            "rows_per_second": (
+                round(self.rows_total / wall, 1) if self.rows_total and wall else None
+            ),
+            "rss_start": self.rss_started,
+            "rss_end": rss,
+            "rss_growth": rss - self.rss_started if self.sampler else None,
+            "rss_peak": self.rss_peak,
+            "phases": phases,
+        }
@@ -0,0 +1,84 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportJob",
+            fields=[
+                ("import_job_id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("EXCEL", "Excel upload"),
+                            ("SHEETS", "Google Sheets"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "upload",
+                    models.FileField(blank=True, null=True, upload_to="imports/"),
+                ),
+                ("sheet_url", models.URLField(blank=True, max_length=500)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("QUEUED", "Queued"),
+                            ("RUNNING", "Running"),
+                            ("SUCCEEDED", "Succeeded"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="QUEUED",
+                        max_length=10,
+                    ),
+                ),
+                (
+                    "phase",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Waiting for a worker"),
+                            ("PARSING", "Parsing and validating sheets"),
+                            ("LOADING", "Loading existing questions"),
+                            ("DIFFING", "Comparing with existing questions"),
+                            ("WRITING", "Writing changes"),
+                            ("DONE", "Done"),
+                        ],
+                        default="PENDING",
+                        max_length=10,
+                    ),
+                ),
+                ("rows_processed", models.IntegerField(default=0)),
+                ("rows_total", models.IntegerField(default=0)),
+                ("created_count", models.IntegerField(default=0)),
+                ("updated_count", models.IntegerField(default=0)),
+                ("deleted_count", models.IntegerField(default=0)),
+                ("log_file", models.CharField(blank=True, max_length=255)),
+                ("messages", models.JSONField(blank=True, default=list)),
+                ("error", models.TextField(blank=True)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("started_at", models.DateTimeField(blank=True, null=True)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "import_jobs",
+                "ordering": ["-created_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "created_at"],
+                        name="import_jobs_status_aedc42_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:18
+
+from django.db import migrations, models
+import hashlib
+
+
+def backfill_text_hash(apps, schema_editor):
+    # Historical models do not have Question.save(), so hash explicitly
+    Question = apps.get_model("tool", "Question")
+    last_id = 0
+    while True:
+        batch = list(
+            Question.objects.filter(question_id__gt=last_id)
+            .order_by("question_id")
+            .only("question_id", "question_text")[:2000]
+        )
+        if not batch:
+            break
+        for question in batch:
+            normalized = " ".join(str(question.question_text).split())
+            question.text_hash = hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+        Question.objects.bulk_update(batch, ["text_hash"])
+        last_id = batch[-1].question_id
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0002_import_job"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="question",
+            name="text_hash",
+            field=models.CharField(default="", editable=False, max_length=64),
+        ),
+        migrations.RunPython(backfill_text_hash, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="question",
+            index=models.Index(fields=["text_hash"], name="questions_text_hash_idx"),
+        ),
+        migrations.AddIndex(
+            model_name="question",
+            index=models.Index(
+                fields=["category", "text_hash"], name="questions_cat_text_hash_idx"
+            ),
+        ),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:20
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0003_question_text_hash"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SheetFingerprint",
+            fields=[
+                (
+                    "category",
+                    models.OneToOneField(
+                        db_column="category_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        serialize=False,
+                        to="tool.category",
+                    ),
+                ),
+                ("fingerprint", models.CharField(max_length=64)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "sheet_fingerprints",
+            },
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="force",
+            field=models.BooleanField(
+                default=False,
+                help_text="Re-import sheets even if they have not changed",
+            ),
+        ),
+    ]
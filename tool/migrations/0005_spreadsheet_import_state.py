@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0004_sheet_fingerprint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SpreadsheetImportState",
+            fields=[
+                (
+                    "spreadsheet_id",
+                    models.CharField(max_length=200, primary_key=True, serialize=False),
+                ),
+                ("revision", models.CharField(blank=True, max_length=100)),
+                ("tab_hashes", models.JSONField(blank=True, default=dict)),
+                ("checked_at", models.DateTimeField(auto_now=True)),
+                ("imported_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "spreadsheet_import_states",
+            },
+        ),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:28
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0005_spreadsheet_import_state"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="checkpoint_at",
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="chunks_committed",
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="commit_chunk_size",
+            field=models.PositiveIntegerField(
+                blank=True,
+                help_text="Commit every N questions so an interrupted import can resume; empty writes everything in one transaction",
+                null=True,
+            ),
+        ),
+    ]
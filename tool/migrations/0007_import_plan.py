@@ -0,0 +1,130 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:30
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0006_import_job_checkpoint"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportPlan",
+            fields=[
+                ("import_plan_id", models.AutoField(primary_key=True, serialize=False)),
+                (
+                    "source",
+                    models.CharField(
+                        choices=[
+                            ("EXCEL", "Excel upload"),
+                            ("SHEETS", "Google Sheets"),
+                            ("PLAN", "Previewed plan"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("upload_hash", models.CharField(db_index=True, max_length=64)),
+                ("force", models.BooleanField(default=False)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("PENDING", "Waiting for review"),
+                            ("APPLIED", "Applied"),
+                        ],
+                        default="PENDING",
+                        max_length=10,
+                    ),
+                ),
+                ("create_count", models.IntegerField(default=0)),
+                ("update_count", models.IntegerField(default=0)),
+                ("delete_count", models.IntegerField(default=0)),
+                ("fingerprints", models.JSONField(blank=True, default=dict)),
+                ("source_state", models.JSONField(blank=True, null=True)),
+                ("messages", models.JSONField(blank=True, default=list)),
+                ("created_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("applied_at", models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                "db_table": "import_plans",
+                "ordering": ["-created_at"],
+            },
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="dry_run",
+            field=models.BooleanField(
+                default=False,
+                help_text="Only compute the changes for review, write nothing",
+            ),
+        ),
+        migrations.AlterField(
+            model_name="importjob",
+            name="source",
+            field=models.CharField(
+                choices=[
+                    ("EXCEL", "Excel upload"),
+                    ("SHEETS", "Google Sheets"),
+                    ("PLAN", "Previewed plan"),
+                ],
+                max_length=10,
+            ),
+        ),
+        migrations.AddField(
+            model_name="importjob",
+            name="plan",
+            field=models.ForeignKey(
+                blank=True,
+                null=True,
+                on_delete=django.db.models.deletion.SET_NULL,
+                related_name="jobs",
+                to="tool.importplan",
+            ),
+        ),
+        migrations.CreateModel(
+            name="ImportPlanEntry",
+            fields=[
+                (
+                    "import_plan_entry_id",
+                    models.AutoField(primary_key=True, serialize=False),
+                ),
+                (
+                    "action",
+                    models.CharField(
+                        choices=[
+                            ("CREATE", "Create"),
+                            ("UPDATE", "Update"),
+                            ("DELETE", "Delete"),
+                        ],
+                        max_length=10,
+                    ),
+                ),
+                ("question_id", models.IntegerField(blank=True, null=True)),
+                ("category_id", models.IntegerField(blank=True, null=True)),
+                ("question_text", models.TextField()),
+                ("payload", models.JSONField(blank=True, default=dict)),
+                ("changes", models.JSONField(blank=True, default=dict)),
+                (
+                    "plan",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="entries",
+                        to="tool.importplan",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "import_plan_entries",
+                "indexes": [
+                    models.Index(
+                        fields=["plan", "action", "import_plan_entry_id"],
+                        name="import_plan_entries_page_idx",
+                    )
+                ],
+            },
+        ),
+    ]
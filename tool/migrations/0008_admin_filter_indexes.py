@@ -0,0 +1,38 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0007_import_plan"),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name="option",
+            index=models.Index(
+                fields=["is_correct", "-option_id"], name="options_correct_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="question",
+            index=models.Index(
+                fields=[
+                    "category",
+                    "is_product_question",
+                    "product_type",
+                    "-question_id",
+                ],
+                name="questions_filter_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="question",
+            index=models.Index(
+                fields=["product_type", "-question_id"],
+                name="questions_product_type_idx",
+            ),
+        ),
+    ]
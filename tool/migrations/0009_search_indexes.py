@@ -0,0 +1,81 @@
+from django.db import migrations, OperationalError
+
+POSTGRES_INDEXES = [
+    ("questions_text_trgm_idx", "questions", "question_text"),
+    ("options_text_trgm_idx", "options", "option_text"),
+]
+
+# External-content FTS5 tables over the text columns, kept in sync by triggers
+SQLITE_TABLES = [
+    ("questions_fts", "questions", "question_id", "question_text"),
+    ("options_fts", "options", "option_id", "option_text"),
+]
+
+
+def create_postgres_indexes(schema_editor):
+    schema_editor.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    for name, table, column in POSTGRES_INDEXES:
+        # UPPER() matches the expression Django generates for icontains
+        schema_editor.execute(
+            f"CREATE INDEX IF NOT EXISTS {name} ON {table} "
+            f"USING gin (UPPER({column}) gin_trgm_ops)"
+        )
+
+
+def create_sqlite_tables(schema_editor):
+    for fts, table, pk, column in SQLITE_TABLES:
+        try:
+            schema_editor.execute(
+                f"CREATE VIRTUAL TABLE {fts} USING fts5({column}, "
+                f"content='{table}', content_rowid='{pk}', tokenize='trigram')"
+            )
+        except OperationalError:
+            # SQLite older than 3.34 has no trigram tokenizer; search stays LIKE
+            return
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) "
+            f"VALUES ('delete', old.{pk}, old.{column}); END"
+        )
+        schema_editor.execute(
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) "
+            f"VALUES ('delete', old.{pk}, old.{column}); "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END"
+        )
+        schema_editor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+
+
+def create_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        create_postgres_indexes(schema_editor)
+    elif vendor == "sqlite":
+        create_sqlite_tables(schema_editor)
+
+
+def drop_search_indexes(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == "postgresql":
+        for name, table, column in POSTGRES_INDEXES:
+            schema_editor.execute(f"DROP INDEX IF EXISTS {name}")
+    elif vendor == "sqlite":
+        for fts, table, pk, column in SQLITE_TABLES:
+            for suffix in ("ai", "ad", "au"):
+                schema_editor.execute(f"DROP TRIGGER IF EXISTS {fts}_{suffix}")
+            schema_editor.execute(f"DROP TABLE IF EXISTS {fts}")
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0008_admin_filter_indexes"),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_indexes, drop_search_indexes),
+    ]
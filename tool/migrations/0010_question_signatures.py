@@ -0,0 +1,62 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:38
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0009_search_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QuestionSignature",
+            fields=[
+                (
+                    "question",
+                    models.OneToOneField(
+                        db_column="question_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="signature",
+                        serialize=False,
+                        to="tool.question",
+                    ),
+                ),
+                ("signature", models.BinaryField()),
+            ],
+            options={
+                "db_table": "question_signatures",
+            },
+        ),
+        migrations.CreateModel(
+            name="QuestionSignatureBand",
+            fields=[
+                (
+                    "question_signature_band_id",
+                    models.BigAutoField(primary_key=True, serialize=False),
+                ),
+                ("band", models.SmallIntegerField()),
+                ("bucket", models.BigIntegerField()),
+                (
+                    "question",
+                    models.ForeignKey(
+                        db_column="question_id",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="signature_bands",
+                        to="tool.question",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "question_signature_bands",
+                "indexes": [
+                    models.Index(
+                        fields=["bucket", "band"], name="signature_bands_bucket_idx"
+                    )
+                ],
+            },
+        ),
+    ]
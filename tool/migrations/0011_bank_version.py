@@ -0,0 +1,34 @@
+# Generated by Django 5.2.18 on 2026-10-17 02:57
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0010_question_signatures"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="BankVersion",
+            fields=[
+                (
+                    "bank_version_id",
+                    models.SmallIntegerField(
+                        default=1, primary_key=True, serialize=False
+                    ),
+                ),
+                ("version", models.BigIntegerField(default=0)),
+                ("updated_at", models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                "db_table": "bank_version",
+            },
+        ),
+        migrations.AddField(
+            model_name="importplan",
+            name="bank_version",
+            field=models.BigIntegerField(default=0),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:00
+
+from django.db import migrations, models
+
+
+def create_buckets(apps, schema_editor):
+    Question = apps.get_model("tool", "Question")
+    QuestionBucket = apps.get_model("tool", "QuestionBucket")
+    pairs = Question.objects.values_list("category_id", "product_type_id").distinct()
+    QuestionBucket.objects.bulk_create(
+        [
+            QuestionBucket(
+                category_id=category_id, product_type_id=product_type_id or 0
+            )
+            for category_id, product_type_id in pairs
+        ],
+        ignore_conflicts=True,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0011_bank_version"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="QuestionBucket",
+            fields=[
+                (
+                    "question_bucket_id",
+                    models.AutoField(primary_key=True, serialize=False),
+                ),
+                ("category_id", models.IntegerField()),
+                ("product_type_id", models.IntegerField(default=0)),
+                ("version", models.BigIntegerField(default=1)),
+            ],
+            options={
+                "db_table": "question_buckets",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("category_id", "product_type_id"),
+                        name="question_buckets_unique",
+                    )
+                ],
+            },
+        ),
+        migrations.RunPython(create_buckets, migrations.RunPython.noop),
+    ]
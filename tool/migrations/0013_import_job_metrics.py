@@ -0,0 +1,22 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:09
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0012_question_buckets"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="importjob",
+            name="metrics",
+            field=models.JSONField(
+                blank=True,
+                default=dict,
+                help_text="Wall and CPU time, queries, throughput and memory per phase",
+            ),
+        ),
+    ]
@@ -0,0 +1,63 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:11
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0013_import_job_metrics"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportRun",
+            fields=[
+                ("import_run_id", models.AutoField(primary_key=True, serialize=False)),
+                ("dry_run", models.BooleanField(default=False)),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("RUNNING", "Running"),
+                            ("SUCCEEDED", "Succeeded"),
+                            ("FAILED", "Failed"),
+                        ],
+                        default="RUNNING",
+                        max_length=10,
+                    ),
+                ),
+                ("log_file", models.CharField(blank=True, max_length=255)),
+                ("created_count", models.IntegerField(default=0)),
+                ("updated_count", models.IntegerField(default=0)),
+                ("deleted_count", models.IntegerField(default=0)),
+                ("warning_count", models.IntegerField(default=0)),
+                ("error_count", models.IntegerField(default=0)),
+                ("error", models.TextField(blank=True)),
+                ("started_at", models.DateTimeField(default=django.utils.timezone.now)),
+                ("finished_at", models.DateTimeField(blank=True, null=True)),
+                (
+                    "import_job",
+                    models.ForeignKey(
+                        blank=True,
+                        null=True,
+                        on_delete=django.db.models.deletion.SET_NULL,
+                        related_name="runs",
+                        to="tool.importjob",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "import_runs",
+                "ordering": ["-started_at"],
+                "indexes": [
+                    models.Index(
+                        fields=["status", "started_at"],
+                        name="import_runs_status_930654_idx",
+                    )
+                ],
+            },
+        ),
+    ]
@@ -0,0 +1,49 @@
+# Generated by Django 5.2.18 on 2026-10-17 03:22
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0014_import_runs"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchivedOption",
+            fields=[
+                ("option_id", models.IntegerField(primary_key=True, serialize=False)),
+                ("question_id", models.IntegerField(db_index=True)),
+                ("option_text", models.TextField()),
+                ("is_correct", models.BooleanField(default=False)),
+            ],
+            options={
+                "db_table": "archived_options",
+            },
+        ),
+        migrations.CreateModel(
+            name="ArchivedQuestion",
+            fields=[
+                ("question_id", models.IntegerField(primary_key=True, serialize=False)),
+                ("category_id", models.IntegerField()),
+                ("question_text", models.TextField()),
+                ("time_limit", models.IntegerField(default=15)),
+                ("is_product_question", models.BooleanField(default=False)),
+                ("product_type_id", models.IntegerField(blank=True, null=True)),
+                ("hint", models.TextField(blank=True, null=True)),
+                ("text_hash", models.CharField(default="", max_length=64)),
+                (
+                    "archived_at",
+                    models.DateTimeField(
+                        db_index=True, default=django.utils.timezone.now
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "archived_questions",
+                "ordering": ["-archived_at"],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def clear_signatures(apps, schema_editor):
+    # Signatures from the previous MinHash permutations never match new ones;
+    # build_dedupe_index indexes the questions again
+    apps.get_model("tool", "QuestionSignatureBand").objects.all().delete()
+    apps.get_model("tool", "QuestionSignature").objects.all().delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("tool", "0016_import_job_heartbeat"),
+    ]
+
+    operations = [
+        migrations.RunPython(clear_signatures, migrations.RunPython.noop),
+    ]
@@ -1,5 +1,6 @@
 from django.db import models
 from django.utils import timezone
+import hashlib
 import uuid
 
 # Create your models here.
@@ -45,6 +46,12 @@ class ProductType(models.Model):
         return self.name
 
 
+def question_text_hash(text):
+    # Whitespace-insensitive key used to match uploaded rows to stored questions
+    normalized = " ".join(str(text).split())
+    return hashlib.sha256(normalized.encode("utf-8")).hexdigest()
+
+
 class Question(models.Model):
     question_id = models.AutoField(primary_key=True)
     category = models.ForeignKey(
@@ -61,13 +68,41 @@ class Question(models.Model):
         blank=True,
     )
     hint = models.TextField(null=True, blank=True)
+    text_hash = models.CharField(max_length=64, editable=False, default="")
 
     class Meta:
         db_table = "questions"
+        indexes = [
+            models.Index(fields=["text_hash"], name="questions_text_hash_idx"),
+            models.Index(
+                fields=["category", "text_hash"], name="questions_cat_text_hash_idx"
+            ),
+            # Back the admin list filters, newest first like the changelist
+            models.Index(
+                fields=[
+                    "category",
+                    "is_product_question",
+                    "product_type",
+                    "-question_id",
+                ],
+                name="questions_filter_idx",
+            ),
+            models.Index(
+                fields=["product_type", "-question_id"],
+                name="questions_product_type_idx",
+            ),
+        ]
 
     def __str__(self):
         return self.question_text[:50]
 
+    def save(self, *args, **kwargs):
+        self.text_hash = question_text_hash(self.question_text)
+        update_fields = kwargs.get("update_fields")
+        if update_fields is not None and "question_text" in update_fields:
+            kwargs["update_fields"] = {*update_fields, "text_hash"}
+        super().save(*args, **kwargs)
+
 
 class Option(models.Model):
     option_id = models.AutoField(primary_key=True)
@@ -79,8 +114,359 @@ class Option(models.Model):
 
     class Meta:
         db_table = "options"
+        indexes = [
+            models.Index(
+                fields=["is_correct", "-option_id"], name="options_correct_idx"
+            )
+        ]
 
     def __str__(self):
         return (
             f"{self.option_text[:30]} - {'Correct' if self.is_correct else 'Incorrect'}"
         )
+
+
+class QuestionSignature(models.Model):
+    # MinHash signature of the normalized question text and correct answer
+    question = models.OneToOneField(
+        Question,
+        db_column="question_id",
+        on_delete=models.CASCADE,
+        primary_key=True,
+        related_name="signature",
+    )
+    signature = models.BinaryField()
+
+    class Meta:
+        db_table = "question_signatures"
+
+
+class QuestionSignatureBand(models.Model):
+    # LSH buckets of a signature; questions sharing one are near-duplicate candidates
+    question_signature_band_id = models.BigAutoField(primary_key=True)
+    question = models.ForeignKey(
+        Question,
+        db_column="question_id",
+        on_delete=models.CASCADE,
+        related_name="signature_bands",
+    )
+    band = models.SmallIntegerField()
+    bucket = models.BigIntegerField()
+
+    class Meta:
+        db_table = "question_signature_bands"
+        indexes = [
+            models.Index(fields=["bucket", "band"], name="signature_bands_bucket_idx")
+        ]
+
+
+class ArchivedQuestion(models.Model):
+    # A question removed by an import, kept with its original ID so it can be
+    # restored as it was
+    question_id = models.IntegerField(primary_key=True)
+    category_id = models.IntegerField()
+    question_text = models.TextField()
+    time_limit = models.IntegerField(default=15)
+    is_product_question = models.BooleanField(default=False)
+    product_type_id = models.IntegerField(null=True, blank=True)
+    hint = models.TextField(null=True, blank=True)
+    text_hash = models.CharField(max_length=64, default="")
+    archived_at = models.DateTimeField(default=timezone.now, db_index=True)
+
+    class Meta:
+        db_table = "archived_questions"
+        ordering = ["-archived_at"]
+
+    def __str__(self):
+        return self.question_text[:50]
+
+
+class ArchivedOption(models.Model):
+    option_id = models.IntegerField(primary_key=True)
+    question_id = models.IntegerField(db_index=True)
+    option_text = models.TextField()
+    is_correct = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = "archived_options"
+
+    def __str__(self):
+        return (
+            f"{self.option_text[:30]} - {'Correct' if self.is_correct else 'Incorrect'}"
+        )
+
+
+class BankVersion(models.Model):
+    # Single row counting changes to questions and options; readers use it to
+    # validate cached responses without looking at the questions themselves
+    bank_version_id = models.SmallIntegerField(primary_key=True, default=1)
+    version = models.BigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "bank_version"
+
+    def __str__(self):
+        return f"Bank version {self.version}"
+
+    @classmethod
+    def current(cls, lock=False):
+        # lock holds the row until the transaction ends, so no other writer can
+        # bump the version in between
+        versions = cls.objects.filter(bank_version_id=1)
+        if lock:
+            versions = versions.select_for_update()
+        return versions.values_list("version", flat=True).first() or 0
+
+    @classmethod
+    def bump(cls):
+        bumped = cls.objects.filter(bank_version_id=1).update(
+            version=models.F("version") + 1, updated_at=timezone.now()
+        )
+        if not bumped:
+            cls.objects.get_or_create(bank_version_id=1, defaults={"version": 1})
+
+
+class QuestionBucket(models.Model):
+    # Version of the question IDs in one (category, product type) bucket, bumped
+    # whenever questions enter or leave it; product_type_id 0 holds non-product
+    # questions. Samplers reload only the buckets whose version moved.
+    question_bucket_id = models.AutoField(primary_key=True)
+    category_id = models.IntegerField()
+    product_type_id = models.IntegerField(default=0)
+    version = models.BigIntegerField(default=1)
+
+    class Meta:
+        db_table = "question_buckets"
+        constraints = [
+            models.UniqueConstraint(
+                fields=["category_id", "product_type_id"],
+                name="question_buckets_unique",
+            )
+        ]
+
+    def __str__(self):
+        return f"Bucket {self.category_id}/{self.product_type_id} v{self.version}"
+
+
+class SheetFingerprint(models.Model):
+    # Hash of the normalized rows last imported into a category
+    category = models.OneToOneField(
+        Category, db_column="category_id", on_delete=models.CASCADE, primary_key=True
+    )
+    fingerprint = models.CharField(max_length=64)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "sheet_fingerprints"
+
+    def __str__(self):
+        return f"{self.category}: {self.fingerprint[:12]}"
+
+
+class SpreadsheetImportState(models.Model):
+    # What a Google spreadsheet looked like when it was last imported
+    spreadsheet_id = models.CharField(max_length=200, primary_key=True)
+    revision = models.CharField(max_length=100, blank=True)
+    tab_hashes = models.JSONField(default=dict, blank=True)
+    checked_at = models.DateTimeField(auto_now=True)
+    imported_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "spreadsheet_import_states"
+
+    def __str__(self):
+        return self.spreadsheet_id
+
+
+class ImportJob(models.Model):
+    class Source(models.TextChoices):
+        EXCEL = "EXCEL", "Excel upload"
+        SHEETS = "SHEETS", "Google Sheets"
+        PLAN = "PLAN", "Previewed plan"
+
+    class Status(models.TextChoices):
+        QUEUED = "QUEUED", "Queued"
+        RUNNING = "RUNNING", "Running"
+        SUCCEEDED = "SUCCEEDED", "Succeeded"
+        FAILED = "FAILED", "Failed"
+
+    class Phase(models.TextChoices):
+        PENDING = "PENDING", "Waiting for a worker"
+        PARSING = "PARSING", "Parsing and validating sheets"
+        LOADING = "LOADING", "Loading existing questions"
+        DIFFING = "DIFFING", "Comparing with existing questions"
+        WRITING = "WRITING", "Writing changes"
+        DONE = "DONE", "Done"
+
+    import_job_id = models.AutoField(primary_key=True)
+    source = models.CharField(max_length=10, choices=Source.choices)
+    upload = models.FileField(upload_to="imports/", null=True, blank=True)
+    sheet_url = models.URLField(max_length=500, blank=True)
+    force = models.BooleanField(
+        default=False, help_text="Re-import sheets even if they have not changed"
+    )
+    dry_run = models.BooleanField(
+        default=False, help_text="Only compute the changes for review, write nothing"
+    )
+    plan = models.ForeignKey(
+        "ImportPlan",
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="jobs",
+    )
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.QUEUED
+    )
+    phase = models.CharField(
+        max_length=10, choices=Phase.choices, default=Phase.PENDING
+    )
+    commit_chunk_size = models.PositiveIntegerField(
+        null=True,
+        blank=True,
+        help_text="Commit every N questions so an interrupted import can resume; "
+        "empty writes everything in one transaction",
+    )
+    chunks_committed = models.IntegerField(default=0)
+    checkpoint_at = models.DateTimeField(null=True, blank=True)
+    rows_processed = models.IntegerField(default=0)
+    rows_total = models.IntegerField(default=0)
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    deleted_count = models.IntegerField(default=0)
+    log_file = models.CharField(max_length=255, blank=True)
+    messages = models.JSONField(default=list, blank=True)
+    metrics = models.JSONField(
+        default=dict,
+        blank=True,
+        help_text="Wall and CPU time, queries, throughput and memory per phase",
+    )
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(default=timezone.now)
+    started_at = models.DateTimeField(null=True, blank=True)
+    heartbeat_at = models.DateTimeField(
+        null=True,
+        blank=True,
+        help_text="Last progress report of the worker running the job",
+    )
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "import_jobs"
+        ordering = ["-created_at"]
+        indexes = [models.Index(fields=["status", "created_at"])]
+
+    def __str__(self):
+        return f"Import #{self.import_job_id} ({self.get_source_display()})"
+
+    @property
+    def is_finished(self):
+        return self.status in (self.Status.SUCCEEDED, self.Status.FAILED)
+
+
+class ImportRun(models.Model):
+    # One run of process_data or apply_plan and its log file, so runs can be
+    # listed without reading the logs directory
+    class Status(models.TextChoices):
+        RUNNING = "RUNNING", "Running"
+        SUCCEEDED = "SUCCEEDED", "Succeeded"
+        FAILED = "FAILED", "Failed"
+
+    import_run_id = models.AutoField(primary_key=True)
+    import_job = models.ForeignKey(
+        ImportJob,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name="runs",
+    )
+    dry_run = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.RUNNING
+    )
+    log_file = models.CharField(max_length=255, blank=True)
+    created_count = models.IntegerField(default=0)
+    updated_count = models.IntegerField(default=0)
+    deleted_count = models.IntegerField(default=0)
+    warning_count = models.IntegerField(default=0)
+    error_count = models.IntegerField(default=0)
+    error = models.TextField(blank=True)
+    started_at = models.DateTimeField(default=timezone.now)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "import_runs"
+        ordering = ["-started_at"]
+        indexes = [models.Index(fields=["status", "started_at"])]
+
+    def __str__(self):
+        return f"Import run #{self.import_run_id}"
+
+
+class ImportPlan(models.Model):
+    # Changes computed by a dry run, applied later without re-parsing the upload
+    class Status(models.TextChoices):
+        PENDING = "PENDING", "Waiting for review"
+        APPLIED = "APPLIED", "Applied"
+
+    import_plan_id = models.AutoField(primary_key=True)
+    source = models.CharField(max_length=10, choices=ImportJob.Source.choices)
+    upload_hash = models.CharField(max_length=64, db_index=True)
+    force = models.BooleanField(default=False)
+    status = models.CharField(
+        max_length=10, choices=Status.choices, default=Status.PENDING
+    )
+    create_count = models.IntegerField(default=0)
+    update_count = models.IntegerField(default=0)
+    delete_count = models.IntegerField(default=0)
+    fingerprints = models.JSONField(default=dict, blank=True)
+    source_state = models.JSONField(null=True, blank=True)
+    messages = models.JSONField(default=list, blank=True)
+    bank_version = models.BigIntegerField(default=0)
+    created_at = models.DateTimeField(default=timezone.now)
+    applied_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "import_plans"
+        ordering = ["-created_at"]
+
+    def __str__(self):
+        return f"Plan #{self.import_plan_id} ({self.get_source_display()})"
+
+    @property
+    def is_stale(self):
+        # Any change to the bank after the preview invalidates its diff, whether
+        # from an import (including chunks of one that later failed) or the admin
+        return self.bank_version != BankVersion.current()
+
+
+class ImportPlanEntry(models.Model):
+    class Action(models.TextChoices):
+        CREATE = "CREATE", "Create"
+        UPDATE = "UPDATE", "Update"
+        DELETE = "DELETE", "Delete"
+
+    import_plan_entry_id = models.AutoField(primary_key=True)
+    plan = models.ForeignKey(
+        ImportPlan, on_delete=models.CASCADE, related_name="entries"
+    )
+    action = models.CharField(max_length=10, choices=Action.choices)
+    # Plain IDs: the rows may be gone by the time the plan is looked at
+    question_id = models.IntegerField(null=True, blank=True)
+    category_id = models.IntegerField(null=True, blank=True)
+    question_text = models.TextField()
+    payload = models.JSONField(default=dict, blank=True)
+    changes = models.JSONField(default=dict, blank=True)
+
+    class Meta:
+        db_table = "import_plan_entries"
+        indexes = [
+            models.Index(
+                fields=["plan", "action", "import_plan_entry_id"],
+                name="import_plan_entries_page_idx",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.get_action_display()}: {self.question_text[:50]}"
@@ -0,0 +1,40 @@
+from django.conf import settings
+from django.core.paginator import Paginator
+from django.db import connections
+from django.utils.functional import cached_property
+import json
+
+
+def get_estimated_count_threshold():
+    return getattr(settings, "ADMIN_ESTIMATED_COUNT_THRESHOLD", 100000)
+
+
+def estimated_row_count(queryset):
+    # Planner statistics instead of a full scan; None where no estimate exists
+    connection = connections[queryset.db]
+    if connection.vendor != "postgresql":
+        return None
+
+    if not queryset.query.where:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT reltuples::bigint FROM pg_class WHERE oid = %s::regclass",
+                [queryset.model._meta.db_table],
+            )
+            row = cursor.fetchone()
+        # reltuples is -1 for a table that has never been analyzed
+        return row[0] if row and row[0] >= 0 else None
+
+    plan = json.loads(queryset.order_by().explain(format="json"))
+    return plan[0]["Plan"]["Plan Rows"]
+
+
+class EstimatedCountPaginator(Paginator):
+    # Large result sets are counted from the estimate; small ones, where the
+    # estimate is least reliable and COUNT(*) is cheap, are counted exactly
+    @cached_property
+    def count(self):
+        estimate = estimated_row_count(self.object_list)
+        if estimate is not None and estimate >= get_estimated_count_threshold():
+            return estimate
+        return super().count
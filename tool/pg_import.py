@@ -0,0 +1,509 @@
+from django.conf import settings
+from django.db import connection, transaction
+from .archive import get_archive_deleted, remove_questions
+from .dedupe import index_question_ids, index_questions
+from .importer import (
+    bank_changed,
+    flag_near_duplicates,
+    get_batch_size,
+    get_key_scope,
+    log_sheet,
+    question_fields,
+    question_key,
+    row_options,
+    save_sheet_fingerprints,
+    sheet_product_type_ids,
+)
+from .models import ImportJob
+import io
+
+# Columns of the staging table, in COPY order. Rows of kind "R" are questions
+# to create or update; rows of kind "K" only keep matching questions from being
+# deleted (rows rejected for a missing answer, sheets matching no category).
+STAGING_COLUMNS = [
+    "row_order",
+    "kind",
+    "category_id",
+    "text_hash",
+    "question_text",
+    "is_product_question",
+    "product_type_id",
+    "time_limit",
+    "hint",
+    "correct",
+    "incorrect1",
+    "incorrect2",
+    "incorrect3",
+]
+
+CREATE_STAGING = """
+CREATE TEMPORARY TABLE import_staging (
+    row_order integer PRIMARY KEY,
+    kind char(1) NOT NULL,
+    category_id integer,
+    text_hash varchar(64) NOT NULL,
+    question_text text,
+    is_product_question boolean,
+    product_type_id integer,
+    time_limit integer,
+    hint text,
+    correct text,
+    incorrect1 text,
+    incorrect2 text,
+    incorrect3 text
+) ON COMMIT DROP
+"""
+
+
+# Temporary tables of one COPY import. ON COMMIT DROP only fires when the
+# outermost transaction commits, so copy_import() also drops them itself for
+# imports run inside a caller's transaction.
+TEMPORARY_TABLES = [
+    "import_staging",
+    "import_matches",
+    "import_deletes",
+    "import_old_options",
+    "import_new_options",
+    "import_option_changes",
+]
+
+
+def get_import_backend():
+    # "auto" reconciles imports in SQL on PostgreSQL; "python" always diffs in
+    # Python through the ORM
+    return getattr(settings, "IMPORT_BACKEND", "auto")
+
+
+def use_copy_import(dry_run=False, commit_chunk_size=None):
+    # Dry runs need the plan in Python, and chunked commits its checkpoints
+    return (
+        connection.vendor == "postgresql"
+        and get_import_backend() == "auto"
+        and not dry_run
+        and not commit_chunk_size
+    )
+
+
+def copy_value(value):
+    # COPY text format
+    if value is None:
+        return "\\N"
+    if isinstance(value, bool):
+        return "t" if value else "f"
+    return (
+        str(value)
+        .replace("\\", "\\\\")
+        .replace("\t", "\\t")
+        .replace("\n", "\\n")
+        .replace("\r", "\\r")
+    )
+
+
+def copy_rows(cursor, table, columns, rows):
+    buffer = io.StringIO()
+    for row in rows:
+        buffer.write("\t".join(copy_value(value) for value in row))
+        buffer.write("\n")
+    buffer.seek(0)
+    sql = f"COPY {table} ({', '.join(columns)}) FROM STDIN"
+    if hasattr(cursor, "copy_expert"):
+        cursor.copy_expert(sql, buffer)
+    else:
+        # psycopg 3
+        with cursor.copy(sql) as copy:
+            copy.write(buffer.getvalue())
+
+
+def iter_staging_rows(parsed, result, logger, new_rows):
+    # Same row handling as build_plan: duplicates within the upload are skipped
+    # with a warning, and only the first occurrence of a question is staged
+    product_types = sheet_product_type_ids(parsed["sheets"])
+    planned_rows = {}
+    row_order = 0
+    for sheet_name, category_id, plan, errors in parsed["sheets"]:
+        if not log_sheet(sheet_name, category_id, plan, errors, result, logger):
+            for text_hash in set(plan["text_hash"]) | set(errors["text_hash"].dropna()):
+                row_order += 1
+                yield (row_order, "K", None, text_hash) + (None,) * 9
+            continue
+
+        for text_hash in set(errors["text_hash"].dropna()):
+            row_order += 1
+            yield (row_order, "K", category_id, text_hash) + (None,) * 9
+
+        for row in plan.itertuples(index=False):
+            key = question_key(category_id, row.text_hash)
+            if key in planned_rows:
+                logger.warning(
+                    f"Sheet: {sheet_name}, Row: {row.row_num} - Duplicate question, "
+                    f"already listed at {planned_rows[key]}. Skipping"
+                )
+                continue
+            planned_rows[key] = f"sheet '{sheet_name}', row {row.row_num}"
+
+            fields = question_fields(category_id, row, product_types)
+            options = row_options(row)
+            row_order += 1
+            new_rows[row_order] = (
+                planned_rows[key],
+                {"question_text": row.question_text, "options": options},
+            )
+            yield (
+                row_order,
+                "R",
+                category_id,
+                row.text_hash,
+                row.question_text,
+                fields["is_product_question"],
+                fields["product_type_id"],
+                fields["time_limit"],
+                fields["hint"],
+                options["correct"],
+                *(options["incorrect"] + [None] * 3)[:3],
+            )
+
+
+def stage_rows(cursor, rows, batch_size):
+    cursor.execute(CREATE_STAGING)
+    staged = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= batch_size:
+            copy_rows(cursor, "import_staging", STAGING_COLUMNS, batch)
+            staged += len(batch)
+            batch = []
+    if batch:
+        copy_rows(cursor, "import_staging", STAGING_COLUMNS, batch)
+        staged += len(batch)
+    cursor.execute("ANALYZE import_staging")
+    return staged
+
+
+def match_staged_rows(cursor, scope):
+    # One row per staged question with the stored question it matches, if any,
+    # and whether its fields or options differ the way question_changes() does
+    same_category = "AND q.category_id = s.category_id" if scope == "category" else ""
+    cursor.execute(f"""
+        CREATE TEMPORARY TABLE import_matches ON COMMIT DROP AS
+        SELECT
+            s.row_order,
+            q.question_id,
+            q.question_id IS NOT NULL AND (
+                q.category_id IS DISTINCT FROM s.category_id
+                OR q.is_product_question IS DISTINCT FROM s.is_product_question
+                OR q.product_type_id IS DISTINCT FROM s.product_type_id
+                OR o.correct IS DISTINCT FROM s.correct
+                OR COALESCE(o.incorrect, '{{}}') <> ARRAY(
+                    SELECT DISTINCT text
+                    FROM unnest(ARRAY[s.incorrect1, s.incorrect2, s.incorrect3]) AS text
+                    WHERE text IS NOT NULL
+                    ORDER BY text
+                )
+            ) AS changed,
+            false AS created
+        FROM import_staging s
+        LEFT JOIN LATERAL (
+            SELECT question_id, category_id, is_product_question, product_type_id
+            FROM questions q
+            WHERE q.text_hash = s.text_hash {same_category}
+            ORDER BY q.question_id
+            LIMIT 1
+        ) q ON true
+        LEFT JOIN LATERAL (
+            SELECT
+                (array_agg(option_text ORDER BY option_id) FILTER (WHERE is_correct))[1]
+                    AS correct,
+                array_agg(DISTINCT option_text ORDER BY option_text)
+                    FILTER (WHERE NOT is_correct) AS incorrect
+            FROM options
+            WHERE question_id = q.question_id
+        ) o ON true
+        WHERE s.kind = 'R'
+        """)
+    cursor.execute("CREATE INDEX ON import_matches (question_id)")
+    cursor.execute("ANALYZE import_matches")
+
+
+def find_missing_questions(cursor, scope, skipped):
+    # Anti-join: stored questions that nothing in the upload keeps
+    same_category = "AND s.category_id = q.category_id" if scope == "category" else ""
+    if scope == "category":
+        keep_skipped = "q.category_id = ANY(%s)"
+    else:
+        keep_skipped = """EXISTS (
+            SELECT 1 FROM questions k
+            WHERE k.category_id = ANY(%s) AND k.text_hash = q.text_hash
+        )"""
+    cursor.execute(
+        f"""
+        CREATE TEMPORARY TABLE import_deletes ON COMMIT DROP AS
+        SELECT q.question_id
+        FROM questions q
+        WHERE NOT EXISTS (
+            SELECT 1 FROM import_staging s
+            WHERE s.text_hash = q.text_hash {same_category}
+        )
+        AND NOT {keep_skipped}
+        """,
+        [skipped],
+    )
+    cursor.execute("SELECT count(*) FROM import_deletes")
+    return cursor.fetchone()[0]
+
+
+def affected_buckets(cursor, condition):
+    cursor.execute(f"""
+        SELECT DISTINCT q.category_id, q.product_type_id
+        FROM questions q
+        WHERE q.question_id IN ({condition})
+        """)
+    return set(cursor.fetchall())
+
+
+def update_questions(cursor):
+    cursor.execute("""
+        UPDATE questions q
+        SET category_id = s.category_id,
+            is_product_question = s.is_product_question,
+            product_type_id = s.product_type_id,
+            time_limit = s.time_limit,
+            hint = s.hint
+        FROM import_matches m
+        JOIN import_staging s ON s.row_order = m.row_order
+        WHERE m.changed AND q.question_id = m.question_id
+        """)
+    updated = cursor.rowcount
+    diff_options(cursor)
+    return updated
+
+
+def diff_options(cursor):
+    # The SQL form of option_changes(): stored options of changed questions are
+    # paired with the wanted ones by text, correctness and occurrence, and only
+    # the leftovers are rewritten in place, deleted or inserted. Questions whose
+    # options are unchanged don't touch the options table.
+    cursor.execute("""
+        CREATE TEMPORARY TABLE import_old_options ON COMMIT DROP AS
+        SELECT
+            option_id, question_id, option_text, is_correct,
+            row_number() OVER (
+                PARTITION BY question_id, option_text, is_correct ORDER BY option_id
+            ) AS occurrence
+        FROM options
+        WHERE question_id IN (SELECT question_id FROM import_matches WHERE changed)
+        """)
+    cursor.execute("""
+        CREATE TEMPORARY TABLE import_new_options ON COMMIT DROP AS
+        SELECT
+            m.question_id, o.text, o.position = 1 AS is_correct, o.position,
+            row_number() OVER (
+                PARTITION BY m.question_id, o.text, o.position = 1 ORDER BY o.position
+            ) AS occurrence
+        FROM import_matches m
+        JOIN import_staging s ON s.row_order = m.row_order
+        CROSS JOIN LATERAL unnest(
+            ARRAY[s.correct, s.incorrect1, s.incorrect2, s.incorrect3]
+        ) WITH ORDINALITY AS o(text, position)
+        WHERE m.changed AND o.text IS NOT NULL
+        """)
+    cursor.execute("""
+        CREATE TEMPORARY TABLE import_option_changes ON COMMIT DROP AS
+        WITH old AS (
+            SELECT
+                x.option_id, x.question_id,
+                row_number() OVER (
+                    PARTITION BY x.question_id ORDER BY x.option_id
+                ) AS slot
+            FROM import_old_options x
+            WHERE NOT EXISTS (
+                SELECT 1 FROM import_new_options y
+                WHERE y.question_id = x.question_id
+                AND y.text = x.option_text
+                AND y.is_correct = x.is_correct
+                AND y.occurrence = x.occurrence
+            )
+        ), new AS (
+            SELECT
+                y.question_id, y.text, y.is_correct, y.position,
+                row_number() OVER (
+                    PARTITION BY y.question_id ORDER BY y.position
+                ) AS slot
+            FROM import_new_options y
+            WHERE NOT EXISTS (
+                SELECT 1 FROM import_old_options x
+                WHERE x.question_id = y.question_id
+                AND x.option_text = y.text
+                AND x.is_correct = y.is_correct
+                AND x.occurrence = y.occurrence
+            )
+        )
+        SELECT
+            COALESCE(old.question_id, new.question_id) AS question_id,
+            old.option_id, new.text, new.is_correct, new.position
+        FROM old
+        FULL JOIN new ON new.question_id = old.question_id AND new.slot = old.slot
+        """)
+    cursor.execute("""
+        DELETE FROM options
+        WHERE option_id IN (
+            SELECT option_id FROM import_option_changes WHERE position IS NULL
+        )
+        """)
+    cursor.execute("""
+        UPDATE options o
+        SET option_text = c.text, is_correct = c.is_correct
+        FROM import_option_changes c
+        WHERE c.option_id = o.option_id AND c.position IS NOT NULL
+        """)
+    cursor.execute("""
+        INSERT INTO options (question_id, option_text, is_correct)
+        SELECT question_id, text, is_correct
+        FROM import_option_changes
+        WHERE option_id IS NULL
+        ORDER BY question_id, position
+        """)
+
+
+def create_questions(cursor, scope):
+    same_category = "AND s.category_id = c.category_id" if scope == "category" else ""
+    cursor.execute(f"""
+        WITH created AS (
+            INSERT INTO questions (
+                category_id, question_text, time_limit, is_product_question,
+                product_type_id, hint, text_hash
+            )
+            SELECT
+                s.category_id, s.question_text, s.time_limit, s.is_product_question,
+                s.product_type_id, s.hint, s.text_hash
+            FROM import_matches m
+            JOIN import_staging s ON s.row_order = m.row_order
+            WHERE m.question_id IS NULL
+            ORDER BY s.row_order
+            RETURNING question_id, category_id, text_hash
+        )
+        UPDATE import_matches m
+        SET question_id = c.question_id, created = true
+        FROM created c
+        JOIN import_staging s ON s.kind = 'R' AND s.text_hash = c.text_hash {same_category}
+        WHERE m.row_order = s.row_order
+        """)
+    created = cursor.rowcount
+    insert_options(cursor, "m.created")
+    return created
+
+
+def insert_options(cursor, condition):
+    # Correct option first, then the incorrect ones in sheet order
+    cursor.execute(f"""
+        INSERT INTO options (question_id, option_text, is_correct)
+        SELECT m.question_id, o.text, o.position = 1
+        FROM import_matches m
+        JOIN import_staging s ON s.row_order = m.row_order
+        CROSS JOIN LATERAL unnest(
+            ARRAY[s.correct, s.incorrect1, s.incorrect2, s.incorrect3]
+        ) WITH ORDINALITY AS o(text, position)
+        WHERE {condition} AND o.text IS NOT NULL
+        ORDER BY s.row_order, o.position
+        """)
+
+
+def delete_questions(cursor):
+    return remove_questions(
+        cursor, "SELECT question_id FROM import_deletes", archive=get_archive_deleted()
+    )
+
+
+def fetch_question_ids(cursor, condition):
+    cursor.execute(f"SELECT question_id FROM import_matches m WHERE {condition}")
+    return [question_id for (question_id,) in cursor.fetchall()]
+
+
+def copy_import(parsed, result, logger, progress):
+    # Writes a parse_sheets() result by staging it with COPY and reconciling in
+    # SQL, so the bank itself is never loaded into Python. Gives the same
+    # counts as build_plan() + write_plan(), in one transaction.
+    batch_size = get_batch_size()
+    scope = get_key_scope()
+    new_rows = {}
+
+    with transaction.atomic(), connection.cursor() as cursor:
+        progress(ImportJob.Phase.LOADING, rows_total=parsed["rows"])
+        staged = stage_rows(
+            cursor, iter_staging_rows(parsed, result, logger, new_rows), batch_size
+        )
+        logger.info(f"Staged {staged} rows with COPY")
+
+        progress(ImportJob.Phase.DIFFING)
+        match_staged_rows(cursor, scope)
+        to_delete = find_missing_questions(cursor, scope, parsed["skipped"])
+        cursor.execute(
+            "SELECT row_order FROM import_matches WHERE question_id IS NULL "
+            "ORDER BY row_order"
+        )
+        # Only rows to create are kept, with their signatures for indexing
+        new_rows = {
+            row_order: new_rows[row_order] for (row_order,) in cursor.fetchall()
+        }
+        flag_near_duplicates(list(new_rows.values()), result, logger)
+        logger.info(f"{to_delete} questions are no longer in the upload")
+
+        progress(ImportJob.Phase.WRITING)
+        # Like build_plan(): skipped sheets whose category loses a question to
+        # another sheet are checked again next time
+        cursor.execute(
+            """
+            SELECT DISTINCT q.category_id
+            FROM import_matches m
+            JOIN import_staging s ON s.row_order = m.row_order
+            JOIN questions q ON q.question_id = m.question_id
+            WHERE m.changed
+            AND q.category_id <> s.category_id
+            AND q.category_id = ANY(%s)
+            """,
+            [parsed["skipped"]],
+        )
+        for (category_id,) in cursor.fetchall():
+            parsed["fingerprints"].pop(category_id, None)
+        buckets = affected_buckets(
+            cursor,
+            "SELECT question_id FROM import_matches WHERE changed "
+            "UNION ALL SELECT question_id FROM import_deletes",
+        )
+        updated = update_questions(cursor)
+        created = create_questions(cursor, scope)
+        deleted = delete_questions(cursor)
+        buckets |= affected_buckets(
+            cursor,
+            "SELECT question_id FROM import_matches WHERE changed OR created",
+        )
+        index_question_ids(fetch_question_ids(cursor, "m.changed"), batch_size)
+        cursor.execute(
+            "SELECT question_id, row_order FROM import_matches WHERE created"
+        )
+        created_rows = [
+            (question_id, new_rows[row_order][1])
+            for question_id, row_order in cursor.fetchall()
+        ]
+        index_questions(
+            [
+                (question_id, data["question_text"], data["options"]["correct"])
+                for question_id, data in created_rows
+            ],
+            batch_size,
+            [data.get("signature") for _, data in created_rows],
+        )
+
+        logger.info(
+            f"Summary: Created {created} questions, Updated {updated} questions, Deleted {deleted} questions"
+        )
+        save_sheet_fingerprints(parsed["fingerprints"])
+        if created or updated or deleted:
+            bank_changed(buckets)
+        cursor.execute(f"DROP TABLE IF EXISTS {', '.join(TEMPORARY_TABLES)}")
+
+    progress(
+        ImportJob.Phase.WRITING,
+        committed={"created": created, "updated": updated, "deleted": deleted},
+    )
+    return created, updated, deleted
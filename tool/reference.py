@@ -0,0 +1,74 @@
+from .models import Category, ProductType
+import threading
+
+# Process-wide copies of the small lookup tables. Imports resolve names to IDs
+# here instead of querying per sheet or row; tool.signals clears them on edits.
+_reference_lock = threading.Lock()
+_category_names = None
+_product_type_ids = None
+
+
+def get_category_ids():
+    # Returns {name: id} for the import categories, creating any that are missing
+    global _category_names
+
+    mapping = Category.get_category_id_mapping()
+    with _reference_lock:
+        if _category_names is None:
+            _category_names = dict(Category.objects.values_list("category_id", "name"))
+
+        missing = [
+            Category(category_id=category_id, name=name)
+            for name, category_id in mapping.items()
+            if category_id not in _category_names
+        ]
+        if missing:
+            Category.objects.bulk_create(missing, ignore_conflicts=True)
+            for category in missing:
+                _category_names[category.category_id] = category.name
+    return mapping
+
+
+def get_product_type_ids(names):
+    # Returns {name: id} for the given product type names, creating missing ones
+    global _product_type_ids
+
+    with _reference_lock:
+        if _product_type_ids is None:
+            _product_type_ids = dict(
+                ProductType.objects.values_list("name", "product_type_id")
+            )
+
+        missing = sorted(set(names) - set(_product_type_ids))
+        if missing:
+            ProductType.objects.bulk_create(
+                [ProductType(name=name, is_active=True) for name in missing],
+                ignore_conflicts=True,
+            )
+            # ignore_conflicts does not return primary keys on every backend
+            _product_type_ids.update(
+                ProductType.objects.filter(name__in=missing).values_list(
+                    "name", "product_type_id"
+                )
+            )
+        return {name: _product_type_ids[name] for name in names}
+
+
+def find_product_type_id(name):
+    # Like get_product_type_ids, but unknown names give None instead of a new row
+    global _product_type_ids
+
+    with _reference_lock:
+        if _product_type_ids is None:
+            _product_type_ids = dict(
+                ProductType.objects.values_list("name", "product_type_id")
+            )
+        return _product_type_ids.get(name)
+
+
+def reset_reference_cache(**kwargs):
+    global _category_names, _product_type_ids
+
+    with _reference_lock:
+        _category_names = None
+        _product_type_ids = None
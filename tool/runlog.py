@@ -0,0 +1,174 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.utils import timezone
+from .models import ImportRun
+from datetime import datetime, timedelta
+from logging.handlers import RotatingFileHandler
+import glob
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s - %(levelname)s - %(message)s"
+
+
+def get_import_log_dir():
+    return getattr(settings, "IMPORT_LOG_DIR", "logs")
+
+
+def get_import_log_buffer_size():
+    return getattr(settings, "IMPORT_LOG_BUFFER_SIZE", 500)
+
+
+def get_import_log_max_bytes():
+    return getattr(settings, "IMPORT_LOG_MAX_BYTES", 50 * 1024 * 1024)
+
+
+def get_import_log_backup_count():
+    return getattr(settings, "IMPORT_LOG_BACKUP_COUNT", 5)
+
+
+def get_import_log_retention_days():
+    return getattr(settings, "IMPORT_LOG_RETENTION_DAYS", 30)
+
+
+class BatchedRotatingFileHandler(RotatingFileHandler):
+    # Keeps formatted records in memory and writes them in one call per batch,
+    # instead of a write and flush per record. Errors are written straight
+    # away so a crash never loses the line explaining it.
+    def __init__(self, filename, capacity, max_bytes, backup_count):
+        super().__init__(
+            filename,
+            maxBytes=max_bytes,
+            backupCount=backup_count,
+            encoding="utf-8",
+            delay=True,
+        )
+        self.capacity = capacity
+        self.buffer = []
+        self.counts = {}
+
+    def emit(self, record):
+        self.counts[record.levelno] = self.counts.get(record.levelno, 0) + 1
+        try:
+            self.buffer.append(self.format(record) + self.terminator)
+        except Exception:
+            self.handleError(record)
+            return
+        if len(self.buffer) >= self.capacity or record.levelno >= logging.ERROR:
+            self.flush()
+
+    def flush(self):
+        self.acquire()
+        try:
+            if self.buffer:
+                data = "".join(self.buffer)
+                self.buffer = []
+                # delay=True leaves the file unopened until the first batch
+                if self.stream is None:
+                    self.stream = self._open()
+                if self.maxBytes and self.stream.tell() + len(data) >= self.maxBytes:
+                    self.doRollover()
+                    if self.stream is None:
+                        self.stream = self._open()
+                self.stream.write(data)
+            if self.stream is not None:
+                self.stream.flush()
+        finally:
+            self.release()
+
+    def close(self):
+        # FileHandler.close() only flushes an open stream, and with delay=True
+        # a run that never filled a batch has none yet
+        self.acquire()
+        try:
+            self.flush()
+        finally:
+            self.release()
+        super().close()
+
+
+@contextmanager
+def import_run(job=None, dry_run=False):
+    # Yields an ImportRun with a logger that writes only to that run's file. The
+    # logger is not registered with the logging module and its handler is closed
+    # when the run ends, so nothing accumulates in a long-lived worker. Set
+    # created_count/updated_count/deleted_count on the run before leaving.
+    log_dir = get_import_log_dir()
+    os.makedirs(log_dir, exist_ok=True)
+
+    run = ImportRun.objects.create(import_job=job, dry_run=dry_run)
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    run.log_file = os.path.join(
+        log_dir, f"data_import_{timestamp}_{run.import_run_id}.log"
+    )
+    ImportRun.objects.filter(import_run_id=run.import_run_id).update(
+        log_file=run.log_file
+    )
+
+    handler = BatchedRotatingFileHandler(
+        run.log_file,
+        get_import_log_buffer_size(),
+        get_import_log_max_bytes(),
+        get_import_log_backup_count(),
+    )
+    handler.setFormatter(logging.Formatter(LOG_FORMAT))
+    run_logger = logging.Logger(f"data_import.{run.import_run_id}", logging.INFO)
+    # Records still reach handlers configured for "data_import" in LOGGING
+    run_logger.parent = logging.getLogger("data_import")
+    run_logger.addHandler(handler)
+    run.logger = run_logger
+
+    try:
+        yield run
+    except BaseException as e:
+        run.status = ImportRun.Status.FAILED
+        run.error = str(e)
+        raise
+    else:
+        run.status = ImportRun.Status.SUCCEEDED
+    finally:
+        handler.close()
+        run_logger.removeHandler(handler)
+        ImportRun.objects.filter(import_run_id=run.import_run_id).update(
+            status=run.status,
+            error=run.error,
+            created_count=run.created_count,
+            updated_count=run.updated_count,
+            deleted_count=run.deleted_count,
+            warning_count=handler.counts.get(logging.WARNING, 0),
+            error_count=sum(
+                count
+                for levelno, count in handler.counts.items()
+                if levelno >= logging.ERROR
+            ),
+            finished_at=timezone.now(),
+        )
+        prune_import_logs()
+
+
+def prune_import_logs(retention_days=None):
+    # Removes run logs (and their rotated parts) older than the retention
+    # period, including files from before runs were recorded
+    retention_days = (
+        get_import_log_retention_days() if retention_days is None else retention_days
+    )
+    if not retention_days:
+        return 0
+    cutoff = timezone.now() - timedelta(days=retention_days)
+
+    removed = 0
+    pattern = os.path.join(get_import_log_dir(), "data_import_*.log*")
+    for path in glob.glob(pattern):
+        try:
+            if os.path.getmtime(path) < cutoff.timestamp():
+                os.remove(path)
+                removed += 1
+        except OSError as e:
+            logger.warning(f"Could not remove old import log {path}: {str(e)}")
+
+    ImportRun.objects.filter(finished_at__lt=cutoff).exclude(log_file="").update(
+        log_file=""
+    )
+    return removed
@@ -0,0 +1,91 @@
+from django.conf import settings
+from django.db.models import F
+from .models import Question, QuestionBucket
+import array
+import random
+import threading
+
+# Process-local question IDs per (category_id, product_type_id) bucket, with the
+# bucket version they were loaded at. product_type_id 0 is non-product questions.
+_sample_lock = threading.Lock()
+_buckets = {}
+
+
+def get_max_sample_size():
+    return getattr(settings, "MAX_SAMPLE_SIZE", 100)
+
+
+def bucket_key(category_id, product_type_id):
+    return (category_id, product_type_id or 0)
+
+
+def touch_question_buckets(buckets=None):
+    # Marks buckets as changed, creating rows for new ones; None marks all
+    if buckets is None:
+        QuestionBucket.objects.update(version=F("version") + 1)
+        return
+    buckets = {bucket_key(*bucket) for bucket in buckets}
+    if not buckets:
+        return
+    QuestionBucket.objects.bulk_create(
+        [
+            QuestionBucket(category_id=category_id, product_type_id=product_type_id)
+            for category_id, product_type_id in buckets
+        ],
+        ignore_conflicts=True,
+    )
+    for category_id, product_type_id in buckets:
+        QuestionBucket.objects.filter(
+            category_id=category_id, product_type_id=product_type_id
+        ).update(version=F("version") + 1)
+
+
+def load_bucket(category_id, product_type_id):
+    questions = Question.objects.filter(category_id=category_id)
+    if product_type_id:
+        questions = questions.filter(product_type_id=product_type_id)
+    else:
+        questions = questions.filter(product_type__isnull=True)
+    return array.array(
+        "q", questions.values_list("question_id", flat=True).iterator(chunk_size=10000)
+    )
+
+
+def current_buckets(category_id, product_type_id=None):
+    # One query for the versions; only buckets that changed since they were
+    # loaded by this process are read again
+    versions = QuestionBucket.objects.filter(category_id=category_id)
+    if product_type_id is not None:
+        versions = versions.filter(product_type_id=product_type_id)
+
+    buckets = []
+    for product_type, version in versions.values_list("product_type_id", "version"):
+        key = (category_id, product_type)
+        with _sample_lock:
+            cached = _buckets.get(key)
+        if cached is None or cached[0] != version:
+            cached = (version, load_bucket(category_id, product_type))
+            with _sample_lock:
+                _buckets[key] = cached
+        buckets.append(cached[1])
+    return buckets
+
+
+def sample_question_ids(category_id, count, product_type_id=None, rng=random):
+    # Without replacement, in O(count): positions are drawn from the combined
+    # length of the buckets and then mapped to the bucket they fall in
+    buckets = current_buckets(category_id, product_type_id)
+    total = sum(len(ids) for ids in buckets)
+    question_ids = []
+    for position in rng.sample(range(total), min(count, total)):
+        for ids in buckets:
+            if position < len(ids):
+                question_ids.append(ids[position])
+                break
+            position -= len(ids)
+    return question_ids
+
+
+def reset_samplers():
+    with _sample_lock:
+        _buckets.clear()
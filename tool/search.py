@@ -0,0 +1,155 @@
+from django.db import connections
+from django.db.models import Q
+from django.db.models.expressions import RawSQL
+from django.utils.text import smart_split, unescape_string_literal
+from .models import Question
+
+# Shortest term the SQLite trigram tokenizer can match; shorter terms fall back
+# to a LIKE scan
+MIN_TRIGRAM_TERM = 3
+
+# Tables created by migration 0009_search_indexes when SQLite has FTS5 trigram,
+# as (fts table, content table, rowid column, text column)
+SQLITE_SEARCH_SOURCES = [
+    ("questions_fts", "questions", "question_id", "question_text"),
+    ("options_fts", "options", "option_id", "option_text"),
+]
+SQLITE_SEARCH_TABLES = {fts for fts, _, _, _ in SQLITE_SEARCH_SOURCES}
+
+_sqlite_search_available = {}
+
+
+def sqlite_search_triggers(fts, table, pk, column):
+    # Same triggers as migration 0009 creates
+    return {
+        f"{fts}_ai": (
+            f"CREATE TRIGGER {fts}_ai AFTER INSERT ON {table} BEGIN "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END"
+        ),
+        f"{fts}_ad": (
+            f"CREATE TRIGGER {fts}_ad AFTER DELETE ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) "
+            f"VALUES ('delete', old.{pk}, old.{column}); END"
+        ),
+        f"{fts}_au": (
+            f"CREATE TRIGGER {fts}_au AFTER UPDATE OF {column} ON {table} BEGIN "
+            f"INSERT INTO {fts}({fts}, rowid, {column}) "
+            f"VALUES ('delete', old.{pk}, old.{column}); "
+            f"INSERT INTO {fts}(rowid, {column}) VALUES (new.{pk}, new.{column}); END"
+        ),
+    }
+
+
+def sqlite_search_state(connection):
+    # (FTS tables present, names of their missing sync triggers)
+    with connection.cursor() as cursor:
+        cursor.execute(
+            "SELECT type, name FROM sqlite_master WHERE type IN ('table', 'trigger')"
+        )
+        names = {(kind, name) for kind, name in cursor.fetchall()}
+    tables = all(("table", fts) in names for fts in SQLITE_SEARCH_TABLES)
+    missing = [
+        name
+        for source in SQLITE_SEARCH_SOURCES
+        for name in sqlite_search_triggers(*source)
+        if ("trigger", name) not in names
+    ]
+    return tables, missing
+
+
+def repair_sqlite_search(using):
+    # SQLite drops a table's triggers when a migration rebuilds it, leaving the
+    # FTS tables silently stale. Recreates missing triggers and rebuilds the
+    # affected index; returns the recreated trigger names.
+    connection = connections[using]
+    if connection.vendor != "sqlite":
+        return []
+    tables, missing = sqlite_search_state(connection)
+    if not tables or not missing:
+        return []
+    with connection.cursor() as cursor:
+        for source in SQLITE_SEARCH_SOURCES:
+            fts = source[0]
+            triggers = sqlite_search_triggers(*source)
+            if not set(triggers) & set(missing):
+                continue
+            for name, sql in triggers.items():
+                if name in missing:
+                    cursor.execute(sql)
+            cursor.execute(f"INSERT INTO {fts}({fts}) VALUES ('rebuild')")
+    _sqlite_search_available.pop(using, None)
+    return missing
+
+
+def get_search_backend(using):
+    # "postgresql": pg_trgm GIN indexes on UPPER(text), which back icontains.
+    # "fts5": SQLite trigram shadow tables kept in sync by triggers.
+    # None: no search index, the admin default LIKE search is used. FTS tables
+    # without all their triggers may be stale and count as no index.
+    connection = connections[using]
+    if connection.vendor == "postgresql":
+        return "postgresql"
+    if connection.vendor == "sqlite":
+        if using not in _sqlite_search_available:
+            tables, missing = sqlite_search_state(connection)
+            _sqlite_search_available[using] = tables and not missing
+        if _sqlite_search_available[using]:
+            return "fts5"
+    return None
+
+
+def search_terms(search_term):
+    terms = []
+    for bit in smart_split(search_term):
+        if bit.startswith(('"', "'")) and bit[0] == bit[-1]:
+            bit = unescape_string_literal(bit)
+        if bit:
+            terms.append(bit)
+    return terms
+
+
+def fts_match(table, term):
+    # A quoted FTS5 string is a substring match with the trigram tokenizer
+    phrase = '"' + term.replace('"', '""') + '"'
+    return RawSQL(f"SELECT rowid FROM {table} WHERE {table} MATCH %s", [phrase])
+
+
+def text_filter(field, table, pk, term, backend):
+    if backend == "fts5" and len(term) >= MIN_TRIGRAM_TERM:
+        return Q(**{f"{pk}__in": fts_match(table, term)})
+    return Q(**{f"{field}__icontains": term})
+
+
+def question_text_filter(term, backend):
+    return text_filter("question_text", "questions_fts", "question_id", term, backend)
+
+
+def option_text_filter(term, backend):
+    # Matching questions are looked up on their own index and joined by ID,
+    # rather than OR-ing a LIKE across the options/questions join
+    matching_questions = Question.objects.filter(
+        question_text_filter(term, backend)
+    ).values("question_id")
+    return text_filter("option_text", "options_fts", "option_id", term, backend) | Q(
+        question_id__in=matching_questions
+    )
+
+
+def search_queryset(queryset, search_term, term_filter):
+    # Every term has to match, as in the admin's default search. Returns None
+    # when there is no search index so the caller can fall back.
+    backend = get_search_backend(queryset.db)
+    terms = search_terms(search_term)
+    if backend is None or not terms:
+        return None
+    for term in terms:
+        queryset = queryset.filter(term_filter(term, backend))
+    return queryset
+
+
+def search_questions(queryset, search_term):
+    return search_queryset(queryset, search_term, question_text_filter)
+
+
+def search_options(queryset, search_term):
+    return search_queryset(queryset, search_term, option_text_filter)
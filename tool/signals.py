@@ -0,0 +1,23 @@
+from django.db.models.signals import post_delete, post_migrate, post_save
+from django.dispatch import receiver
+from .models import Category, ProductType
+from .reference import reset_reference_cache
+from .search import repair_sqlite_search
+import logging
+
+logger = logging.getLogger(__name__)
+
+
+@receiver([post_save, post_delete], sender=Category)
+@receiver([post_save, post_delete], sender=ProductType)
+def reference_data_changed(sender, **kwargs):
+    reset_reference_cache()
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name != "tool":
+        return
+    repaired = repair_sqlite_search(using)
+    if repaired:
+        logger.warning(f"Recreated search triggers: {', '.join(repaired)}")
@@ -0,0 +1,428 @@
+from django.conf import settings
+from .importer import get_batch_size
+from .models import BankVersion, Category, Option, ProductType, Question
+from bisect import bisect_left
+from itertools import islice
+import array
+import json
+import logging
+import mmap
+import os
+import shutil
+import struct
+import sys
+import tempfile
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# File layout: a fixed header, a table of sections, then the sections themselves,
+# each aligned to 8 bytes. Columns are little-endian arrays of one entry per
+# question (or option), and text is packed into UTF-8 blobs indexed by offset
+# columns with one extra trailing entry, so row i spans offsets[i]:offsets[i + 1].
+# Questions are ordered by category, then question ID, and the "categories"
+# section holds (category_id, first row, end row) for each category. Lookups by
+# ID bisect "sorted_question_id", whose rows are at the same index in "id_order".
+SNAPSHOT_MAGIC = b"QBSNAPSH"
+SNAPSHOT_FORMAT_VERSION = 2
+HEADER = struct.Struct("<8sIIqqqq")
+SECTION = struct.Struct("<32sqq")
+ALIGNMENT = 8
+
+FLAG_PRODUCT_QUESTION = 1
+FLAG_HAS_HINT = 2
+
+# Section name -> array typecode; blobs and the JSON metadata are raw bytes
+COLUMNS = {
+    "question_id": "i",
+    "category_id": "i",
+    "product_type_id": "i",
+    "time_limit": "i",
+    "flags": "B",
+    "text_offsets": "q",
+    "hint_offsets": "q",
+    "option_offsets": "q",
+    "id_order": "i",
+    "sorted_question_id": "i",
+    "option_id": "i",
+    "option_correct": "B",
+    "option_text_offsets": "q",
+    "categories": "q",
+}
+BLOBS = ["text", "hint", "option_text", "meta"]
+
+
+class SnapshotError(Exception):
+    pass
+
+
+def get_snapshot_path():
+    return getattr(settings, "QUESTION_SNAPSHOT_PATH", None)
+
+
+def aligned(offset):
+    return (offset + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+def build_snapshot(path=None, batch_size=None):
+    # Streams the bank category by category into columns and blob spool files,
+    # then writes the file next to the target and swaps it in, so readers that
+    # already mapped the previous snapshot keep a consistent view of it
+    path = path or get_snapshot_path()
+    if not path:
+        raise SnapshotError("QUESTION_SNAPSHOT_PATH is not set")
+    batch_size = batch_size or get_batch_size()
+    started = time.perf_counter()
+
+    # Read first: a change made while building leaves the snapshot stale, so
+    # the next refresh builds it again
+    bank_version = BankVersion.current()
+
+    columns = {name: array.array(typecode) for name, typecode in COLUMNS.items()}
+    blobs = {name: tempfile.TemporaryFile() for name in BLOBS}
+    for name in ["text_offsets", "hint_offsets", "option_offsets"]:
+        columns[name].append(0)
+    columns["option_text_offsets"].append(0)
+    sizes = {"text": 0, "hint": 0, "option_text": 0}
+
+    def pack(blob, value):
+        encoded = value.encode("utf-8")
+        blobs[blob].write(encoded)
+        sizes[blob] += len(encoded)
+        return sizes[blob]
+
+    try:
+        category_ids = (
+            Question.objects.order_by("category_id")
+            .values_list("category_id", flat=True)
+            .distinct()
+        )
+        for category_id in list(category_ids):
+            first_row = len(columns["question_id"])
+            rows = (
+                Question.objects.filter(category_id=category_id)
+                .order_by("question_id")
+                .values_list(
+                    "question_id",
+                    "product_type_id",
+                    "time_limit",
+                    "is_product_question",
+                    "question_text",
+                    "hint",
+                )
+                .iterator(chunk_size=batch_size)
+            )
+            while batch := list(islice(rows, batch_size)):
+                options = {}
+                option_rows = (
+                    Option.objects.filter(question_id__in=[row[0] for row in batch])
+                    .order_by("question_id", "option_id")
+                    .values_list(
+                        "question_id", "option_id", "option_text", "is_correct"
+                    )
+                )
+                for question_id, *option in option_rows:
+                    options.setdefault(question_id, []).append(option)
+
+                for (
+                    question_id,
+                    product_type_id,
+                    time_limit,
+                    is_product,
+                    text,
+                    hint,
+                ) in batch:
+                    columns["question_id"].append(question_id)
+                    columns["category_id"].append(category_id)
+                    columns["product_type_id"].append(product_type_id or 0)
+                    columns["time_limit"].append(time_limit)
+                    columns["flags"].append(
+                        (FLAG_PRODUCT_QUESTION if is_product else 0)
+                        | (FLAG_HAS_HINT if hint is not None else 0)
+                    )
+                    columns["text_offsets"].append(pack("text", text))
+                    columns["hint_offsets"].append(pack("hint", hint or ""))
+                    for option_id, option_text, is_correct in options.get(
+                        question_id, []
+                    ):
+                        columns["option_id"].append(option_id)
+                        columns["option_correct"].append(is_correct)
+                        columns["option_text_offsets"].append(
+                            pack("option_text", option_text)
+                        )
+                    columns["option_offsets"].append(len(columns["option_id"]))
+            columns["categories"].extend(
+                [category_id, first_row, len(columns["question_id"])]
+            )
+
+        question_ids = columns["question_id"]
+        columns["id_order"] = array.array(
+            "i", sorted(range(len(question_ids)), key=question_ids.__getitem__)
+        )
+        columns["sorted_question_id"] = array.array(
+            "i", (question_ids[row] for row in columns["id_order"])
+        )
+        if sys.byteorder == "big":
+            for column in columns.values():
+                column.byteswap()
+
+        meta = {
+            "categories": dict(Category.objects.values_list("category_id", "name")),
+            "product_types": dict(
+                ProductType.objects.values_list("product_type_id", "name")
+            ),
+        }
+        blobs["meta"].write(json.dumps(meta).encode("utf-8"))
+
+        sections = [
+            (name, column.tobytes(), None) for name, column in columns.items()
+        ] + [(name, None, blobs[name]) for name in BLOBS]
+        write_snapshot(
+            path,
+            sections,
+            bank_version,
+            len(question_ids),
+            len(columns["option_id"]),
+        )
+    finally:
+        for blob in blobs.values():
+            blob.close()
+
+    logger.info(
+        f"Built question snapshot {path} at bank version {bank_version}: "
+        f"{len(columns['question_id'])} questions, {len(columns['option_id'])} options "
+        f"in {time.perf_counter() - started:.2f}s"
+    )
+    return {
+        "path": path,
+        "bank_version": bank_version,
+        "questions": len(columns["question_id"]),
+        "options": len(columns["option_id"]),
+        "size": os.path.getsize(path),
+    }
+
+
+def write_snapshot(path, sections, bank_version, question_count, option_count):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+
+    table = []
+    offset = aligned(HEADER.size + SECTION.size * len(sections))
+    for name, data, spool in sections:
+        length = len(data) if data is not None else spool.seek(0, os.SEEK_END)
+        table.append((name, offset, length))
+        offset = aligned(offset + length)
+
+    handle, temp_path = tempfile.mkstemp(dir=directory, suffix=".tmp")
+    try:
+        with os.fdopen(handle, "wb") as output:
+            output.write(
+                HEADER.pack(
+                    SNAPSHOT_MAGIC,
+                    SNAPSHOT_FORMAT_VERSION,
+                    len(sections),
+                    bank_version,
+                    question_count,
+                    option_count,
+                    int(time.time()),
+                )
+            )
+            for name, offset, length in table:
+                output.write(SECTION.pack(name.encode("ascii"), offset, length))
+            for (name, data, spool), (_, offset, _) in zip(sections, table):
+                output.write(b"\0" * (offset - output.tell()))
+                if data is not None:
+                    output.write(data)
+                else:
+                    spool.seek(0)
+                    shutil.copyfileobj(spool, output)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+class Snapshot:
+    # Read-only view of a snapshot file. Columns and text are memoryviews over
+    # the mapped file, so nothing is read until it is touched and text is only
+    # copied when it is decoded.
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as snapshot_file:
+            stat = os.fstat(snapshot_file.fileno())
+            self.file_id = (stat.st_ino, stat.st_mtime_ns)
+            self._mmap = mmap.mmap(snapshot_file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._buffer = memoryview(self._mmap)
+        self._views = [self._buffer]
+
+        try:
+            (
+                magic,
+                format_version,
+                section_count,
+                self.bank_version,
+                self.question_count,
+                self.option_count,
+                built_at,
+            ) = HEADER.unpack_from(self._buffer)
+        except struct.error:
+            self.close()
+            raise SnapshotError(f"{path} is not a question snapshot")
+        if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+            self.close()
+            raise SnapshotError(
+                f"{path} is not a version {SNAPSHOT_FORMAT_VERSION} question snapshot"
+            )
+        self.built_at = built_at
+        if sys.byteorder != "little":
+            # Columns are read in place, so they have to be in the host's order
+            self.close()
+            raise SnapshotError("Question snapshots need a little-endian host")
+
+        sections = {}
+        for index in range(section_count):
+            name, offset, length = SECTION.unpack_from(
+                self._buffer, HEADER.size + SECTION.size * index
+            )
+            sections[name.rstrip(b"\0").decode("ascii")] = self._view(
+                self._buffer[offset : offset + length]
+            )
+        for name, typecode in COLUMNS.items():
+            setattr(self, name, self._view(sections[name].cast(typecode)))
+        for name in BLOBS:
+            setattr(self, f"{name}_blob", sections[name])
+
+        meta = json.loads(bytes(self.meta_blob))
+        self.category_names = {
+            int(category_id): name for category_id, name in meta["categories"].items()
+        }
+        self.product_type_names = {
+            int(product_type_id): name
+            for product_type_id, name in meta["product_types"].items()
+        }
+        self.category_ranges = {
+            self.categories[index]: (
+                self.categories[index + 1],
+                self.categories[index + 2],
+            )
+            for index in range(0, len(self.categories), 3)
+        }
+
+    def _view(self, view):
+        self._views.append(view)
+        return view
+
+    def close(self):
+        # Views must be released before the mapping can be closed
+        for view in reversed(self._views):
+            view.release()
+        self._views = []
+        self._mmap.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def __len__(self):
+        return self.question_count
+
+    def find(self, question_id):
+        # Row of a question by its ID, or None
+        index = bisect_left(self.sorted_question_id, question_id)
+        if (
+            index < self.question_count
+            and self.sorted_question_id[index] == question_id
+        ):
+            return self.id_order[index]
+        return None
+
+    def rows(self, category_id):
+        return range(*self.category_ranges.get(category_id, (0, 0)))
+
+    def text(self, row):
+        return self.text_blob[self.text_offsets[row] : self.text_offsets[row + 1]]
+
+    def hint(self, row):
+        if not self.flags[row] & FLAG_HAS_HINT:
+            return None
+        return self.hint_blob[self.hint_offsets[row] : self.hint_offsets[row + 1]]
+
+    def options(self, row):
+        # (option_id, text, is_correct) with the text as a memoryview
+        for index in range(self.option_offsets[row], self.option_offsets[row + 1]):
+            yield (
+                self.option_id[index],
+                self.option_text_blob[
+                    self.option_text_offsets[index] : self.option_text_offsets[
+                        index + 1
+                    ]
+                ],
+                bool(self.option_correct[index]),
+            )
+
+    def question(self, row):
+        # Decoded copy of one question, shaped like the read API's payloads
+        product_type_id = self.product_type_id[row]
+        hint = self.hint(row)
+        return {
+            "id": self.question_id[row],
+            "category": self.category_id[row],
+            "text": str(self.text(row), "utf-8"),
+            "time_limit": self.time_limit[row],
+            "is_product_question": bool(self.flags[row] & FLAG_PRODUCT_QUESTION),
+            "product_type": self.product_type_names.get(product_type_id),
+            "hint": None if hint is None else str(hint, "utf-8"),
+            "options": [
+                {"id": option_id, "text": str(text, "utf-8"), "is_correct": is_correct}
+                for option_id, text, is_correct in self.options(row)
+            ],
+        }
+
+
+_snapshot_lock = threading.Lock()
+_snapshot = None
+
+
+def get_snapshot(path=None):
+    # Process-wide reader that switches to a rebuilt file on the next call.
+    # The previous mapping is left to the garbage collector, since callers may
+    # still hold views into it.
+    global _snapshot
+    path = path or get_snapshot_path()
+    stat = os.stat(path)
+    with _snapshot_lock:
+        if (
+            _snapshot is None
+            or _snapshot.path != path
+            or _snapshot.file_id != (stat.st_ino, stat.st_mtime_ns)
+        ):
+            _snapshot = Snapshot(path)
+        return _snapshot
+
+
+def snapshot_bank_version(path):
+    try:
+        with open(path, "rb") as snapshot_file:
+            header = snapshot_file.read(HEADER.size)
+        magic, format_version, _, bank_version, *_ = HEADER.unpack(header)
+    except (OSError, struct.error):
+        return None
+    if magic != SNAPSHOT_MAGIC or format_version != SNAPSHOT_FORMAT_VERSION:
+        return None
+    return bank_version
+
+
+def refresh_snapshot():
+    # Rebuilds the configured snapshot unless it already matches the bank
+    path = get_snapshot_path()
+    if not path:
+        return None
+    if snapshot_bank_version(path) == BankVersion.current():
+        return None
+    return build_snapshot(path)
@@ -1,3 +1,858 @@
-from django.test import TestCase
+from django.contrib.auth.models import User
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.urls import reverse
+from django.utils import timezone
+from googleapiclient.http import HttpMockSequence
+from openpyxl import Workbook
+from . import dedupe, importer, pagination, search
+from .archive import restore_questions
+from .export import iter_csv, iter_export_rows, iter_jsonl, write_xlsx
+from .importer import (
+    PRODUCT_TYPES,
+    apply_plan,
+    check_google_sheet,
+    iter_prepared_sheets,
+    process_data,
+    save_google_sheet_state,
+    save_plan,
+)
+from .jobs import claim_next_job, enqueue_excel_import, resume_job, run_job
+from .metrics import ImportMetrics, current_rss
+from .models import (
+    ArchivedOption,
+    ArchivedQuestion,
+    BankVersion,
+    Category,
+    ImportJob,
+    ImportPlan,
+    Option,
+    ProductType,
+    Question,
+    SheetFingerprint,
+)
+from .reference import (
+    find_product_type_id,
+    get_category_ids,
+    get_product_type_ids,
+    reset_reference_cache,
+)
+from .runlog import import_run
+from .sampling import reset_samplers, sample_question_ids
+from .snapshot import Snapshot, build_snapshot, get_snapshot_path
+from .utils import GoogleSheetsClient, iter_excel_sheets
+from datetime import timedelta
+from unittest import mock
+from urllib.parse import parse_qs, urlparse
+import csv
+import io
+import json
+import numpy as np
+import os
+import pandas as pd
+import random
+import shutil
+import tempfile
+import time
 
-# Create your tests here.
+GAMING = "Gaming"
+SPORTS = "Sports"
+COLUMNS = ["Question", "Correct", "Incorrect1", "Incorrect2", "Incorrect3", "Product"]
+WORDS = (
+    "which what first largest famous classic released original popular record "
+    "team player city country console game album film river mountain planet "
+    "author winner title season island ocean painting language engine"
+).split()
+
+
+def question_row(category, number, product=None):
+    # Distinct enough that no two rows are near duplicates of each other
+    rng = random.Random(f"{category}-{number}")
+    words = " ".join(rng.sample(WORDS, 8))
+    answers = [f"{rng.choice(WORDS)} {number}-{choice}" for choice in range(4)]
+    return [f"{category} #{number}: {words}?", *answers, product]
+
+
+def sheet_rows(category, count):
+    return [question_row(category, number) for number in range(count)]
+
+
+def sheet(category, rows):
+    return (category, pd.DataFrame(rows, columns=COLUMNS))
+
+
+def workbook_upload(sheets):
+    workbook = Workbook(write_only=True)
+    for category, rows in sheets:
+        worksheet = workbook.create_sheet(title=category)
+        worksheet.append(COLUMNS)
+        for row in rows:
+            worksheet.append(row)
+    data = io.BytesIO()
+    workbook.save(data)
+    return SimpleUploadedFile("questions.xlsx", data.getvalue())
+
+
+def option_ids(question_id):
+    return set(
+        Option.objects.filter(question_id=question_id).values_list(
+            "option_id", flat=True
+        )
+    )
+
+
+class ImportTestCase(TestCase):
+    # Logs, uploads and snapshots go to a throwaway directory
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.temp_dir, ignore_errors=True)
+        overrides = override_settings(
+            IMPORT_LOG_DIR=os.path.join(self.temp_dir, "logs"),
+            MEDIA_ROOT=os.path.join(self.temp_dir, "media"),
+            QUESTION_SNAPSHOT_PATH=os.path.join(self.temp_dir, "questions.snapshot"),
+            QUESTIONS_API_TOKEN=None,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        reset_reference_cache()
+        self.addCleanup(reset_reference_cache)
+
+    def import_sheets(self, *sheets, **kwargs):
+        reset_reference_cache()
+        return process_data(list(sheets), **kwargs)
+
+    def question(self, category, row):
+        return Question.objects.get(
+            category_id=Category.get_category_id_mapping()[category],
+            question_text=row[0],
+        )
+
+
+class ImportTests(ImportTestCase):
+    def test_create_update_delete(self):
+        rows = sheet_rows(GAMING, 5)
+        result = self.import_sheets(sheet(GAMING, rows))
+        self.assertEqual(
+            (result["created"], result["updated"], result["deleted"]), (5, 0, 0)
+        )
+        self.assertEqual(Option.objects.count(), 20)
+
+        kept = self.question(GAMING, rows[1])
+        kept_options = option_ids(kept.question_id)
+        edited = self.question(GAMING, rows[0])
+        edited_options = option_ids(edited.question_id)
+        removed = self.question(GAMING, rows[4])
+
+        revised = [list(row) for row in rows[:4]]
+        revised[0][1] = "A new correct answer"
+        result = self.import_sheets(sheet(GAMING, revised))
+
+        self.assertEqual(
+            (result["created"], result["updated"], result["deleted"]), (0, 1, 1)
+        )
+        self.assertEqual(option_ids(kept.question_id), kept_options)
+        # The changed answer is rewritten in place
+        self.assertEqual(option_ids(edited.question_id), edited_options)
+        self.assertEqual(
+            Option.objects.get(question=edited, is_correct=True).option_text,
+            "A new correct answer",
+        )
+        self.assertFalse(Question.objects.filter(pk=removed.pk).exists())
+        self.assertFalse(Option.objects.filter(question_id=removed.pk).exists())
+
+    def test_product_change_keeps_options(self):
+        rows = sheet_rows(GAMING, 3)
+        self.import_sheets(sheet(GAMING, rows))
+        question = self.question(GAMING, rows[0])
+        options = list(
+            Option.objects.filter(question=question).values_list(
+                "option_id", "option_text", "is_correct"
+            )
+        )
+
+        revised = [list(row) for row in rows]
+        revised[0][5] = PRODUCT_TYPES[0]
+        result = self.import_sheets(sheet(GAMING, revised))
+
+        self.assertEqual(result["updated"], 1)
+        question.refresh_from_db()
+        self.assertTrue(question.is_product_question)
+        self.assertEqual(
+            list(
+                Option.objects.filter(question=question).values_list(
+                    "option_id", "option_text", "is_correct"
+                )
+            ),
+            options,
+        )
+
+    def test_unchanged_sheet_is_skipped(self):
+        rows = sheet_rows(GAMING, 3)
+        self.import_sheets(sheet(GAMING, rows))
+        result = self.import_sheets(sheet(GAMING, rows))
+
+        self.assertEqual(
+            (result["created"], result["updated"], result["deleted"]), (0, 0, 0)
+        )
+        self.assertIn("unchanged", result["messages"][0]["message"])
+
+    def test_sheet_missing_from_upload_is_imported_again(self):
+        gaming, sports = sheet_rows(GAMING, 3), sheet_rows(SPORTS, 3)
+        self.import_sheets(sheet(GAMING, gaming), sheet(SPORTS, sports))
+        result = self.import_sheets(sheet(SPORTS, sports))
+        self.assertEqual(result["deleted"], 3)
+        self.assertFalse(
+            SheetFingerprint.objects.filter(
+                category_id=Category.get_category_id_mapping()[GAMING]
+            ).exists()
+        )
+
+        result = self.import_sheets(sheet(GAMING, gaming), sheet(SPORTS, sports))
+
+        self.assertEqual(result["created"], 3)
+        self.assertEqual(Question.objects.count(), 6)
+
+    def test_duplicate_stored_question_matches_oldest(self):
+        rows = sheet_rows(GAMING, 2)
+        self.import_sheets(sheet(GAMING, rows))
+        original = self.question(GAMING, rows[0])
+        copy = Question.objects.create(
+            category_id=original.category_id, question_text=original.question_text
+        )
+
+        revised = [list(row) for row in rows]
+        revised[0][1] = "A new correct answer"
+        self.import_sheets(sheet(GAMING, revised), force=True)
+
+        self.assertEqual(
+            Option.objects.get(question=original, is_correct=True).option_text,
+            "A new correct answer",
+        )
+        self.assertFalse(Option.objects.filter(question=copy).exists())
+
+    @override_settings(IMPORT_WORKERS=2)
+    def test_import_in_transaction_parses_in_process(self):
+        # TestCase wraps every test in a transaction
+        with mock.patch.object(importer, "ProcessPoolExecutor") as executor:
+            result = self.import_sheets(sheet(GAMING, sheet_rows(GAMING, 3)))
+
+        executor.assert_not_called()
+        self.assertEqual(result["created"], 3)
+
+
+class DedupeTests(ImportTestCase):
+    def duplicate_messages(self, result):
+        return [
+            message["message"]
+            for message in result["messages"]
+            if message["message"].startswith("Possible duplicate")
+        ]
+
+    def test_near_duplicates_are_flagged(self):
+        rows = sheet_rows(GAMING, 3)
+        self.import_sheets(sheet(GAMING, rows))
+        stored = self.question(GAMING, rows[0])
+        self.assertEqual(dedupe.QuestionSignature.objects.count(), 3)
+
+        reworded = list(rows[0])
+        reworded[0] = rows[0][0].replace("?", ", really?")
+        result = self.import_sheets(
+            sheet(GAMING, [*rows, reworded, question_row(GAMING, 3)])
+        )
+
+        self.assertEqual(result["created"], 2)
+        messages = self.duplicate_messages(result)
+        self.assertEqual(len(messages), 1)
+        self.assertIn(f"question #{stored.question_id}", messages[0])
+        self.assertEqual(dedupe.QuestionSignature.objects.count(), 5)
+
+    def test_similar_rows_of_one_upload_are_flagged(self):
+        first = question_row(GAMING, 0)
+        second = list(first)
+        second[0] = first[0].replace("?", ", really?")
+        result = self.import_sheets(sheet(GAMING, [first, second]))
+
+        messages = self.duplicate_messages(result)
+        self.assertEqual(len(messages), 1)
+        self.assertIn("looks like sheet 'Gaming', row 2", messages[0])
+
+    def test_matches_are_capped_and_ordered(self):
+        signature = dedupe.minhash("Which planet is closest to the sun?", "Mercury")
+        others = [
+            dedupe.minhash("Which planet is closest to the sun?", "Mercury"),
+            dedupe.minhash("Which planet is the closest to the sun?", "Mercury"),
+            dedupe.minhash("Who painted the Mona Lisa?", "Leonardo"),
+        ]
+        scores = dedupe.similarities(signature, np.vstack(others))
+        self.assertEqual(scores[0], 1.0)
+        self.assertGreater(scores[1], 0.7)
+        self.assertLess(scores[2], 0.3)
+        self.assertEqual(
+            dedupe.top_matches(zip("abc", scores), 0.7), [("a", 1.0), ("b", scores[1])]
+        )
+
+
+@override_settings(IMPORT_ARCHIVE_DELETED=True)
+class ArchiveTests(ImportTestCase):
+    def test_removed_question_is_archived_and_restored(self):
+        rows = sheet_rows(GAMING, 3)
+        self.import_sheets(sheet(GAMING, rows))
+        removed = self.question(GAMING, rows[2])
+        options = list(
+            Option.objects.filter(question=removed).values_list(
+                "option_id", "option_text", "is_correct"
+            )
+        )
+
+        result = self.import_sheets(sheet(GAMING, rows[:2]))
+
+        self.assertEqual(result["deleted"], 1)
+        self.assertFalse(Question.objects.filter(pk=removed.pk).exists())
+        self.assertEqual(
+            ArchivedQuestion.objects.get().question_text, removed.question_text
+        )
+        self.assertEqual(ArchivedOption.objects.count(), 4)
+
+        self.assertEqual(restore_questions([removed.pk]), (1, 0))
+
+        restored = Question.objects.get(pk=removed.pk)
+        self.assertEqual(restored.question_text, removed.question_text)
+        self.assertEqual(
+            list(
+                Option.objects.filter(question=restored).values_list(
+                    "option_id", "option_text", "is_correct"
+                )
+            ),
+            options,
+        )
+        self.assertTrue(
+            dedupe.QuestionSignature.objects.filter(question=restored).exists()
+        )
+        self.assertFalse(ArchivedQuestion.objects.exists())
+        self.assertFalse(ArchivedOption.objects.exists())
+
+    def test_question_back_in_the_bank_is_not_restored(self):
+        rows = sheet_rows(GAMING, 2)
+        self.import_sheets(sheet(GAMING, rows))
+        removed = self.question(GAMING, rows[1])
+        self.import_sheets(sheet(GAMING, rows[:1]))
+        self.import_sheets(sheet(GAMING, rows))
+
+        self.assertEqual(restore_questions([removed.pk]), (0, 1))
+        self.assertTrue(ArchivedQuestion.objects.filter(pk=removed.pk).exists())
+        self.assertEqual(Question.objects.count(), 2)
+
+    @override_settings(IMPORT_ARCHIVE_DELETED=False)
+    def test_nothing_is_archived_by_default(self):
+        rows = sheet_rows(GAMING, 2)
+        self.import_sheets(sheet(GAMING, rows))
+        self.import_sheets(sheet(GAMING, rows[:1]))
+
+        self.assertEqual(Question.objects.count(), 1)
+        self.assertFalse(ArchivedQuestion.objects.exists())
+
+
+class ParallelParseTests(SimpleTestCase):
+    def test_workers_parse_sheets_in_order(self):
+        if importer.get_fork_context() is None:
+            self.skipTest("fork is not available on this platform")
+        sheets = [
+            sheet(GAMING, sheet_rows(GAMING, 3)),
+            sheet(SPORTS, sheet_rows(SPORTS, 2)),
+        ]
+
+        prepared = list(iter_prepared_sheets(sheets, {}, workers=2))
+
+        self.assertEqual([sheet["sheet_name"] for sheet in prepared], [GAMING, SPORTS])
+        self.assertEqual([len(sheet["plan"]) for sheet in prepared], [3, 2])
+
+
+class PlanTests(ImportTestCase):
+    def preview(self, *sheets):
+        result = self.import_sheets(*sheets, dry_run=True)
+        return save_plan(
+            result.pop("plan"),
+            ImportJob.Source.EXCEL,
+            "upload-hash",
+            False,
+            result["messages"],
+        )
+
+    def test_dry_run_then_apply(self):
+        plan = self.preview(sheet(GAMING, sheet_rows(GAMING, 4)))
+        self.assertEqual(plan.create_count, 4)
+        self.assertEqual(Question.objects.count(), 0)
+
+        result = apply_plan(plan)
+
+        self.assertEqual(result["created"], 4)
+        self.assertEqual(Question.objects.count(), 4)
+        plan.refresh_from_db()
+        self.assertEqual(plan.status, ImportPlan.Status.APPLIED)
+
+    def test_plan_is_applied_once(self):
+        plan = self.preview(sheet(GAMING, sheet_rows(GAMING, 4)))
+        # A second worker that passed the checks before the first one committed
+        stale_copy = ImportPlan.objects.get(pk=plan.pk)
+        apply_plan(plan)
+        stale_copy.bank_version = BankVersion.current()
+
+        with self.assertRaisesMessage(Exception, "already been applied"):
+            apply_plan(stale_copy)
+        self.assertEqual(Question.objects.count(), 4)
+
+    def test_stale_plan_is_rejected(self):
+        plan = self.preview(sheet(GAMING, sheet_rows(GAMING, 4)))
+        self.import_sheets(sheet(SPORTS, sheet_rows(SPORTS, 2)))
+
+        with self.assertRaisesMessage(Exception, "out of date"):
+            apply_plan(plan)
+        plan.refresh_from_db()
+        self.assertEqual(plan.status, ImportPlan.Status.PENDING)
+        self.assertEqual(Question.objects.count(), 2)
+
+
+class JobTests(ImportTestCase):
+    @override_settings(IMPORT_COMMIT_CHUNK_SIZE=2)
+    def test_failed_chunked_import_resumes(self):
+        rows = sheet_rows(GAMING, 5)
+        job = enqueue_excel_import(workbook_upload([(GAMING, rows)]), chunked=True)
+        upload_path = job.upload.path
+
+        create = importer.bulk_create_questions
+        calls = []
+
+        def fail_second_chunk(*args, **kwargs):
+            calls.append(1)
+            if len(calls) == 2:
+                raise Exception("Connection lost")
+            return create(*args, **kwargs)
+
+        with mock.patch.object(
+            importer, "bulk_create_questions", side_effect=fail_second_chunk
+        ):
+            self.assertFalse(run_job(claim_next_job()))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.FAILED)
+        self.assertEqual(job.created_count, 2)
+        self.assertEqual(Question.objects.count(), 2)
+        # Kept so the job can be resumed
+        self.assertTrue(os.path.exists(upload_path))
+
+        self.assertEqual(resume_job(job), 1)
+        self.assertTrue(run_job(claim_next_job()))
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, ImportJob.Status.SUCCEEDED)
+        self.assertEqual(job.created_count, 5)
+        # One chunk before the failure, two after it and the final deletes
+        self.assertEqual(job.chunks_committed, 4)
+        self.assertEqual(Question.objects.count(), 5)
+        self.assertFalse(os.path.exists(upload_path))
+
+    def test_unchunked_import_commits_no_chunks(self):
+        job = enqueue_excel_import(workbook_upload([(GAMING, sheet_rows(GAMING, 3))]))
+        self.assertTrue(run_job(claim_next_job()))
+
+        job.refresh_from_db()
+        self.assertEqual(job.created_count, 3)
+        self.assertEqual(job.chunks_committed, 0)
+
+    def test_running_job_is_not_resumed(self):
+        job = ImportJob.objects.create(
+            source=ImportJob.Source.PLAN,
+            status=ImportJob.Status.RUNNING,
+            started_at=timezone.now(),
+            heartbeat_at=timezone.now(),
+        )
+        self.assertEqual(resume_job(job), 0)
+
+        ImportJob.objects.filter(pk=job.pk).update(
+            heartbeat_at=timezone.now() - timedelta(days=1)
+        )
+        self.assertEqual(resume_job(job), 1)
+
+
+class StubSheetsClient:
+    # Serves fixed tabs and counts the calls the importer makes
+    def __init__(self, revision, values):
+        self.revision = revision
+        self.values = values
+        self.value_reads = 0
+
+    def get_revision(self, sheet_id):
+        return self.revision
+
+    def get_values(self, sheet_id):
+        self.value_reads += 1
+        return self.values
+
+
+class GoogleSheetTests(ImportTestCase):
+    url = "https://docs.google.com/spreadsheets/d/sheet-id/edit"
+
+    def test_unchanged_revision_skips_fetching_values(self):
+        values = {GAMING: [COLUMNS[:5], question_row(GAMING, 0)[:5]]}
+        client = StubSheetsClient("7", values)
+        check = check_google_sheet(self.url, client=client)
+        self.assertEqual(list(check["data"]), [GAMING])
+        save_google_sheet_state(check, imported=True)
+
+        check = check_google_sheet(self.url, client=client)
+        self.assertIsNone(check["data"])
+        self.assertEqual(client.value_reads, 1)
+
+        # A new revision with the same content is read but not imported
+        client.revision = "8"
+        check = check_google_sheet(self.url, client=client)
+        self.assertIsNone(check["data"])
+        self.assertEqual(client.value_reads, 2)
+
+        check = check_google_sheet(self.url, force=True, client=client)
+        self.assertEqual(list(check["data"]), [GAMING])
+
+    def test_client_reads_every_tab_in_one_request(self):
+        tabs = {GAMING: [COLUMNS[:5], ["Q?", "A"]], "Travel's": [COLUMNS[:5]]}
+        http = HttpMockSequence(
+            [
+                (
+                    {"status": "200"},
+                    json.dumps(
+                        {"sheets": [{"properties": {"title": name}} for name in tabs]}
+                    ),
+                ),
+                (
+                    {"status": "200"},
+                    json.dumps(
+                        {
+                            "valueRanges": [
+                                {"values": values} for values in tabs.values()
+                            ]
+                        }
+                    ),
+                ),
+            ]
+        )
+
+        self.assertEqual(GoogleSheetsClient(http=http).get_values("sheet-id"), tabs)
+        self.assertEqual(len(http.request_sequence), 2)
+        batch_get = urlparse(http.request_sequence[1][0])
+        self.assertTrue(batch_get.path.endswith("/values:batchGet"))
+        self.assertEqual(
+            parse_qs(batch_get.query)["ranges"], ["'Gaming'!A:E", "'Travel''s'!A:E"]
+        )
+
+
+class SearchTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        if search.get_search_backend(connection.alias) != "fts5":
+            self.skipTest("SQLite FTS5 trigram search is not available")
+        self.addCleanup(search._sqlite_search_available.clear)
+
+    def test_search_finds_substrings(self):
+        rows = sheet_rows(GAMING, 3)
+        self.import_sheets(sheet(GAMING, rows))
+        term = rows[1][0].split(":")[0]
+
+        found = search.search_questions(Question.objects.all(), term)
+
+        self.assertEqual(list(found), [self.question(GAMING, rows[1])])
+
+    def test_dropped_triggers_are_detected_and_repaired(self):
+        with connection.cursor() as cursor:
+            cursor.execute("DROP TRIGGER questions_fts_ai")
+        search._sqlite_search_available.clear()
+        self.assertIsNone(search.get_search_backend(connection.alias))
+
+        get_category_ids()
+        question = Question.objects.create(
+            category_id=Category.get_category_id_mapping()[GAMING],
+            question_text="Which console sold the most units?",
+        )
+        self.assertEqual(
+            search.repair_sqlite_search(connection.alias), ["questions_fts_ai"]
+        )
+
+        found = search.search_questions(Question.objects.all(), "sold the most")
+        self.assertEqual(list(found), [question])
+
+
+class ExportTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        formula = question_row(SPORTS, 0)
+        formula[0] = "=1+1 is two?"
+        self.gaming = sheet_rows(GAMING, 2) + [
+            question_row(GAMING, 2, PRODUCT_TYPES[0])
+        ]
+        self.sports = [formula, question_row(SPORTS, 1)]
+        self.import_sheets(sheet(GAMING, self.gaming), sheet(SPORTS, self.sports))
+
+    def test_xlsx_reimports_unchanged(self):
+        output = io.BytesIO()
+        write_xlsx(output)
+        output.seek(0)
+
+        result = self.import_sheets(*iter_excel_sheets(output), force=True)
+
+        self.assertEqual(
+            (result["created"], result["updated"], result["deleted"]), (0, 0, 0)
+        )
+        self.assertEqual(Question.objects.count(), 5)
+
+    def test_csv_and_jsonl_rows(self):
+        rows = list(csv.reader(io.StringIO("".join(iter_csv()))))
+        self.assertEqual(rows[0], ["Category", *COLUMNS])
+        self.assertEqual(len(rows), 6)
+        self.assertIn([GAMING, *self.gaming[2]], rows)
+
+        records = [json.loads(line) for line in iter_jsonl()]
+        self.assertEqual(len(records), 5)
+        record = next(record for record in records if record["product"])
+        self.assertEqual(record["question"], self.gaming[2][0])
+        self.assertEqual(record["correct"], self.gaming[2][1])
+        self.assertEqual(sorted(record["incorrect"]), sorted(self.gaming[2][2:5]))
+
+    def test_options_are_read_per_batch(self):
+        # Names, categories, then per category its questions and one options
+        # query for each batch of them
+        with self.assertNumQueries(7):
+            rows = list(iter_export_rows(batch_size=2))
+        self.assertEqual(len(rows), 5)
+
+
+class SamplingTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        reset_samplers()
+        self.addCleanup(reset_samplers)
+
+    def test_samples_follow_imports(self):
+        rows = sheet_rows(GAMING, 4) + [question_row(GAMING, 4, PRODUCT_TYPES[0])]
+        self.import_sheets(sheet(GAMING, rows))
+        gaming = Category.get_category_id_mapping()[GAMING]
+        product = self.question(GAMING, rows[4])
+
+        sampled = sample_question_ids(gaming, 10)
+        self.assertEqual(len(sampled), 5)
+        self.assertEqual(
+            set(sampled), set(Question.objects.values_list("pk", flat=True))
+        )
+        self.assertEqual(
+            sample_question_ids(gaming, 10, product.product_type_id), [product.pk]
+        )
+        self.assertNotIn(product.pk, sample_question_ids(gaming, 10, 0))
+        # Unchanged buckets are not read again
+        with self.assertNumQueries(1):
+            self.assertEqual(len(sample_question_ids(gaming, 3)), 3)
+
+        self.import_sheets(sheet(GAMING, rows[2:]))
+        self.assertEqual(
+            set(sample_question_ids(gaming, 10)),
+            set(Question.objects.values_list("pk", flat=True)),
+        )
+
+    def test_random_questions_endpoint(self):
+        self.import_sheets(sheet(GAMING, sheet_rows(GAMING, 5)))
+        url = reverse("tool:random-questions")
+        gaming = Category.get_category_id_mapping()[GAMING]
+
+        response = self.client.get(url, {"category": gaming, "count": 3})
+
+        self.assertEqual(response.status_code, 200)
+        results = response.json()["results"]
+        self.assertEqual(len(results), 3)
+        self.assertEqual(len({question["id"] for question in results}), 3)
+        self.assertEqual(len(results[0]["options"]), 4)
+        self.assertEqual(self.client.get(url).status_code, 400)
+
+
+class SnapshotTests(ImportTestCase):
+    def test_find_and_decode(self):
+        rows = sheet_rows(GAMING, 3) + [question_row(GAMING, 3, PRODUCT_TYPES[0])]
+        self.import_sheets(sheet(GAMING, rows), sheet(SPORTS, sheet_rows(SPORTS, 2)))
+        build_snapshot()
+
+        with Snapshot(get_snapshot_path()) as snapshot:
+            self.assertEqual(len(snapshot), 6)
+            for question in Question.objects.all():
+                row = snapshot.find(question.question_id)
+                payload = snapshot.question(row)
+                self.assertEqual(payload["id"], question.question_id)
+                self.assertEqual(payload["text"], question.question_text)
+                self.assertEqual(
+                    {option["id"] for option in payload["options"]},
+                    option_ids(question.question_id),
+                )
+            product = snapshot.question(
+                snapshot.find(self.question(GAMING, rows[3]).pk)
+            )
+            self.assertEqual(product["product_type"], PRODUCT_TYPES[0])
+            self.assertIsNone(snapshot.find(0))
+            self.assertIsNone(snapshot.find(Question.objects.order_by("-pk")[0].pk + 1))
+
+
+class QuestionApiTests(ImportTestCase):
+    def test_etag_answers_not_modified(self):
+        self.import_sheets(sheet(GAMING, sheet_rows(GAMING, 3)))
+        url = reverse("tool:question-list")
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()["results"]), 3)
+        etag = response["ETag"]
+
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 304)
+
+        response = self.client.get(f"{url}?limit=1", HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+        BankVersion.bump()
+        response = self.client.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertEqual(response.status_code, 200)
+
+
+class AdminTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "password")
+        )
+
+    def test_question_save_bumps_bank_version_once(self):
+        rows = sheet_rows(GAMING, 1)
+        self.import_sheets(sheet(GAMING, rows))
+        question = self.question(GAMING, rows[0])
+        options = list(Option.objects.filter(question=question).order_by("option_id"))
+        version = BankVersion.current()
+
+        data = {
+            "question_text": "An edited question?",
+            "category": question.category_id,
+            "time_limit": question.time_limit,
+            "product_type": "",
+            "hint": "",
+            "option_set-TOTAL_FORMS": len(options),
+            "option_set-INITIAL_FORMS": len(options),
+            "option_set-MIN_NUM_FORMS": 0,
+            "option_set-MAX_NUM_FORMS": 4,
+        }
+        for index, option in enumerate(options):
+            data.update(
+                {
+                    f"option_set-{index}-option_id": option.option_id,
+                    f"option_set-{index}-question": question.question_id,
+                    f"option_set-{index}-option_text": option.option_text,
+                    f"option_set-{index}-is_correct": "on" if option.is_correct else "",
+                }
+            )
+        response = self.client.post(
+            reverse("admin:tool_question_change", args=[question.question_id]), data
+        )
+
+        self.assertEqual(response.status_code, 302)
+        question.refresh_from_db()
+        self.assertEqual(question.question_text, "An edited question?")
+        self.assertEqual(BankVersion.current(), version + 1)
+        self.assertFalse(SheetFingerprint.objects.exists())
+
+
+class PaginatorTests(ImportTestCase):
+    def setUp(self):
+        super().setUp()
+        self.import_sheets(sheet(GAMING, sheet_rows(GAMING, 3)))
+
+    def paginator(self):
+        return pagination.EstimatedCountPaginator(
+            Question.objects.order_by("question_id"), 2
+        )
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=1000)
+    def test_large_estimate_is_used(self):
+        with mock.patch.object(pagination, "estimated_row_count", return_value=5000):
+            self.assertEqual(self.paginator().count, 5000)
+        with mock.patch.object(pagination, "estimated_row_count", return_value=999):
+            self.assertEqual(self.paginator().count, 3)
+        with mock.patch.object(pagination, "estimated_row_count", return_value=None):
+            self.assertEqual(self.paginator().count, 3)
+
+    def test_estimate_on_this_database(self):
+        estimate = pagination.estimated_row_count(
+            Question.objects.filter(
+                category_id=Category.get_category_id_mapping()[GAMING]
+            )
+        )
+        if connection.vendor == "postgresql":
+            self.assertIsInstance(estimate, int)
+        else:
+            self.assertIsNone(estimate)
+
+    @override_settings(ADMIN_ESTIMATED_COUNT_THRESHOLD=0)
+    def test_changelist_pages_with_estimate(self):
+        self.client.force_login(
+            User.objects.create_superuser("admin", "admin@example.com", "password")
+        )
+        response = self.client.get(reverse("admin:tool_question_changelist"))
+        self.assertEqual(response.status_code, 200)
+        self.assertContains(response, sheet_rows(GAMING, 1)[0][0])
+
+
+class ReferenceCacheTests(TestCase):
+    def setUp(self):
+        reset_reference_cache()
+        self.addCleanup(reset_reference_cache)
+
+    def test_lookups_are_cached_until_reference_data_changes(self):
+        get_category_ids()
+        ids = get_product_type_ids(PRODUCT_TYPES)
+        with self.assertNumQueries(0):
+            get_category_ids()
+            self.assertEqual(get_product_type_ids(PRODUCT_TYPES), ids)
+
+        ProductType.objects.filter(name=PRODUCT_TYPES[0]).delete()
+        with self.assertNumQueries(1):
+            self.assertIsNone(find_product_type_id(PRODUCT_TYPES[0]))
+
+        renamed = Category.objects.get(category_id=get_category_ids()[GAMING])
+        renamed.name = "Video games"
+        renamed.save()
+        with self.assertNumQueries(1):
+            get_category_ids()
+
+
+class ImportRunTests(ImportTestCase):
+    def test_short_run_writes_its_log(self):
+        with import_run() as run:
+            run.logger.info("First line")
+            run.logger.info("Second line")
+
+        with open(run.log_file, encoding="utf-8") as log_file:
+            lines = log_file.read().splitlines()
+        self.assertEqual(len(lines), 2)
+        self.assertIn("Second line", lines[1])
+
+
+class MetricsTests(TestCase):
+    def test_phase_peak_includes_freed_memory(self):
+        if current_rss() is None:
+            self.skipTest("RSS is not available on this platform")
+        metrics = ImportMetrics()
+        progress = metrics.track(lambda phase, **fields: None)
+
+        progress(ImportJob.Phase.PARSING)
+        spike = b"x" * (64 * 1024 * 1024)
+        time.sleep(0.1)
+        del spike
+        progress(ImportJob.Phase.WRITING)
+        summary = metrics.finish()
+
+        parsing = summary["phases"][str(ImportJob.Phase.PARSING)]
+        self.assertGreaterEqual(
+            parsing["rss_peak"] - parsing["rss_start"], 60 * 1024 * 1024
+        )
+        self.assertLess(parsing["rss_growth"], 32 * 1024 * 1024)
+        self.assertGreaterEqual(summary["rss_peak"], parsing["rss_peak"])
@@ -0,0 +1,9 @@
+from django.urls import path
+from . import views
+
+app_name = "tool"
+
+urlpatterns = [
+    path("questions/", views.question_list, name="question-list"),
+    path("questions/random/", views.random_questions, name="random-questions"),
+]
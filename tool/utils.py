@@ -2,21 +2,49 @@ from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
 from googleapiclient.discovery import build
+from googleapiclient.errors import HttpError
+from django.conf import settings
+from django.utils.module_loading import import_string
+from openpyxl import load_workbook
 import os
 import pickle
 import pandas as pd
 import logging
-from datetime import datetime
+import threading
+from functools import partial
 
-SCOPES = ["https://www.googleapis.com/auth/spreadsheets.readonly"]
+SCOPES = [
+    "https://www.googleapis.com/auth/spreadsheets.readonly",
+    "https://www.googleapis.com/auth/drive.metadata.readonly",
+]
 
+SHEET_RANGE = "A:E"
+SHEET_COLUMNS = ["Question", "Correct", "Incorrect1", "Incorrect2", "Incorrect3"]
 
-def get_google_sheets_credentials():
-    creds = None
+GOOGLE_API_ENDPOINT_SETTINGS = {
+    "sheets": "GOOGLE_SHEETS_API_ENDPOINT",
+    "drive": "GOOGLE_DRIVE_API_ENDPOINT",
+}
+
+# Process-wide Google API clients, built on first use and reused by every import
+_google_lock = threading.Lock()
+_google_credentials = None
+_google_services = {}
+
+logger = logging.getLogger(__name__)
+
+# Question, Correct, Incorrect1-3 and Product
+EXCEL_MAX_COLUMN = 6
+
+
+def get_google_sheets_credentials(creds=None):
     token_path = "token.pickle"
     credentials_path = "credentials.json"
 
-    if os.path.exists(token_path):
+    if creds and creds.valid:
+        return creds
+
+    if creds is None and os.path.exists(token_path):
         with open(token_path, "rb") as token:
             creds = pickle.load(token)
 
@@ -47,64 +75,180 @@ def extract_sheet_id_from_url(url):
     raise ValueError("Invalid Google Sheets URL")
 
 
-def read_google_sheet(sheet_url):
-    try:
-        sheet_id = extract_sheet_id_from_url(sheet_url)
-        creds = get_google_sheets_credentials()
-        service = build("sheets", "v4", credentials=creds)
-        sheet = service.spreadsheets()
-
-        # Get all sheet names
-        metadata = sheet.get(spreadsheetId=sheet_id).execute()
-        sheets = metadata.get("sheets", [])
-
-        all_data = {}
-        for sheet_metadata in sheets:
-            sheet_name = sheet_metadata["properties"]["title"]
-            result = (
-                sheet.values()
-                .get(spreadsheetId=sheet_id, range=f"{sheet_name}!A:E")
-                .execute()
-            )
-            values = result.get("values", [])
-
-            if not values:
-                continue
-
-            df = pd.DataFrame(
-                values[1:],
-                columns=[
-                    "Question",
-                    "Correct",
-                    "Incorrect1",
-                    "Incorrect2",
-                    "Incorrect3",
-                ],
+def build_google_service(api, version, http=None, credentials=None):
+    # An injected transport (e.g. httplib2.Http pointed at a local fake server,
+    # or googleapiclient.http.HttpMock) is used as-is, without credentials
+    client_options = None
+    endpoint = getattr(settings, GOOGLE_API_ENDPOINT_SETTINGS[api], None)
+    if endpoint:
+        client_options = {"api_endpoint": endpoint}
+
+    if http is not None:
+        return build(
+            api,
+            version,
+            http=http,
+            client_options=client_options,
+            cache_discovery=False,
+        )
+
+    return build(
+        api,
+        version,
+        credentials=credentials,
+        client_options=client_options,
+        cache_discovery=False,
+    )
+
+
+def get_google_service(api, version, http=None):
+    global _google_credentials
+
+    if http is not None:
+        return build_google_service(api, version, http=http)
+
+    with _google_lock:
+        if _google_credentials is None or not _google_credentials.valid:
+            # Loads token.pickle only once; afterwards just refreshes the token
+            _google_credentials = get_google_sheets_credentials(_google_credentials)
+            _google_services.clear()
+        if api not in _google_services:
+            _google_services[api] = build_google_service(
+                api, version, credentials=_google_credentials
             )
-            all_data[sheet_name] = df
+        return _google_services[api]
+
 
-        return all_data
-    except Exception as e:
-        raise Exception(f"Error reading Google Sheet: {str(e)}")
+def quote_sheet_range(sheet_name, cell_range=SHEET_RANGE):
+    escaped = sheet_name.replace("'", "''")
+    return f"'{escaped}'!{cell_range}"
 
 
-def setup_data_import_logger():
-    log_dir = "logs"
-    if not os.path.exists(log_dir):
-        os.makedirs(log_dir)
+def sheet_values_to_dataframe(values):
+    # The API drops trailing empty cells, so pad each row to the full width
+    width = len(SHEET_COLUMNS)
+    rows = [row[:width] + [None] * (width - len(row)) for row in values[1:]]
+    return pd.DataFrame(rows, columns=SHEET_COLUMNS)
 
-    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-    log_file = os.path.join(log_dir, f"data_import_{timestamp}.log")
 
-    logger = logging.getLogger("data_import")
-    logger.setLevel(logging.INFO)
+class GoogleSheetsClient:
+    # Default client; settings.GOOGLE_SHEETS_CLIENT can name a stand-in with the
+    # same two methods, e.g. one serving fixed metadata and values in tests
 
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.INFO)
+    def __init__(self, http=None):
+        self.http = http
+
+    def get_revision(self, sheet_id):
+        # Drive's file version changes on every edit; None means "unknown", in
+        # which case callers fall back to comparing the fetched content
+        try:
+            metadata = (
+                get_google_service("drive", "v3", self.http)
+                .files()
+                .get(fileId=sheet_id, fields="version,modifiedTime")
+                .execute()
+            )
+        except HttpError as e:
+            logger.warning(f"Could not read revision of spreadsheet {sheet_id}: {e}")
+            return None
+        return metadata.get("version") or metadata.get("modifiedTime")
+
+    def get_values(self, sheet_id):
+        sheet = get_google_service("sheets", "v4", self.http).spreadsheets()
+
+        # Get all sheet names
+        metadata = sheet.get(
+            spreadsheetId=sheet_id, fields="sheets.properties.title"
+        ).execute()
+        sheet_names = [
+            sheet_metadata["properties"]["title"]
+            for sheet_metadata in metadata.get("sheets", [])
+        ]
+        if not sheet_names:
+            return {}
+
+        # One request for every tab instead of one per tab
+        result = (
+            sheet.values()
+            .batchGet(
+                spreadsheetId=sheet_id,
+                ranges=[quote_sheet_range(sheet_name) for sheet_name in sheet_names],
+            )
+            .execute()
+        )
+        return {
+            sheet_name: value_range.get("values", [])
+            for sheet_name, value_range in zip(
+                sheet_names, result.get("valueRanges", [])
+            )
+        }
+
+
+def get_google_sheets_client(http=None):
+    client_class = import_string(
+        getattr(settings, "GOOGLE_SHEETS_CLIENT", "tool.utils.GoogleSheetsClient")
+    )
+    return client_class(http=http)
+
+
+def sheet_values_to_dataframes(values_by_sheet):
+    return {
+        sheet_name: sheet_values_to_dataframe(values)
+        for sheet_name, values in values_by_sheet.items()
+        if values
+    }
+
+
+def worksheet_to_dataframe(worksheet, max_col=EXCEL_MAX_COLUMN):
+    rows = worksheet.iter_rows(max_col=max_col, values_only=True)
+    header = next(rows, None)
+    if header is None:
+        return pd.DataFrame()
+
+    columns = [
+        str(name).strip() if name is not None else f"Unnamed: {position}"
+        for position, name in enumerate(header)
+    ]
+    width = len(columns)
+    df = pd.DataFrame.from_records(
+        (row[:width] + (None,) * (width - len(row)) for row in rows),
+        columns=columns,
+    )
+
+    # Drop trailing rows that only carry formatting
+    non_empty = df.notna().any(axis=1)
+    last_row = non_empty[non_empty].index.max() if non_empty.any() else -1
+    return df.iloc[: last_row + 1]
+
+
+def iter_excel_sheets(excel_file, max_col=EXCEL_MAX_COLUMN):
+    # Parses the workbook once in read-only mode and yields one sheet at a time,
+    # so only a single sheet's A-F values are held in memory
+    workbook = load_workbook(excel_file, read_only=True, data_only=True)
+    try:
+        for worksheet in workbook.worksheets:
+            yield worksheet.title, worksheet_to_dataframe(worksheet, max_col)
+    finally:
+        workbook.close()
 
-    formatter = logging.Formatter("%(asctime)s - %(levelname)s - %(message)s")
-    file_handler.setFormatter(formatter)
 
-    logger.addHandler(file_handler)
+def read_excel_sheet(excel_path, sheet_name, max_col=EXCEL_MAX_COLUMN):
+    workbook = load_workbook(excel_path, read_only=True, data_only=True)
+    try:
+        return worksheet_to_dataframe(workbook[sheet_name], max_col)
+    finally:
+        workbook.close()
+
 
-    return logger, log_file
+def excel_sheet_loaders(excel_path, max_col=EXCEL_MAX_COLUMN):
+    # (sheet_name, loader) pairs that a worker process can call to parse just
+    # its own sheet, instead of the parent parsing and pickling every sheet
+    workbook = load_workbook(excel_path, read_only=True)
+    try:
+        sheet_names = workbook.sheetnames
+    finally:
+        workbook.close()
+    return [
+        (sheet_name, partial(read_excel_sheet, excel_path, sheet_name, max_col))
+        for sheet_name in sheet_names
+    ]
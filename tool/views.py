@@ -1,3 +1,197 @@
-from django.shortcuts import render
+from django.conf import settings
+from django.http import JsonResponse
+from django.utils.cache import patch_cache_control
+from django.utils.crypto import constant_time_compare
+from django.views.decorators.http import condition, require_GET
+from .models import BankVersion, Option, Question
+from .reference import find_product_type_id
+from .sampling import get_max_sample_size, sample_question_ids
+import hashlib
 
-# Create your views here.
+QUESTION_PAGE_SIZE = 100
+MAX_QUESTION_PAGE_SIZE = 1000
+
+QUESTION_FILTERS = ("category", "product_type", "is_product", "after", "limit")
+
+
+class InvalidParameter(Exception):
+    pass
+
+
+QUESTION_VALUES = (
+    "question_id",
+    "category_id",
+    "question_text",
+    "time_limit",
+    "is_product_question",
+    "product_type__name",
+    "hint",
+)
+
+
+def question_payloads(rows):
+    # rows come from one joined values_list(*QUESTION_VALUES) query; the options
+    # of all of them are read in one more query, without model instances
+    options = {}
+    if rows:
+        option_rows = (
+            Option.objects.filter(question_id__in=[row[0] for row in rows])
+            .order_by("question_id", "option_id")
+            .values_list("question_id", "option_text", "is_correct")
+        )
+        for question_id, option_text, is_correct in option_rows:
+            options.setdefault(question_id, []).append([option_text, is_correct])
+
+    results = []
+    for question_id, category, text, time_limit, product, product_type, hint in rows:
+        question = {
+            "id": question_id,
+            "category": category,
+            "text": text,
+            "time_limit": time_limit,
+            "options": options.get(question_id, []),
+        }
+        # Keys that would be false or null are left out to keep pages small
+        if product:
+            question["product_type"] = product_type
+        if hint:
+            question["hint"] = hint
+        results.append(question)
+    return results
+
+
+def compact_json(data, status=200):
+    return JsonResponse(
+        data,
+        status=status,
+        json_dumps_params={"separators": (",", ":"), "ensure_ascii": False},
+    )
+
+
+def integer_param(request, name, default=None, minimum=0):
+    value = request.GET.get(name)
+    if value in (None, ""):
+        return default
+    try:
+        value = int(value)
+    except ValueError:
+        raise InvalidParameter(f"'{name}' must be an integer")
+    if value < minimum:
+        raise InvalidParameter(f"'{name}' must be at least {minimum}")
+    return value
+
+
+def boolean_param(request, name):
+    value = request.GET.get(name)
+    if value in (None, ""):
+        return None
+    if value.lower() in ("1", "true", "yes"):
+        return True
+    if value.lower() in ("0", "false", "no"):
+        return False
+    raise InvalidParameter(f"'{name}' must be true or false")
+
+
+def is_authorized(request):
+    token = getattr(settings, "QUESTIONS_API_TOKEN", None)
+    return not token or constant_time_compare(
+        request.headers.get("Authorization", ""), f"Bearer {token}"
+    )
+
+
+def question_list_etag(request):
+    # Any import or admin edit bumps the bank version, so one tiny query is
+    # enough to answer If-None-Match for every page and filter combination
+    if not is_authorized(request):
+        return None
+    request.bank_version = BankVersion.current()
+    params = "&".join(
+        f"{name}={request.GET.get(name, '')}" for name in QUESTION_FILTERS
+    )
+    digest = hashlib.sha256(params.encode("utf-8")).hexdigest()[:16]
+    return f"{request.bank_version}-{digest}"
+
+
+@require_GET
+@condition(etag_func=question_list_etag)
+def question_list(request):
+    # Questions with their options in question_id order. Pages are keyset
+    # paginated: pass the returned "next" value as "after" for the next page.
+    if not is_authorized(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+
+    try:
+        category_id = integer_param(request, "category")
+        is_product = boolean_param(request, "is_product")
+        after = integer_param(request, "after", default=0)
+        limit = integer_param(request, "limit", QUESTION_PAGE_SIZE, minimum=1)
+    except InvalidParameter as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    limit = min(limit, MAX_QUESTION_PAGE_SIZE)
+
+    questions = Question.objects.filter(question_id__gt=after)
+    if category_id is not None:
+        questions = questions.filter(category_id=category_id)
+    if is_product is not None:
+        questions = questions.filter(is_product_question=is_product)
+    if request.GET.get("product_type"):
+        questions = questions.filter(
+            product_type__name=request.GET["product_type"].upper()
+        )
+
+    rows = list(
+        questions.order_by("question_id").values_list(*QUESTION_VALUES)[: limit + 1]
+    )
+    has_more = len(rows) > limit
+    rows = rows[:limit]
+    results = question_payloads(rows)
+
+    response = compact_json(
+        {
+            "version": getattr(request, "bank_version", None),
+            "results": results,
+            "next": rows[-1][0] if has_more else None,
+        }
+    )
+    # Clients may keep the page but must revalidate it with the ETag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
+@require_GET
+def random_questions(request):
+    # "count" random questions of one category, optionally of one product type,
+    # drawn without replacement from this process's sampler
+    if not is_authorized(request):
+        return JsonResponse({"error": "Unauthorized"}, status=401)
+
+    try:
+        category_id = integer_param(request, "category")
+        count = integer_param(request, "count", default=10, minimum=1)
+    except InvalidParameter as e:
+        return JsonResponse({"error": str(e)}, status=400)
+    if category_id is None:
+        return JsonResponse({"error": "'category' is required"}, status=400)
+    count = min(count, get_max_sample_size())
+
+    product_type_id = None
+    if request.GET.get("product_type"):
+        product_type_id = find_product_type_id(request.GET["product_type"].upper())
+        if product_type_id is None:
+            return JsonResponse({"error": "Unknown product type"}, status=400)
+
+    question_ids = sample_question_ids(category_id, count, product_type_id)
+    rows = {
+        row[0]: row
+        for row in Question.objects.filter(question_id__in=question_ids).values_list(
+            *QUESTION_VALUES
+        )
+    }
+    # Keep the sampled order; a question deleted meanwhile is just left out
+    results = question_payloads(
+        [rows[question_id] for question_id in question_ids if question_id in rows]
+    )
+
+    response = compact_json({"results": results})
+    patch_cache_control(response, no_store=True)
+    return response